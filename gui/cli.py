@@ -6,13 +6,15 @@ import argparse
 import tqdm
 from typing import Optional
 
+import simulation
 import dataset.budgetary
 
+from core import Core
 from model import *
-from dataset import load_raw_csv
 from gui.progress import Worker, MockWorker
 from gui.estimation import Options as EstimationOpts
 from gui.estimation import DistanceScore
+from gui.power_analysis import Options as PowerAnalysisOpts
 from dataset.experimental_data import ExperimentalData
 
 logging.basicConfig(level=logging.DEBUG)
@@ -40,15 +42,13 @@ def budgetary_consistency(args):
     dsc.export(args.fname_out, '*.csv', variant, ProgressWorker())
 
 def consistency_deterministic(args):
-    rows = load_raw_csv(args.fname_in)
-    ds = ExperimentalData.from_csv('dataset', rows[1:], (0, 1, None, 2))
+    ds = ExperimentalData.load_from_csv(ProgressWorker(), args.fname_in, (0, 1, None, 2), 'dataset')
     dsm = ds.analysis_consistency_deterministic(ProgressWorker(), None)
     variant = dsm._get_export_variant(args.export_variant)
     dsm.export(args.fname_out, '*.csv', variant, MockWorker())
 
 def estimate(args):
-    rows = load_raw_csv(args.fname_in)
-    ds = ExperimentalData.from_csv('dataset', rows[1:], (0, 1, None, 2))
+    ds = ExperimentalData.load_from_csv(ProgressWorker(), args.fname_in, (0, 1, None, 2), 'dataset')
 
     AVAILABLE_MODELS = [
         preorder(strict=True, total=True),
@@ -97,6 +97,60 @@ def estimate(args):
     variant = dsm._get_export_variant(args.export_variant)
     dsm.export(args.fname_out, '*.csv', variant, MockWorker())
 
+def simulate(args):
+    alternatives = [alt.strip() for alt in args.alternatives.split(',')]
+    seed = args.seed if args.seed is not None else simulation.random_seed()
+    log.info('random seed: %d' % seed)
+
+    request = simulation.BatchRequest(
+        name='random',
+        alternatives=alternatives,
+        subjects=simulation.Generated(simulation.GenMenus(
+            generator=simulation.Binary() if args.menus == 'binary' else simulation.Exhaustive(),
+            defaults=False,
+        )),
+        gen_choices=simulation.Uniform(
+            forced_choice=args.forced_choice,
+            multiple_choice=False,
+        ),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=args.subjects,
+        seed=seed,
+    )
+
+    ds = ExperimentalData('simulated', alternatives)
+    ds.observ_count = 0
+    subjects = []
+
+    worker = ProgressWorker()
+    worker.set_work_size(args.subjects)
+    with Core() as core:
+        for response in simulation.run_batch(core, request):
+            subjects.append(response.subject_packed)
+            ds.observ_count += response.observation_count
+            worker.set_progress(len(subjects))
+
+    ds.subjects = subjects
+    ds.export(args.fname_out, '*.csv', ds._get_export_variant('Detailed'), MockWorker())
+
+def power_analysis(args):
+    ds = ExperimentalData.load_from_csv(ProgressWorker(), args.fname_in, (0, 1, None, 2), 'dataset')
+    seed = args.seed if args.seed is not None else simulation.random_seed()
+    log.info('random seed: %d' % seed)
+
+    dsp = ds.analysis_power_analysis(ProgressWorker(), PowerAnalysisOpts(
+        replications=args.replications,
+        gen_choices=simulation.Uniform(
+            forced_choice=args.forced_choice,
+            multiple_choice=False,
+        ),
+        preserve_deferrals=args.preserve_deferrals,
+        seed=seed,
+    ))
+    variant = dsp._get_export_variant(args.export_variant)
+    dsp.export(args.fname_out, '*.csv', variant, MockWorker())
+
 def main(args):
     if args.action == 'estimate':
         estimate(args)
@@ -104,6 +158,10 @@ def main(args):
         consistency_deterministic(args)
     elif args.action == 'budgetary':
         budgetary_consistency(args)
+    elif args.action == 'simulate':
+        simulate(args)
+    elif args.action == 'power':
+        power_analysis(args)
     else:
         raise Exception(f'unknown action: {args.action}')
 
@@ -139,4 +197,24 @@ if __name__ == '__main__':
         help='export variant [%(default)s]',
     )
 
+    apS = sub.add_parser('simulate', help='random subjects')
+    apS.add_argument('fname_out', metavar='output.csv')
+    apS.add_argument('-a', dest='alternatives', default='A,B,C,D,E', help='comma-separated alternatives [%(default)s]')
+    apS.add_argument('-n', dest='subjects', type=int, default=1024, help='number of subjects [%(default)s]')
+    apS.add_argument('-m', dest='menus', choices=['exhaustive', 'binary'], default='exhaustive', help='menus [%(default)s]')
+    apS.add_argument('--forced-choice', default=False, action='store_true')
+    apS.add_argument('--seed', type=int, help='random seed; the same seed gives the same subjects [random]')
+
+    apP = sub.add_parser('power', help='power analysis')
+    apP.add_argument('fname_in', metavar='input.csv')
+    apP.add_argument('fname_out', metavar='output.csv')
+    apP.add_argument('-e', dest='export_variant',
+        default='Summary',
+        help='export variant [%(default)s]',
+    )
+    apP.add_argument('-r', dest='replications', type=int, default=1000, help='number of replications [%(default)s]')
+    apP.add_argument('--forced-choice', default=False, action='store_true')
+    apP.add_argument('--preserve-deferrals', default=False, action='store_true')
+    apP.add_argument('--seed', type=int, help='random seed; the same seed gives the same results [random]')
+
     main(ap.parse_args())
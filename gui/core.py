@@ -1,13 +1,16 @@
 import io
 import os
+import contextlib
 import sys
+import queue
 import select
 import logging
 import threading
 import subprocess
 import collections
 import typing
-from typing import Sequence, Any, Type, Optional, NamedTuple, Union, BinaryIO, cast, TypeVar
+from typing import Sequence, Any, Type, Optional, NamedTuple, Union, BinaryIO, \
+    Iterable, Iterator, Generator, Generic, cast, TypeVar
 
 import model
 import platform_specific
@@ -20,6 +23,8 @@ log = logging.getLogger(__name__)
 
 Req = TypeVar('Req')
 Resp = TypeVar('Resp')
+Item = TypeVar('Item')
+T = TypeVar('T')
 
 class CoreError(Exception):
     pass
@@ -47,11 +52,16 @@ class Log(NamedTuple):
     message : str
     tag : int = 3
 
+class ItemFollows(NamedTuple):
+    item_index : int  # not `index`, which would shadow tuple.index
+    tag : int = 4
+
 Message = Union[
     Progress,
     AnswerFollows,
     Error,
     Log,
+    ItemFollows,
 ]
 
 MessageC = enumC('Message', {
@@ -59,8 +69,12 @@ MessageC = enumC('Message', {
     AnswerFollows: (),
     Error: (strC, bytesC),
     Log: (intC, strC),
+    ItemFollows: (intC,),
 })
 
+class Interrupted(CoreError):
+    pass
+
 class Failure(CoreError):
     def __init__(self, message : str, error : bytes) -> None:
         CoreError.__init__(self, message)
@@ -82,6 +96,14 @@ class StreamReader(threading.Thread):
     def get_content(self) -> bytes:
         return self.buf.getvalue()
 
+def chunks(xs : Sequence[T], chunk_count : int = 256, max_chunk_size : int = 1024) -> Iterator[list[T]]:
+    # batched requests amortise the IPC round-trip over many subjects
+    # but we still want about chunk_count chunks so that the progress bar moves;
+    # the chunk size therefore grows with the size of the dataset
+    chunk_size = max(1, min(max_chunk_size, len(xs) // chunk_count))
+    for i in range(0, len(xs), chunk_size):
+        yield list(xs[i:i+chunk_size])
+
 class Core:
     def __init__(
         self,
@@ -137,6 +159,17 @@ class Core:
         self.stderr_reader = StreamReader(self.stderr)
         self.stderr_reader.start()
 
+        # serialises writes to stdin between call_many's writer thread
+        # and shutdown(), which may be called from another thread
+        self.stdin_lock = threading.Lock()
+
+        # held while a request is being processed, including the draining
+        # of a cancelled pipeline, so that requests on a shared core don't interleave
+        self.busy = threading.Lock()
+
+        # the items of the streaming requests in progress, see cancel()
+        self.streams : list[queue.Queue[Optional[tuple[bool, Any]]]] = []
+
         log.debug('the core is running')
 
     def __enter__(self) -> 'Core':
@@ -146,30 +179,140 @@ class Core:
         self.shutdown()
 
     def call(self, name : str, codec_req : Codec[Req], codec_resp : Codec[Resp], request : Req) -> Resp:
+        with self.busy:
+            with self.stdin_lock:
+                self.send(name, codec_req, request)
+            return self.receive(codec_resp)
+
+    def call_many(
+        self,
+        name : str,
+        codec_req : Codec[Req],
+        codec_resp : Codec[Resp],
+        requests : Iterable[Req],
+        window : int = 16,
+    ) -> 'Pipeline[Resp]':
+        return Pipeline(self, name, codec_req, codec_resp, requests, window)
+
+    def call_streaming(
+        self,
+        name : str,
+        codec_req : Codec[Req],
+        codec_item : Codec[Item],
+        request : Req,
+    ) -> Generator[tuple[int, Item], None, None]:
+        # The core sends the items as they are computed, tagged with their indices,
+        # so they come in no particular order.
+        #
+        # A reader thread receives the items so that cancel() can interrupt the consumer
+        # from another thread. The rest of a cancelled or abandoned stream is drained
+        # in the background: the core stays busy until then but it does not have to be killed.
+        items : queue.Queue[Optional[tuple[bool, Any]]] = queue.Queue()  # None = no more items
+        abandoned = threading.Event()
+
+        self.busy.acquire()  # released by the reader when the stream is over
+        try:
+            with self.stdin_lock:
+                self.send(name, codec_req, request)
+        except BaseException:
+            self.busy.release()
+            raise
+
+        def read() -> None:
+            try:
+                for item in self.receive_streaming(codec_item):
+                    if not abandoned.is_set():
+                        items.put((True, item))
+            except Failure as e:
+                # the error was the final answer so the core is still in sync
+                items.put((False, e))
+            except Exception as e:
+                items.put((False, e))
+                log.debug('streaming request failed, shutting down the core')
+                self.shutdown()
+            finally:
+                items.put(None)
+                self.busy.release()
+
+        self.streams.append(items)
+        threading.Thread(target=read, daemon=True).start()
+        try:
+            while (item := items.get()) is not None:
+                ok, value = item
+                if not ok:
+                    raise value
+                yield value
+        finally:
+            abandoned.set()
+            self.streams.remove(items)
+
+    def cancel(self) -> None:
+        # stop the streaming requests in progress but keep the core;
+        # may be called from another thread
+        for items in list(self.streams):
+            items.put((False, Interrupted('streaming request cancelled')))
+
+    def send(self, name : str, codec_req : Codec[Req], request : Req) -> None:
         strC.encode(self.stdin, name)
         codec_req.encode(self.stdin, request)
         self.stdin.flush()
 
-        try:
+    def receive(self, codec_resp : Codec[Resp]) -> Resp:
+        with self.decoding():
             while True:
                 msg = MessageC.decode(self.stdout)
                 #log.debug('message received: %s' % str(msg))
 
-                if isinstance(msg, Progress):
-                    log.debug('progress: %d' % msg.position)
+                if isinstance(msg, AnswerFollows):
+                    return codec_resp.decode(self.stdout)
 
-                elif isinstance(msg, Log):
-                    level = ['DEBUG', 'INFO', 'WARN', 'ERROR'][msg.level]
-                    log.info('[%s] %s' % (level, msg.message))
+                self.handle_message(msg)
 
-                elif isinstance(msg, AnswerFollows):
-                    return codec_resp.decode(self.stdout)
+    def receive_streaming(self, codec_item : Codec[Item]) -> Iterator[tuple[int, Item]]:
+        # items followed by the final answer: the number of items
+        indices : set[int] = set()
+        while True:
+            with self.decoding():
+                msg = MessageC.decode(self.stdout)
 
-                elif isinstance(msg, Error):
-                    raise Failure(msg.message, msg.extra)
+                if isinstance(msg, ItemFollows):
+                    item = codec_item.decode(self.stdout)
+                    if msg.item_index in indices:
+                        raise MalformedResponse('duplicate item: %d' % msg.item_index)
+                    indices.add(msg.item_index)
+
+                elif isinstance(msg, AnswerFollows):
+                    count = intC.decode(self.stdout)
+                    if indices != set(range(count)):
+                        raise MalformedResponse('expected %d items, got %d' % (count, len(indices)))
+                    return
 
                 else:
-                    raise MalformedResponse('invalid response: %s' % msg)
+                    self.handle_message(msg)
+                    continue
+
+            # not within decoding(), which would misreport the consumer's exceptions
+            yield msg.item_index, item
+
+    def handle_message(self, msg : Message) -> None:
+        if isinstance(msg, Progress):
+            log.debug('progress: %d' % msg.position)
+
+        elif isinstance(msg, Log):
+            level = ['DEBUG', 'INFO', 'WARN', 'ERROR'][msg.level]
+            log.info('[%s] %s' % (level, msg.message))
+
+        elif isinstance(msg, Error):
+            raise Failure(msg.message, msg.extra)
+
+        else:
+            raise MalformedResponse('invalid response: %s' % (msg,))
+
+    @contextlib.contextmanager
+    def decoding(self) -> Iterator[None]:
+        # translates decoding errors into core errors
+        try:
+            yield
         except EOF:
             death_note = self.stderr_reader.get_content().decode('utf8')
             log.warning('core died with message: {0}'.format(death_note))
@@ -183,6 +326,16 @@ class Core:
             log.warning('core stderr: {0}'.format(stderr))
             raise
 
+    def is_alive(self) -> bool:
+        # health check before reusing the core
+        if self.core.poll() is not None:
+            return False
+
+        try:
+            return self.call('echo', strC, strC, 'ping') == 'ping'
+        except (CoreError, OSError):
+            return False
+
     def crash(self) -> None:
         self.call('crash', strC, strC, 'Crash test')
 
@@ -192,11 +345,16 @@ class Core:
     def shutdown(self) -> None:
         log.debug('core shutdown')
 
+        # don't wait forever if a writer is stuck on a full pipe
+        locked = self.stdin_lock.acquire(timeout=2)  # seconds
         try:
             strC.encode(self.stdin, 'quit')
             self.stdin.flush()
         except (OSError, BrokenPipeError):  # windows throws OSError
             log.debug('could not send quit, the core is probably dead already')
+        finally:
+            if locked:
+                self.stdin_lock.release()
 
         try:
             self.core.wait(2)  # seconds
@@ -217,3 +375,328 @@ class Core:
             log.warning("stderr reader won't quit, leaking it")
         else:
             log.debug('stderr reader joined')
+
+class Pipeline(Generic[Resp]):
+    # Pipelined version of Core.call(): a writer thread keeps up to `window` requests
+    # in flight on the core's stdin while a reader thread decodes the responses,
+    # which are iterated in order. This way, encoding in Python, the pipe transfer
+    # and the computation in the core all overlap.
+    #
+    # The threads start immediately, not on the first next(). Always close() the pipeline
+    # (or iterate it to the end); remaining responses are then drained to keep the core in sync.
+    #
+    # cancel() may be called from another thread: the consumer gets Interrupted right away
+    # while the responses still in flight are drained in the background.
+    # The core stays busy until then but it does not have to be killed.
+
+    def __init__(
+        self,
+        core : Core,
+        name : str,
+        codec_req : Codec[Req],
+        codec_resp : Codec[Resp],
+        requests : Iterable[Req],
+        window : int,
+    ) -> None:
+        self.in_flight = threading.Semaphore(window)
+        self.sent : queue.Queue[bool] = queue.Queue()  # one True per request sent, then False
+        self.results : queue.Queue[Optional[tuple[bool, Any]]] = queue.Queue()  # None = no more results
+        self.stop = threading.Event()
+        self.writer_error : list[Exception] = []
+        self.closed = False
+        self.cancelled = False
+
+        core.busy.acquire()  # released by the reader when all responses are in
+
+        def write() -> None:
+            try:
+                for request in requests:
+                    self.in_flight.acquire()
+                    if self.stop.is_set():
+                        break
+
+                    with core.stdin_lock:
+                        core.send(name, codec_req, request)
+                    self.sent.put(True)
+            except Exception as e:
+                # if the core died, the reader will find out and report it
+                self.writer_error.append(e)
+            finally:
+                self.sent.put(False)
+
+        def read() -> None:
+            while self.sent.get():
+                if self.stop.is_set():
+                    # something has gone wrong already;
+                    # just drain the responses to keep the core in sync
+                    try:
+                        core.receive(codec_resp)
+                    except Failure:
+                        pass
+                    except Exception:
+                        break  # the core is unusable anyway
+                    continue
+
+                try:
+                    self.results.put((True, core.receive(codec_resp)))
+                except Failure as e:
+                    # the core is still in sync, keep draining
+                    self.stop.set()
+                    self.results.put((False, e))
+                except Exception as e:
+                    self.stop.set()
+                    self.results.put((False, e))
+                    break
+
+            self.results.put(None)
+            core.busy.release()
+
+        self.writer = threading.Thread(target=write, daemon=True)
+        self.reader = threading.Thread(target=read, daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def __iter__(self) -> 'Pipeline[Resp]':
+        return self
+
+    def __next__(self) -> Resp:
+        if self.closed:
+            raise StopIteration
+
+        try:
+            item = self.results.get()
+            if self.cancelled:
+                raise Interrupted('request pipeline cancelled')
+
+            if item is None:
+                if self.writer_error:
+                    raise self.writer_error[0]
+                raise StopIteration
+
+            ok, value = item
+            if not ok:
+                raise value
+        except BaseException:
+            self.close()
+            raise
+
+        self.in_flight.release()
+        return cast(Resp, value)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+
+        self.stop.set()
+        self.in_flight.release()  # wake up the writer if it's waiting for the window
+
+        if not self.cancelled:
+            self.writer.join()
+            self.reader.join()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.stop.set()
+        self.in_flight.release()
+        self.results.put(None)  # wake up the consumer
+
+def pool_size(max_size : Optional[int] = None) -> int:
+    size = os.cpu_count() or 1
+    if max_size is not None:
+        # no point in starting more cores than there is work
+        size = max(1, min(size, max_size))
+    return size
+
+def shutdown_all(cores : Iterable[Core]) -> None:
+    # shut down in parallel so that stuck cores time out concurrently
+    threads = [
+        threading.Thread(target=core.shutdown, daemon=True)
+        for core in cores
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+class CorePool:
+    # Several cores working on the same stream of requests.
+    #
+    # Most analyses are independent per subject and each core is single-threaded,
+    # so we run one core process per CPU. The cores pull their requests from one shared
+    # iterator, so the requests are never copied nor held in memory all at once
+    # and faster cores get more of them. Responses come back in the order of the requests.
+    #
+    # The pool owns the cores it starts; cores passed in (e.g. by a CoreSession)
+    # are left running when the pool is done.
+
+    def __init__(self, max_size : Optional[int] = None, cores : Optional[list[Core]] = None) -> None:
+        self.owned = cores is None
+        self.cancelled = False
+        self.pipelines : list[Pipeline[Any]] = []
+        self.owner_queues : list[queue.Queue[Optional[int]]] = []
+
+        if cores is not None:
+            self.cores = cores
+            return
+
+        size = pool_size(max_size)
+        log.debug('creating a pool of %d cores' % size)
+
+        self.cores = []
+        try:
+            for _ in range(size):
+                self.cores.append(Core())
+        except Exception:
+            self.shutdown()
+            raise
+
+    def __enter__(self) -> 'CorePool':
+        return self
+
+    def __exit__(self, *_exc_info : Any) -> None:
+        if self.owned:
+            self.shutdown()
+
+    def call_many(
+        self,
+        name : str,
+        codec_req : Codec[Req],
+        codec_resp : Codec[Resp],
+        requests : Iterable[Req],
+        window : int = 16,
+    ) -> Generator[Resp, None, None]:
+        if self.cancelled:
+            raise Interrupted('core pool cancelled')
+
+        # Every core answers its requests in the order it took them,
+        # so it's enough to record which core took each request to restore the order.
+        shared = iter(requests)
+        lock = threading.Lock()
+        owners : queue.Queue[Optional[int]] = queue.Queue()  # the core of every request, then None
+
+        def take(k : int) -> Iterator[Req]:
+            while True:
+                with lock:
+                    try:
+                        request = next(shared)
+                    except StopIteration:
+                        owners.put(None)
+                        return
+                    except BaseException:
+                        owners.put(None)  # the pipeline reports the error
+                        raise
+                    owners.put(k)
+
+                yield request
+
+        streams = [
+            core.call_many(name, codec_req, codec_resp, take(k), window)
+            for k, core in enumerate(self.cores)
+        ]
+        self.pipelines.extend(streams)
+        self.owner_queues.append(owners)
+
+        try:
+            while (k := owners.get()) is not None:
+                yield next(streams[k])
+
+            if self.cancelled:
+                raise Interrupted('core pool cancelled')
+
+            # all responses are in; this raises the errors of the writers, if any
+            for stream in streams:
+                for response in stream:
+                    raise MalformedResponse('unexpected response: %s' % (response,))
+        finally:
+            self.owner_queues.remove(owners)
+            for stream in streams:
+                stream.close()
+                self.pipelines.remove(stream)
+
+    def cancel(self) -> None:
+        # stop the running requests but keep the cores
+        self.cancelled = True
+        for pipeline in list(self.pipelines):
+            pipeline.cancel()
+        for owners in list(self.owner_queues):
+            owners.put(None)  # wake up the consumer
+
+    def shutdown(self) -> None:
+        shutdown_all(self.cores)
+
+class CoreSession:
+    # Long-lived cores reused across analyses, so that we don't pay
+    # for the process startup with every request.
+    #
+    # Cores are started lazily, checked with an echo before reuse
+    # and replaced once they die. A non-persistent session starts
+    # fresh cores and shuts them down after use.
+
+    def __init__(self, persistent : bool = True) -> None:
+        self.persistent = persistent
+        self.lock = threading.Lock()
+        self.idle : list[Core] = []
+        self.closed = False
+
+    def checkout(self) -> Core:
+        with self.lock:
+            candidates, self.idle = self.idle, []
+
+        found : Optional[Core] = None
+        keep : list[Core] = []
+        for candidate in candidates:
+            if found is not None or candidate.busy.locked():
+                # still draining a cancelled pipeline, maybe next time
+                keep.append(candidate)
+            elif candidate.is_alive():
+                found = candidate
+            else:
+                log.warning('discarding a dead core')
+                candidate.shutdown()
+
+        with self.lock:
+            self.idle.extend(keep)
+
+        if found is not None:
+            return found
+
+        return Core()
+
+    def checkin(self, cores : list[Core]) -> None:
+        dead = []
+        for core in cores:
+            if self.persistent and not self.closed and core.core.poll() is None:
+                with self.lock:
+                    self.idle.append(core)
+            else:
+                dead.append(core)
+
+        shutdown_all(dead)
+
+    @contextlib.contextmanager
+    def core(self) -> Iterator[Core]:
+        core = self.checkout()
+        try:
+            yield core
+        finally:
+            self.checkin([core])
+
+    @contextlib.contextmanager
+    def pool(self, max_size : Optional[int] = None) -> Iterator[CorePool]:
+        cores : list[Core] = []
+        try:
+            for _ in range(pool_size(max_size)):
+                cores.append(self.checkout())
+
+            yield CorePool(cores=cores)
+        finally:
+            self.checkin(cores)
+
+    def close(self) -> None:
+        log.debug('closing core session')
+        with self.lock:
+            self.closed = True
+            cores, self.idle = self.idle, []
+
+        shutdown_all(cores)
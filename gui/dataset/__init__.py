@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import csv
 import logging
+import itertools
 from dataclasses import dataclass
 from typing import Sequence, Any, NamedTuple, Callable, Iterator, \
     Optional, Iterable, NewType, Union, cast, overload, TypeVar, \
@@ -16,18 +17,19 @@ import enum
 import model
 import branding
 from gui.progress import Worker, Cancelled
-from util.codec import Codec, tupleC, strC, listC, namedtupleC, frozensetC, \
-    intC, maybe, bytesC
+from util.codec import Codec, CodecError, tupleC, strC, listC, namedtupleC, \
+    frozensetC, intC, maybe, bytesC, enumC
 from util.codec_progress import CodecProgress
+from util.codec_compiler import compiled
 
 if TYPE_CHECKING:
     from gui.main_window import MainWindow
 
 log = logging.getLogger(__name__)
 
-def load_raw_csv(fname):
+def load_raw_csv(fname, max_rows : Optional[int] = None):
     with open(fname) as f:
-        return list(csv.reader(line.strip() for line in f))
+        return list(itertools.islice(csv.reader(line.strip() for line in f), max_rows))
     
 class ExportVariant(NamedTuple):
     name : str
@@ -45,7 +47,22 @@ class ShowMessageBox(NamedTuple):
     title : str
     message : str
 
-AnalysisResult = Union[None, ShowMessageBox, 'Dataset']
+class DatasetWithMessage(NamedTuple):
+    # a new dataset and something to say about it
+    dataset : 'Dataset'
+    message : ShowMessageBox
+
+AnalysisResult = Union[None, ShowMessageBox, DatasetWithMessage, 'Dataset']
+
+def show_message_box(main_win : MainWindow, msg : ShowMessageBox) -> None:
+    if msg.type is MessageBoxType.INFORMATION:
+        QMessageBox.information(main_win, msg.title, msg.message)
+    elif msg.type is MessageBoxType.WARNING:
+        QMessageBox.warning(main_win, msg.title, msg.message)
+    elif msg.type is MessageBoxType.CRITICAL:
+        QMessageBox.critical(main_win, msg.title, msg.message)
+    else:
+        raise Exception('unknown message box type: %s', msg.type)
 
 ConfigT = TypeVar('ConfigT')
 
@@ -71,6 +88,77 @@ ChoiceRowC = namedtupleC(ChoiceRow, MenuC, maybe(intC), AltSetC)
 
 PackedSubject = NewType('PackedSubject', bytes)
 PackedSubjectC = cast(Codec[PackedSubject], bytesC)
+PackedSubjectsC = listC(PackedSubjectC)
+
+# The alternatives of a packed subject, usually as references into Dataset.alternatives,
+# which we do not want to repeat in every subject. The alternative indices
+# in the choice rows of the subject are indices into this list.
+
+class AllAlternatives(NamedTuple):
+    alt_count : int  # the first `alt_count` alternatives of the dataset
+    tag : int = 0
+
+class SomeAlternatives(NamedTuple):
+    indices : list[int]  # a selection of the alternatives of the dataset
+    tag : int = 1
+
+class NamedAlternatives(NamedTuple):
+    names : list[str]  # not in the dataset
+    tag : int = 2
+
+SubjectAlternatives = Union[
+    AllAlternatives,
+    SomeAlternatives,
+    NamedAlternatives,
+]
+
+SubjectAlternativesC = enumC('SubjectAlternatives', {
+    AllAlternatives: (intC,),
+    SomeAlternatives: (listC(intC),),
+    NamedAlternatives: (listC(strC),),
+})
+
+def compact_alternatives(
+    alternatives : Sequence[str],
+    dictionary : Sequence[str],
+    dictionary_index : Optional[dict[str,int]] = None,
+) -> SubjectAlternatives:
+    # pass dictionary_index to avoid rebuilding it for every subject
+    if len(alternatives) <= len(dictionary) and all(x == y for x, y in zip(alternatives, dictionary)):
+        return AllAlternatives(len(alternatives))
+
+    if dictionary_index is None:
+        dictionary_index = {alt: i for i, alt in enumerate(dictionary)}
+
+    try:
+        return SomeAlternatives([dictionary_index[alt] for alt in alternatives])
+    except KeyError:
+        return NamedAlternatives(list(alternatives))
+
+def expand_alternatives(alternatives : SubjectAlternatives, dictionary : Sequence[str]) -> list[str]:
+    try:
+        if isinstance(alternatives, AllAlternatives):
+            if alternatives.alt_count > len(dictionary):
+                raise IndexError(alternatives.alt_count)
+            return list(dictionary[:alternatives.alt_count])
+        elif isinstance(alternatives, SomeAlternatives):
+            return [dictionary[i] for i in alternatives.indices]
+        else:
+            return alternatives.names
+    except IndexError:
+        raise CodecError('subject alternatives not in the dataset')
+
+class CompactSubject(NamedTuple):
+    name : str
+    alternatives : SubjectAlternatives
+    choices : list[ChoiceRow]
+
+# this is the format of PackedSubject
+CompactSubjectC = compiled(namedtupleC(CompactSubject, strC, SubjectAlternativesC, listC(ChoiceRowC)))
+
+# the name and alternatives at the start of a PackedSubject;
+# the choice rows that follow consist of varints only
+SubjectHeaderC = compiled(tupleC(strC, SubjectAlternativesC))
 
 class Subject(NamedTuple):
     name : str
@@ -92,17 +180,75 @@ class Subject(NamedTuple):
         else:
             return self.alternatives[index]
 
-    def pack(self) -> PackedSubject:
-        return PackedSubject(SubjectC.encode_to_memory(self))
+    def pack(self, dictionary : Sequence[str] = ()) -> PackedSubject:
+        # dictionary: the alternatives of the dataset the subject belongs to
+        return PackedSubject(CompactSubjectC.encode_to_memory(CompactSubject(
+            self.name,
+            compact_alternatives(self.alternatives, dictionary),
+            self.choices,
+        )))
 
     @staticmethod
-    def unpack(packed : PackedSubject) -> 'Subject':
-        return SubjectC.decode_from_memory(packed)
+    def unpack(packed : Union[PackedSubject, memoryview], dictionary : Sequence[str] = ()) -> 'Subject':
+        name, alternatives, choices = CompactSubjectC.decode_from_memory(packed)
+        return Subject(name, expand_alternatives(alternatives, dictionary), choices)
+
+def recompact_subject(packed : PackedSubject, dictionary : Sequence[str], dictionary_index : dict[str,int]) -> PackedSubject:
+    # re-encode the alternatives of a subject packed with another dictionary (or none);
+    # the choice rows are copied as they are
+    (name, alternatives), pos = SubjectHeaderC.decode_buf(memoryview(packed))
+    if not isinstance(alternatives, NamedAlternatives):
+        return packed
+
+    return PackedSubject(SubjectHeaderC.encode_to_memory((
+        name,
+        compact_alternatives(alternatives.names, dictionary, dictionary_index),
+    )) + packed[pos:])
+
+# the name and alternatives at the start of a subject
+# saved in workspace format 18 or older
+LegacySubjectHeaderC = compiled(tupleC(strC, listC(strC)))
+
+def compact_legacy_subject(packed : Union[PackedSubject, memoryview], dictionary : Sequence[str], dictionary_index : dict[str,int]) -> PackedSubject:
+    # legacy subjects spell out their alternatives;
+    # the choice rows are copied as they are
+    (name, alternatives), pos = LegacySubjectHeaderC.decode_buf(memoryview(packed))
+    return PackedSubject(SubjectHeaderC.encode_to_memory((
+        name,
+        compact_alternatives(alternatives, dictionary, dictionary_index),
+    )) + packed[pos:])
+
+def subject_name(packed : Union[PackedSubject, memoryview]) -> str:
+    name : str
+    (name, _alternatives), _pos = SubjectHeaderC.decode_buf(memoryview(packed))
+    return name
 
-SubjectC = namedtupleC(Subject, strC, listC(strC), listC(ChoiceRowC))
+def rename_subject(packed : PackedSubject, name : str) -> PackedSubject:
+    # the choice rows are copied as they are
+    (_name, alternatives), pos = SubjectHeaderC.decode_buf(memoryview(packed))
+    return PackedSubject(SubjectHeaderC.encode_to_memory((name, alternatives)) + packed[pos:])
 
 DatasetHeaderC = tupleC(strC, listC(strC))
 
+# Excel can't have more rows in a sheet, including the header
+XLSX_MAX_ROWS = 1048576
+
+# the number of rows that the XLSX column widths are computed from
+XLSX_WIDTH_SAMPLE = 1000
+
+def xlsx_column_widths(column_names : Sequence[str], rows : Iterable[tuple]) -> list[int]:
+    # who knows what the units are but it approximately fits
+    # furthermore, we fudge the numbers by 1 unit because that looks better
+    lengths = [len(str(name or '')) for name in column_names]
+    for row in rows:
+        if len(row) > len(lengths):
+            lengths.extend([0] * (len(row) - len(lengths)))
+
+        for i, value in enumerate(row):
+            lengths[i] = max(lengths[i], len(str(value or '')))
+
+    return [max(4, length + 1) for length in lengths]
+
 T = TypeVar("T")
 
 class Dataset:
@@ -124,7 +270,7 @@ class Dataset:
     def label_alts(self):
         return str(len(self.alternatives))
 
-    def dlg_view(self, _flag=None):
+    def dlg_view(self, _flag=None, core_session : Optional[core.CoreSession] = None):
         dlg = self.ViewDialog(self)
         dlg.exec_()
 
@@ -150,10 +296,14 @@ class Dataset:
             def work(self):
                 return analysis.run(self, config)
 
+        worker = MyWorker()
+        worker.core_session = main_win.core_session
+        worker.result_cache = main_win.result_cache
+
         try:
             result = cast(
                 AnalysisResult,
-                MyWorker().run_with_progress(
+                worker.run_with_progress(
                     main_win,  # parent widget
                     '{0}...'.format(analysis.name),
                 ),
@@ -163,17 +313,13 @@ class Dataset:
             return None
 
         if isinstance(result, ShowMessageBox):
-            if result.type is MessageBoxType.INFORMATION:
-                QMessageBox.information(main_win, result.title, result.message)
-            elif result.type is MessageBoxType.WARNING:
-                QMessageBox.warning(main_win, result.title, result.message)
-            elif result.type is MessageBoxType.CRITICAL:
-                QMessageBox.critical(main_win, result.title, result.message)
-            else:
-                raise Exception('unknown message box type: %s', result.type)
-
+            show_message_box(main_win, result)
             return None
 
+        if isinstance(result, DatasetWithMessage):
+            show_message_box(main_win, result.message)
+            return result.dataset
+
         return result
 
     def get_export_variants(self) -> Sequence[ExportVariant]:
@@ -212,35 +358,53 @@ class Dataset:
                         worker.set_progress(position)
 
         elif '*.xlsx' in fformat:
-            wb = openpyxl.Workbook() 
+            # A write-only workbook streams the rows to the file instead of keeping them all,
+            # but it needs the column widths before the first row of every sheet,
+            # so we size the columns by the first rows only.
+            rows = variant.get_rows()
+            sample : list[tuple] = []
+            for row in rows:
+                if row:
+                    sample.append(row)
+                    if len(sample) >= XLSX_WIDTH_SAMPLE:
+                        break
+                else:
+                    # progress
+                    position += 1
+                    worker.set_progress(position)
+
+            widths = xlsx_column_widths(variant.column_names, sample)
+
+            wb = openpyxl.Workbook(write_only=True)
             wb.properties.creator = branding.PREST_VERSION
-            ws = wb.active
 
-            ws.append(variant.column_names)
-            for row in variant.get_rows():
+            def add_sheet() -> Any:
+                # every sheet gets the header
+                sheet_number = len(wb.worksheets) + 1
+                ws = wb.create_sheet('Sheet' if sheet_number == 1 else 'Sheet %d' % sheet_number)
+                for column_number, width in enumerate(widths, start=1):
+                    ws.column_dimensions[
+                        openpyxl.utils.cell.get_column_letter(column_number)
+                    ].width = width
+
+                ws.append(variant.column_names)
+                return ws
+
+            ws = add_sheet()
+            sheet_rows = 1
+            for row in itertools.chain(sample, rows):
                 if row:
+                    if sheet_rows >= XLSX_MAX_ROWS:
+                        ws = add_sheet()
+                        sheet_rows = 1
+
                     ws.append(row)
+                    sheet_rows += 1
                 else:
                     # progress
                     position += 1
                     worker.set_progress(position)
 
-            # autosize columns
-            # who knows what the units are but it approximately fits
-            # furthermore, we fudge the numbers by 1 unit because that looks better
-            for column_number, column_cells in enumerate(ws.columns, start=1):
-                length = max(
-                    (len(str(cell.value or '')) for cell in column_cells),
-                    default=5
-                ) + 1
-
-                if length < 4:
-                    length = 4
-
-                ws.column_dimensions[
-                    openpyxl.utils.cell.get_column_letter(column_number)
-                ].width = length
-
             wb.save(fname)
 
         else:
@@ -5,13 +5,13 @@ import uic.view_dataset
 import numpy as np
 
 import dataset.budgetary_consistency
-from core import Core
 from dataset import Dataset, Analysis, ExportVariant, DatasetHeaderC
 from dataset.budgetary_consistency import BudgetaryConsistency
 from typing import Sequence, NamedTuple, List, Dict, Tuple, Iterator, Union, Optional, cast
 from gui.progress import Worker, Cancelled
 from util.codec import FileOut, FileIn, namedtupleC, strC, numpyC, listC
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 from PyQt5.QtWidgets import QDialog, QTreeWidgetItem, QHeaderView
 
 class Subject(NamedTuple):
@@ -19,7 +19,7 @@ class Subject(NamedTuple):
     prices  : np.ndarray
     amounts : np.ndarray
 
-SubjectC = namedtupleC(Subject, strC, numpyC(np.float32), numpyC(np.float32))
+SubjectC = compiled(namedtupleC(Subject, strC, numpyC(np.float32), numpyC(np.float32)))
 
 class RowNode(util.tree_model.Node):
     def __init__(self, parent_node, row: int, prices: np.ndarray, amounts: np.ndarray) -> None:
@@ -80,21 +80,19 @@ class Budgetary(Dataset):
         return f'{len(self.subjects)} subjects, {self.nr_observations} observations'
 
     def analysis_consistency(self, worker : Worker, _config : None) -> BudgetaryConsistency:
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()  # interrupt hook
+        with worker.core_session.pool(len(self.subjects)) as pool:
+            worker.interrupt = lambda: pool.cancel()  # interrupt hook
 
             rows = []
 
             worker.set_work_size(len(self.subjects))
-            for i, subject in enumerate(self.subjects):
-                response = core.call(
-                    'budgetary-consistency',
-                    SubjectC,
-                    dataset.budgetary_consistency.SubjectC,
-                    subject
-                )
+            for i, response in enumerate(pool.call_many(
+                'budgetary-consistency',
+                SubjectC,
+                dataset.budgetary_consistency.SubjectC,
+                self.subjects,
+            )):
                 rows.append(response)
-
                 worker.set_progress(i+1)
 
         ds = BudgetaryConsistency(
@@ -8,6 +8,7 @@ from typing import Sequence, NamedTuple, List, Iterator, Tuple, cast
 from gui.progress import Worker, Cancelled
 from util.codec import namedtupleC, strC, intC, listC, tupleC, FileIn, FileOut
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QDialog, QTreeWidgetItem, QHeaderView
@@ -40,10 +41,10 @@ class Subject(NamedTuple):
     hm_warp_strict : BoundEstimate
     hm_warp_nonstrict : BoundEstimate
 
-SubjectC = namedtupleC(Subject, strC, listC(tupleC(intC, ViolationsC)), intC, intC,
+SubjectC = compiled(namedtupleC(Subject, strC, listC(tupleC(intC, ViolationsC)), intC, intC,
     BoundEstimateC, BoundEstimateC,
     BoundEstimateC, BoundEstimateC,
-)
+))
 
 class ViolationsNode(util.tree_model.Node):
     def __init__(self, parent_node, row, len_viol : Tuple[int, Violations]) -> None:
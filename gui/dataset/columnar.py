@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Sequence, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from dataset import Subject, ChoiceRow, PackedSubject, AltSet, SubjectAlternatives, \
+    SubjectHeaderC, CompactSubject, CompactSubjectC, compact_alternatives, expand_alternatives
+from util.codec import CodecError, EOF, _decode_varints_numpy
+
+# ColumnarSubjects.defaults for rows without a default
+NO_DEFAULT = -1
+
+def bitmasks(masks : Sequence[int], words : int) -> np.ndarray:
+    # python ints -> rows of 64-bit words
+    if words == 1:
+        return np.fromiter(masks, dtype=np.uint64, count=len(masks)).reshape(len(masks), 1)
+
+    size = 8 * words
+    data = b''.join(mask.to_bytes(size, 'little') for mask in masks)
+    return np.frombuffer(data, dtype='<u8').astype(np.uint64).reshape(len(masks), words)
+
+def alt_sets(masks : np.ndarray) -> list[AltSet]:
+    # inverse of bitmasks()
+    cache : dict[bytes, AltSet] = {}
+    size = 8 * masks.shape[1]
+
+    def alts(bs : bytes) -> AltSet:
+        result = cache.get(bs)
+        if result is None:
+            bits = bin(int.from_bytes(bs, 'little'))[:1:-1]
+            result = cache[bs] = frozenset(i for i, bit in enumerate(bits) if bit == '1')
+        return result
+
+    data = np.ascontiguousarray(masks, dtype='<u8').tobytes()
+    return [alts(data[lo:lo+size]) for lo in range(0, len(data), size)]
+
+def segment_bitmasks(values : np.ndarray, starts : Sequence[int], lengths : Sequence[int]) -> Optional[np.ndarray]:
+    # single-word masks of values[start:start+length], for all segments;
+    # None if the alternatives do not fit in one word
+    starts_arr = np.array(starts, dtype=np.int64)
+    lengths_arr = np.array(lengths, dtype=np.int64)
+    masks = np.zeros((len(starts_arr), 1), dtype=np.uint64)
+
+    total = int(lengths_arr.sum())
+    if total == 0:
+        return masks
+
+    firsts = np.cumsum(lengths_arr) - lengths_arr  # in the flattened segments
+    positions = np.arange(total) + np.repeat(starts_arr - firsts, lengths_arr)
+    alts = values[positions]
+    if alts.max() >= 64:
+        return None
+
+    nonempty = lengths_arr > 0
+    masks[nonempty, 0] = np.bitwise_or.reduceat(np.left_shift(np.uint64(1), alts), firsts[nonempty])
+    return masks
+
+def word_count(alt_count : int) -> int:
+    return max(1, (alt_count + 63) // 64)
+
+@dataclass
+class ColumnarSubjects:
+    # all choice rows of all subjects, one array element per row;
+    # subject i owns rows offsets[i] .. offsets[i+1]-1
+    names : list[str]
+    alternatives : list[SubjectAlternatives]  # as packed, see dataset.compact_alternatives
+    dictionary : Sequence[str]  # the alternatives of the dataset
+    offsets : np.ndarray  # int64, len(names)+1
+    menus : np.ndarray  # uint64 bitmasks, (row_count, words)
+    defaults : np.ndarray  # int32, NO_DEFAULT if there's no default
+    choices : np.ndarray  # uint64 bitmasks, (row_count, words)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.defaults)
+
+    def row_subjects(self) -> np.ndarray:
+        # subject index of every row
+        return np.repeat(np.arange(len(self.names)), np.diff(self.offsets))
+
+    @staticmethod
+    def from_subjects(subjects : Iterable[Subject], dictionary : Sequence[str] = ()) -> ColumnarSubjects:
+        names : list[str] = []
+        alternatives : list[SubjectAlternatives] = []
+        alt_count = 0
+        lengths : list[int] = []
+        menus : list[int] = []
+        defaults : list[int] = []
+        choices : list[int] = []
+
+        # datasets tend to contain few distinct menus and choices
+        # so we compute every mask only once
+        #
+        # we also don't keep the unpacked subjects around;
+        # millions of live tuples and sets make the GC crawl
+        mask_cache : dict[AltSet, int] = {}
+        def mask(alts : AltSet) -> int:
+            result = mask_cache.get(alts)
+            if result is None:
+                result = mask_cache[alts] = sum(1 << alt for alt in alts)
+            return result
+
+        dictionary_index = {alt: i for i, alt in enumerate(dictionary)}
+        for subject in subjects:
+            names.append(subject.name)
+            alternatives.append(compact_alternatives(subject.alternatives, dictionary, dictionary_index))
+            alt_count = max(alt_count, len(subject.alternatives))
+            lengths.append(len(subject.choices))
+            for cr in subject.choices:
+                menus.append(mask(cr.menu))
+                defaults.append(NO_DEFAULT if cr.default is None else cr.default)
+                choices.append(mask(cr.choice))
+
+        # the alternatives must fit in the bitmasks, even if not listed in the subject
+        alt_count = max(
+            alt_count,
+            max((m.bit_length() for m in mask_cache.values()), default=0),
+        )
+        words = word_count(alt_count)
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return ColumnarSubjects(
+            names=names,
+            alternatives=alternatives,
+            dictionary=dictionary,
+            offsets=offsets,
+            menus=bitmasks(menus, words),
+            defaults=np.array(defaults, dtype=np.int32),
+            choices=bitmasks(choices, words),
+        )
+
+    @staticmethod
+    def from_packed(
+        subjects : Sequence[Union[PackedSubject, memoryview]],
+        dictionary : Sequence[str] = (),
+    ) -> ColumnarSubjects:
+        # rather than unpacking the subjects one by one,
+        # we decode all choice rows of all subjects in one go
+        names : list[str] = []
+        alternatives : list[SubjectAlternatives] = []
+        tails : list[memoryview] = []
+        tail_offsets = [0]
+        for packed in subjects:
+            view = memoryview(packed)
+            (name, alts), pos = SubjectHeaderC.decode_buf(view)
+            names.append(name)
+            alternatives.append(alts)
+
+            tails.append(view[pos:])
+            tail_offsets.append(tail_offsets[-1] + len(view) - pos)
+
+        octets = np.frombuffer(b''.join(tails), dtype=np.uint8)
+
+        # every byte without the continuation bit ends a varint
+        varint_ends = np.concatenate(([0], np.cumsum(octets < 0x80)))
+        varint_counts = np.diff(varint_ends[tail_offsets]).tolist()
+
+        values = _decode_varints_numpy(octets) if len(octets) else []
+        if values is None:
+            # too big for numpy
+            return ColumnarSubjects.from_subjects(
+                (Subject.unpack(packed, dictionary) for packed in subjects),
+                dictionary,
+            )
+
+        lengths : list[int] = []
+        defaults : list[int] = []
+        menu_starts : list[int] = []
+        menu_lengths : list[int] = []
+        choice_starts : list[int] = []
+        choice_lengths : list[int] = []
+
+        pos = 0
+        try:
+            for varint_count in varint_counts:
+                end = pos + varint_count
+                row_count = values[pos]
+                pos += 1
+                lengths.append(row_count)
+
+                for _ in range(row_count):
+                    menu_length = values[pos]
+                    menu_starts.append(pos + 1)
+                    menu_lengths.append(menu_length)
+                    pos += menu_length + 1
+
+                    has_default = values[pos]
+                    if has_default == 1:
+                        defaults.append(values[pos + 1])
+                        pos += 2
+                    elif has_default == 0:
+                        defaults.append(NO_DEFAULT)
+                        pos += 1
+                    else:
+                        raise CodecError('invalid bool code: %s' % has_default)
+
+                    choice_length = values[pos]
+                    choice_starts.append(pos + 1)
+                    choice_lengths.append(choice_length)
+                    pos += choice_length + 1
+
+                if pos != end:
+                    raise CodecError('malformed subject')
+        except IndexError:
+            raise EOF()
+
+        values_arr = np.array(values, dtype=np.uint64)
+        menus = segment_bitmasks(values_arr, menu_starts, menu_lengths)
+        choices = segment_bitmasks(values_arr, choice_starts, choice_lengths)
+        if menus is None or choices is None:
+            # more than 64 alternatives
+            return ColumnarSubjects.from_subjects(
+                (Subject.unpack(packed, dictionary) for packed in subjects),
+                dictionary,
+            )
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return ColumnarSubjects(
+            names=names,
+            alternatives=alternatives,
+            dictionary=dictionary,
+            offsets=offsets,
+            menus=menus,
+            defaults=np.array(defaults, dtype=np.int32),
+            choices=choices,
+        )
+
+    def compact_subjects(self) -> Iterator[CompactSubject]:
+        menus = alt_sets(self.menus)
+        choices = alt_sets(self.choices)
+        defaults = [None if d == NO_DEFAULT else d for d in self.defaults.tolist()]
+        offsets = self.offsets.tolist()
+
+        for i, (name, alternatives) in enumerate(zip(self.names, self.alternatives)):
+            lo, hi = offsets[i], offsets[i+1]
+            yield CompactSubject(
+                name=name,
+                alternatives=alternatives,
+                choices=[
+                    ChoiceRow(menu=menu, default=default, choice=choice)
+                    for menu, default, choice
+                    in zip(menus[lo:hi], defaults[lo:hi], choices[lo:hi])
+                ],
+            )
+
+    def subjects(self) -> Iterator[Subject]:
+        for name, alternatives, choices in self.compact_subjects():
+            yield Subject(name, expand_alternatives(alternatives, self.dictionary), choices)
+
+    def to_packed(self) -> list[PackedSubject]:
+        # the alternatives are kept as they were packed
+        return [
+            PackedSubject(CompactSubjectC.encode_to_memory(subject))
+            for subject in self.compact_subjects()
+        ]
+
+def merge_choices(columns : ColumnarSubjects, track_deferrals_separately : bool) -> ColumnarSubjects:
+    # rows of the same subject with the same (menu, default) are merged into one,
+    # at the position of the first such row, with the union of their choices;
+    # with track_deferrals_separately, deferrals form groups of their own
+    if columns.row_count == 0:
+        return columns
+
+    subjects = columns.row_subjects()
+    if track_deferrals_separately:
+        deferrals = ~columns.choices.any(axis=1)
+    else:
+        deferrals = np.zeros(columns.row_count, dtype=np.bool_)
+
+    keys = np.column_stack((
+        subjects.astype(np.uint64),
+        deferrals.astype(np.uint64),
+        (columns.defaults.astype(np.int64) - NO_DEFAULT).astype(np.uint64),
+        columns.menus,
+    ))
+
+    # lexsort is stable so the first row of every group is its first occurrence
+    order = np.lexsort(keys.T[::-1])
+    keys_sorted = keys[order]
+    group_starts = np.flatnonzero(np.concatenate((
+        [True],
+        (keys_sorted[1:] != keys_sorted[:-1]).any(axis=1),
+    )))
+
+    # groups ordered by their first occurrence
+    first_rows = order[group_starts]
+    group_order = np.argsort(first_rows)
+    merged_choices = np.bitwise_or.reduceat(columns.choices[order], group_starts, axis=0)
+
+    rows = first_rows[group_order]
+    offsets = np.searchsorted(subjects[rows], np.arange(len(columns) + 1)).astype(np.int64)
+
+    return ColumnarSubjects(
+        names=columns.names,
+        alternatives=columns.alternatives,
+        dictionary=columns.dictionary,
+        offsets=offsets,
+        menus=columns.menus[rows],
+        defaults=columns.defaults[rows],
+        choices=merged_choices[group_order],
+    )
@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import dataclasses
+from array import array
+from typing import Sequence, Iterable, Iterator, Callable, TypeVar, Union, Any
+
+from dataset import PackedSubject, CompactSubjectC, SubjectAlternativesC, subject_name
+from util.packed_list import Selection, views
+
+log = logging.getLogger(__name__)
+
+Resp = TypeVar('Resp')
+
+def subject_digest(packed : Union[PackedSubject, memoryview]) -> bytes:
+    # the same for subjects that differ only in their names and the order of their choice rows
+    _name, alternatives, choices = CompactSubjectC.decode_from_memory(packed)
+    rows = sorted(
+        (sorted(menu), -1 if default is None else default, sorted(choice))
+        for menu, default, choice in choices
+    )
+
+    canonical : list[int] = []
+    for menu, default, choice in rows:
+        canonical.append(len(menu))
+        canonical.extend(menu)
+        canonical.append(default)
+        canonical.append(len(choice))
+        canonical.extend(choice)
+
+    h = hashlib.blake2b(digest_size=32)
+    h.update(SubjectAlternativesC.encode_to_memory(alternatives))
+    h.update(array('q', canonical).tobytes())
+    return h.digest()
+
+class Deduplication:
+    # Subjects that are identical up to their names and the order of their choice rows
+    # give the same results in all per-subject analyses, so we send only one of them
+    # (the representative) to the core and then fan its response out to the others.
+    #
+    # The subjects are hashed one by one, straight from the (possibly spilled) dataset;
+    # we keep only the digests and indices, never the subjects themselves.
+    #
+    # Representatives come in the order of first occurrence.
+
+    def __init__(self, subjects : Sequence[PackedSubject]) -> None:
+        self.subjects = subjects
+
+        group_of : dict[bytes, int] = {}
+        self.groups = array('q')  # the group of every subject
+        indices = array('q')  # of the representatives
+        for i, packed in enumerate(views(subjects)):
+            digest = subject_digest(packed)
+            group = group_of.get(digest)
+            if group is None:
+                group = group_of[digest] = len(indices)
+                indices.append(i)
+            self.groups.append(group)
+
+        self.representatives : Sequence[PackedSubject] = Selection(subjects, indices)
+
+        log.info('deduplication: %d subjects, %d distinct (ratio %.2f)' % (
+            len(subjects), len(self.representatives), self.ratio,
+        ))
+
+    @property
+    def ratio(self) -> float:
+        # how many subjects there are per distinct subject
+        return len(self.groups) / len(self.representatives) if self.representatives else 1.0
+
+    def fan_out(self, responses : Iterable[Resp], rename : Callable[[Resp, str], Resp]) -> Iterator[Resp]:
+        # responses for the representatives, in order -> responses for all subjects, in order;
+        # the responses are consumed lazily so that progress can be reported as they come
+        responses_it = iter(responses)
+        results : list[Resp] = []
+        for packed, group in zip(views(self.subjects), self.groups):
+            if group == len(results):
+                # first occurrence: this is the representative
+                results.append(next(responses_it))
+                yield results[group]
+            else:
+                yield rename(results[group], subject_name(packed))
+
+def renamed(response : Any, name : str) -> Any:
+    # the responses of all per-subject analyses carry the subject name as `name`
+    if dataclasses.is_dataclass(response) and not isinstance(response, type):
+        return dataclasses.replace(response, name=name)
+    else:
+        return response._replace(name=name)
@@ -13,8 +13,10 @@ import util.tree_model
 import platform_specific
 from gui.progress import Worker
 from dataset import Dataset, DatasetHeaderC, ExportVariant, Analysis
-from util.codec import FileIn, FileOut, namedtupleC, strC, intC, listC
+from core import Failure
+from util.codec import FileIn, FileOut, namedtupleC, strC, intC, listC, enumC
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 from util.tree_model import Node
 
 log = logging.getLogger(__name__)
@@ -37,7 +39,31 @@ class SubjectRaw(NamedTuple):
     contraction_consistency_pairs : int
     contraction_consistency_all : int
 
-SubjectRawC = namedtupleC(SubjectRaw, strC, listC(RowC), intC, intC, intC, intC)
+SubjectRawC = compiled(namedtupleC(SubjectRaw, strC, listC(RowC), intC, intC, intC, intC))
+
+# the outcome for one subject of a batch request
+class SubjectOk(NamedTuple):
+    raw : SubjectRaw
+    tag : int = 0
+
+class SubjectFailed(NamedTuple):
+    name : str
+    message : str
+    tag : int = 1
+
+SubjectResult = Union[SubjectOk, SubjectFailed]
+
+SubjectResultsC = listC(enumC('SubjectResult', {
+    SubjectOk: (SubjectRawC,),
+    SubjectFailed: (strC, strC),
+}))
+
+def unwrap(result : SubjectResult) -> SubjectRaw:
+    # a subject that could not be analysed fails the analysis, naming the subject
+    if isinstance(result, SubjectFailed):
+        raise Failure('subject %s: %s' % (result.name, result.message), b'')
+
+    return result.raw
 
 class Subject(NamedTuple):
     raw: SubjectRaw
@@ -59,7 +85,7 @@ class Subject(NamedTuple):
             total_sarp_binary_menus=sum(r.sarp_binary_menus for r in raw.rows),
         )
 
-SubjectC = namedtupleC(Subject, SubjectRawC, intC, intC, intC, intC, intC)
+SubjectC = compiled(namedtupleC(Subject, SubjectRawC, intC, intC, intC, intC, intC))
 
 class RootNode(util.tree_model.RootNode):
     def __init__(self, subjects: List[Subject]) -> None:
@@ -1,7 +1,7 @@
 import base64
 from fractions import Fraction
 from typing import NamedTuple, Sequence, Iterator, \
-    Optional, Any, NewType, cast, Callable
+    Optional, Any, NewType, Union, cast, Callable
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import Qt
@@ -14,7 +14,7 @@ import dataset
 import subprocess
 import platform_specific
 from dataclasses import dataclass
-from core import Core
+from core import CoreSession
 from gui.progress import Worker
 from gui.estimation import DistanceScore, distanceScoreC
 from model import get_name as model_get_name
@@ -25,7 +25,9 @@ from dataset import Dataset, DatasetHeaderC, ExportVariant, Analysis
 from util.tree_model import Node, TreeModel, Field, PackedRootNode
 from util.codec import Codec, FileIn, FileOut, namedtupleC, strC, intC, \
     frozensetC, listC, bytesC, tupleC, boolC, fractionC
-from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_progress import CodecProgress, spillingListCP
+from util.codec_compiler import compiled
+from util.packed_list import views
 import uic.view_estimated
 
 def from_fraction(x : Fraction) -> int | float:
@@ -74,7 +76,7 @@ class Response(NamedTuple):
     penalty : Penalty
     best_instances : list[InstanceInfo]
 
-ResponseC = namedtupleC(Response, strC, PenaltyC, listC(InstanceInfoC))
+ResponseC = compiled(namedtupleC(Response, strC, PenaltyC, listC(InstanceInfoC)))
 ResponsesC = listC(ResponseC)
 
 PackedResponse = NewType('PackedResponse', bytes)
@@ -109,12 +111,52 @@ class Subject(NamedTuple):
     penalty: Penalty
     best_models: list[tuple[model.Model, Penalty, list[InstanceRepr]]]
 
-SubjectC = namedtupleC(Subject, strC, PenaltyC, listC(tupleC(ModelC, PenaltyC, listC(InstanceReprC))))
+SubjectC = compiled(namedtupleC(Subject, strC, PenaltyC, listC(tupleC(ModelC, PenaltyC, listC(InstanceReprC)))))
 
 PackedSubject = NewType('PackedSubject', bytes)
 PackedSubjectC = cast(Codec[PackedSubject], bytesC)
 
-def subject_from_response_bytes(response_bytes : PackedResponse) -> Subject:
+def renamed_response(response : PackedResponse, name : str) -> PackedResponse:
+    # the subject name comes first, see ResponseC
+    _old_name, pos = strC.decode_buf(memoryview(response))
+    return PackedResponse(strC.encode_to_memory(name) + response[pos:])
+
+def combine_responses(responses : Sequence[Response]) -> Response:
+    # Estimates of different models for the same subject, combined
+    # like BestInstances::combine() and finish() in the core;
+    # this gives the same result as estimating all the models at once.
+    penalty, instances = responses[0].penalty, list(responses[0].best_instances)
+    for response in responses[1:]:
+        if penalty.upper_bound < response.penalty.lower_bound:
+            # we're strictly better
+            pass
+        elif penalty.lower_bound > response.penalty.upper_bound:
+            # they're strictly better
+            penalty, instances = response.penalty, list(response.best_instances)
+        else:
+            # neither is strictly better, keep the instances that may be the best
+            penalty = Penalty(
+                lower_bound=min(penalty.lower_bound, response.penalty.lower_bound),
+                upper_bound=min(penalty.upper_bound, response.penalty.upper_bound),
+            )
+            instances.extend(response.best_instances)
+
+    return Response(
+        subject_name=responses[0].subject_name,
+        penalty=penalty,
+        best_instances=sorted(
+            (i for i in instances if i.penalty.lower_bound <= penalty.upper_bound),
+            key=lambda i: (model.get_core_ordering_key(i.model), i.penalty, i.instance),
+        ),
+    )
+
+def upper_bound_for(response : Response, this_model : model.Model) -> Optional[Fraction]:
+    return max(
+        (i.penalty.upper_bound for i in response.best_instances if i.model == this_model),
+        default=None,
+    )
+
+def subject_from_response_bytes(response_bytes : Union[PackedResponse, memoryview]) -> Subject:
     # returns something orderable
     def model_sort_criterion(chunk : tuple[ModelRepr, tuple[Penalty, list[InstanceRepr]]]) -> Any:
         model, (penalty, instances) = chunk
@@ -204,17 +246,19 @@ class EstimationResult(Dataset):
             )
 
     class ViewDialog(uic.view_estimated.Ui_ViewEstimated, gui.ExceptionDialog):
-        def __init__(self, ds: 'EstimationResult') -> None:
+        def __init__(self, ds: 'EstimationResult', core_session : Optional[CoreSession] = None) -> None:
             QDialog.__init__(self)
             self.setupUi(self)
 
+            # a warm core makes clicking through instances snappy
+            self.core_session = core_session or CoreSession(persistent=False)
             self.alternatives = ds.alternatives
             self.model = TreeModel(
                 PackedRootNode(
                     EstimationResult.Subject,
                     cast(Callable[[bytes], Any], subject_from_response_bytes),
                     'Subject',
-                    ds.subjects
+                    views(ds.subjects),
                 ),
                 headers=('Name', 'Distance score', 'Size'),
             )
@@ -225,7 +269,7 @@ class EstimationResult(Dataset):
             self.twSubjects.clicked.connect(self.catch_exc(self.dlg_item_clicked))
 
         def render_instance(self, instance_code : str) -> RenderedInstance:
-            with Core() as core:
+            with self.core_session.core() as core:
                 response : InstVizResponse = core.call(
                     'instviz',
                     InstVizRequestC,
@@ -349,7 +393,11 @@ class EstimationResult(Dataset):
 
     def __init__(self, name: str, alternatives: Sequence[str]) -> None:
         Dataset.__init__(self, name, alternatives)
-        self.subjects: list[PackedResponse] = []
+        self.subjects: Sequence[PackedResponse] = []
+
+    def dlg_view(self, _flag=None, core_session : Optional[CoreSession] = None):
+        dlg = self.ViewDialog(self, core_session)
+        dlg.exec_()
 
     def get_analyses(self) -> Sequence[Analysis]:
         return []
@@ -371,7 +419,7 @@ class EstimationResult(Dataset):
         )
 
     def export_detailed(self) -> Iterator[Optional[tuple[str,Optional[int|float],str,str]]]:
-        for subject in map(subject_from_response_bytes, self.subjects):
+        for subject in map(subject_from_response_bytes, views(self.subjects)):
             for model, penalty, instances in subject.best_models:
                 for instance in sorted(instances):
                     yield (
@@ -384,7 +432,7 @@ class EstimationResult(Dataset):
             yield None  # bump progress
 
     def export_compact(self) -> Iterator[Optional[tuple[Optional[str],str|int|float,str,int]]]:
-        for subject in map(subject_from_response_bytes, self.subjects):
+        for subject in map(subject_from_response_bytes, views(self.subjects)):
             subject_name: Optional[str] = subject.name
             for model, model_penalty, instances in subject.best_models:
                 yield (subject_name, model_penalty.to_csv(), model_get_name(model), len(instances))
@@ -397,11 +445,11 @@ class EstimationResult(Dataset):
 
     @classmethod
     def get_codec_progress(_cls) -> CodecProgress['EstimationResult']:
-        subjects_encode : Callable[[Worker, FileOut, list[PackedResponse]], None]
-        subjects_decode : Callable[[Worker, FileIn], list[PackedResponse]]
+        subjects_encode : Callable[[Worker, FileOut, Sequence[PackedResponse]], None]
+        subjects_decode : Callable[[Worker, FileIn], Sequence[PackedResponse]]
 
         DatasetHeaderC_encode, DatasetHeaderC_decode = DatasetHeaderC.enc_dec()
-        subjects_size, subjects_encode, subjects_decode = listCP(oneCP(PackedResponseC)).enc_dec()
+        subjects_size, subjects_encode, subjects_decode = spillingListCP(PackedResponseC).enc_dec()
         intC_encode, intC_decode = intC.enc_dec()
 
         def get_size(x : 'EstimationResult') -> int:
@@ -7,6 +7,7 @@ from gui.progress import Worker
 from dataset import Dataset, DatasetHeaderC, Analysis, ExportVariant
 from util.codec import Codec, FileIn, FileOut, listC, strC, intC, namedtupleC
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 
 class Subject(NamedTuple):
     name : str
@@ -15,7 +16,7 @@ class Subject(NamedTuple):
     active_choices_binary : int
     deferrals : int
 
-SubjectC = namedtupleC(Subject, strC, intC, intC, intC, intC)
+SubjectC = compiled(namedtupleC(Subject, strC, intC, intC, intC, intC))
 
 class SubjectNode(util.tree_model.Node):
     def __init__(self, parent_node, row: int, subject: Subject) -> None:
@@ -1,40 +1,58 @@
 from __future__ import annotations
 
+import io
+import os
+import csv
 import logging
-import collections
+import tempfile
 from dataclasses import dataclass
-from typing import Sequence, Iterator, NamedTuple, Optional
+from typing import Sequence, Iterable, Iterator, Generator, Callable, NamedTuple, Optional, IO, TypeVar
 
 from PyQt5.QtWidgets import QDialog, QHeaderView
 
 import dataset
 import gui.copycat_simulation
 import gui.estimation
+import gui.power_analysis
+import model
 import simulation
-from core import Core
+from core import chunks
 from dataset import Dataset, DatasetHeaderC, ChoiceRow, \
-    Subject, SubjectC, ExportVariant, Analysis, PackedSubject, PackedSubjectC
+    Subject, ExportVariant, Analysis, PackedSubject, PackedSubjectC, \
+    PackedSubjectsC, DatasetWithMessage, recompact_subject, compact_legacy_subject
+from dataset.columnar import ColumnarSubjects
+from dataset.dedup import Deduplication, renamed
 from gui.progress import Worker
 from dataset.estimation_result import EstimationResult
 from dataset.stochastic_consistency_result import StochasticConsistencyResult
 from dataset.deterministic_consistency_result import DeterministicConsistencyResult
 from dataset.experiment_stats import ExperimentStats
+from dataset.power_analysis import PowerAnalysis
 from dataset.tuple_intrans_alts import TupleIntransAlts
 from dataset.tuple_intrans_menus import TupleIntransMenus
 import dataset.deterministic_consistency_result
 import dataset.experiment_stats
+import dataset.power_analysis
 import dataset.tuple_intrans_alts
 import dataset.tuple_intrans_menus
 import dataset.integrity_check
+import dataset.columnar
 import dataset.estimation_result as estimation_result
 import uic.view_dataset
 import util.tree_model
-from util.codec import FileIn, FileOut, namedtupleC, strC, intC, \
-    frozensetC, maybe
-from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec import Codec, FileIn, FileOut, namedtupleC, strC, intC, \
+    frozensetC, tupleC, boolC, maybe
+from util.result_cache import cached_calls, PUT_BATCH_SIZE
+from util.codec_progress import CodecProgress, spillingListCP
+from util.packed_list import SpillingBlocks, spilled, views
 
 log = logging.getLogger(__name__)
 
+Resp = TypeVar('Resp')
+
+# the options that the estimates of a model depend on, for the result cache
+EstimationOptionsC = tupleC(model.ModelC, gui.estimation.distanceScoreC, boolC)
+
 class ChoiceRow_str(NamedTuple):
     menu : frozenset[str]
     default : Optional[str]
@@ -73,6 +91,201 @@ def parse_set(s: str) -> frozenset[str]:
 class CsvError(Exception):
     pass
 
+class CsvImporter:
+    # builds an ExperimentalData from CSV rows fed one by one
+    #
+    # every subject is packed as soon as it is complete,
+    # which is when the next subject starts if the input is grouped by subject.
+    # if it turns out not to be, the rest of the input is buffered by subject
+    # and the buffer is spilled to disk whenever it fills up,
+    # in buckets by subject name, to be grouped one bucket at a time at the end.
+
+    BUFFER_ROWS = 500_000
+    SPILL_BUCKETS = 64
+
+    def __init__(self, indices: tuple[int,int,Optional[int],int]) -> None:
+        self.indices = indices  # CSV column indices: subject, menu, default, choice
+
+        # in order of first appearance; None until packed
+        self.subjects: dict[str,Optional[PackedSubject]] = {}
+        self.alternatives: set[str] = set()
+        self.observ_count = 0
+
+        # there are usually few distinct alternatives and menus, each repeated many times
+        self.alt_names: dict[str,str] = {}
+        self.alt_sets: dict[str,frozenset[str]] = {}
+
+        self.current_name: Optional[str] = None
+        self.current_rows: list[ChoiceRow_str] = []
+
+        # once we know the input is not grouped
+        self.buffer: Optional[dict[str,list[ChoiceRow_str]]] = None
+        self.buffer_rows = 0
+        self.spill_files: list[Optional[IO[str]]] = [None] * self.SPILL_BUCKETS
+
+    def parse_set(self, s: str) -> frozenset[str]:
+        result = self.alt_sets.get(s)
+        if result is None:
+            alt_names = self.alt_names
+            result = self.alt_sets[s] = frozenset(alt_names.setdefault(alt, alt) for alt in parse_set(s))
+        return result
+
+    def add_row(self, row: Sequence[str]) -> None:
+        i_s, i_m, i_d, i_c = self.indices
+
+        subject_name = row[i_s]
+        default = (row[i_d] if i_d is not None else None) or None  # empty string -> None
+        cr = ChoiceRow_str(
+            menu=self.parse_set(row[i_m]),
+            default=self.alt_names.setdefault(default, default) if default else None,
+            choice=self.parse_set(row[i_c]),
+        )
+
+        if (cr.default is not None) and (cr.default not in cr.menu):
+            raise CsvError('%s: default alternative "%s" does not appear in its menu "%s".' % (
+                subject_name, cr.default, set(cr.menu)
+            ))
+
+        if self.buffer is not None:
+            self.subjects.setdefault(subject_name, None)
+            self.buffer_row(subject_name, cr)
+        elif subject_name == self.current_name:
+            self.current_rows.append(cr)
+        else:
+            self.finish_current()
+
+            if subject_name in self.subjects:
+                log.debug('CSV input not grouped by subject, buffering')
+                self.buffer = {}
+                self.buffer_row(subject_name, cr)
+            else:
+                self.subjects[subject_name] = None
+                self.current_name = subject_name
+                self.current_rows = [cr]
+
+    def finish_current(self) -> None:
+        if self.current_name is not None:
+            self.subjects[self.current_name] = self.pack(self.current_name, self.current_rows)
+            self.current_name = None
+            self.current_rows = []
+
+    def pack(self, subject_name: str, choices: Sequence[ChoiceRow_str]) -> PackedSubject:
+        alternatives_subj: set[str] = set()
+        for cr in choices:
+            alternatives_subj |= cr.menu
+            alternatives_subj |= cr.choice
+
+        self.alternatives |= alternatives_subj
+
+        alternatives = sorted(alternatives_subj)  # order matters!
+        alt_map = dict()
+        for i, alt in enumerate(alternatives):
+            alt_map[alt] = i
+
+        self.observ_count += len(choices)
+        return Subject(
+            name=subject_name,
+            alternatives=alternatives,
+            choices=[
+                ChoiceRow(
+                    menu=frozenset(alt_map[x] for x in cr.menu),
+                    default=alt_map[cr.default] if cr.default else None,  # cr.default == "" -> None
+                    choice=frozenset(alt_map[x] for x in cr.choice),
+                )
+                for cr in choices
+            ]
+        ).pack()
+
+    def buffer_row(self, subject_name: str, cr: ChoiceRow_str) -> None:
+        assert self.buffer is not None
+
+        self.buffer.setdefault(subject_name, []).append(cr)
+        self.buffer_rows += 1
+        if self.buffer_rows >= self.BUFFER_ROWS:
+            self.spill()
+
+    def spill(self) -> None:
+        assert self.buffer is not None
+        log.debug('spilling %d CSV rows to disk', self.buffer_rows)
+
+        for subject_name, choices in self.buffer.items():
+            bucket = hash(subject_name) % self.SPILL_BUCKETS
+            f = self.spill_files[bucket]
+            if f is None:
+                f = self.spill_files[bucket] = tempfile.TemporaryFile(mode='w+', newline='')
+
+            csv.writer(f).writerows(
+                (subject_name, ','.join(cr.menu), cr.default or '', ','.join(cr.choice))
+                for cr in choices
+            )
+
+        self.buffer = {}
+        self.buffer_rows = 0
+
+    def unspill(self, f: IO[str]) -> dict[str,list[ChoiceRow_str]]:
+        subjects_raw: dict[str,list[ChoiceRow_str]] = {}
+
+        f.seek(0)
+        for subject_name, menu, default, choice in csv.reader(f):
+            subjects_raw.setdefault(subject_name, []).append(ChoiceRow_str(
+                menu=self.parse_set(menu),
+                default=self.alt_names.get(default, default) or None,
+                choice=self.parse_set(choice),
+            ))
+
+        return subjects_raw
+
+    def pack_buffered(self, subjects_raw: dict[str,list[ChoiceRow_str]]) -> None:
+        for subject_name, choices in subjects_raw.items():
+            # rows seen before we started buffering come first
+            packed = self.subjects[subject_name]
+            if packed is not None:
+                subject = Subject.unpack(packed)
+                self.observ_count -= len(subject.choices)
+                choices = [
+                    ChoiceRow_str(
+                        menu=frozenset(subject.alternatives[i] for i in cr.menu),
+                        default=subject.csv_alt(cr.default),
+                        choice=frozenset(subject.alternatives[i] for i in cr.choice),
+                    )
+                    for cr in subject.choices
+                ] + choices
+
+            self.subjects[subject_name] = self.pack(subject_name, choices)
+
+    def finish(self, name: str) -> ExperimentalData:
+        self.finish_current()
+
+        if self.buffer is not None:
+            if any(f is not None for f in self.spill_files):
+                # the buffer does not fit in memory; go through the disk
+                self.spill()
+                for f in self.spill_files:
+                    if f is not None:
+                        with f:
+                            self.pack_buffered(self.unspill(f))
+                self.spill_files = [None] * self.SPILL_BUCKETS
+            else:
+                self.pack_buffered(self.buffer)
+
+            self.buffer = None
+            self.buffer_rows = 0
+
+        # the subjects have been packed with their alternatives spelled out
+        # because we did not know all alternatives of the dataset yet
+        alternatives = sorted(self.alternatives)
+        alternatives_index = {alt: i for i, alt in enumerate(alternatives)}
+
+        subjects : SpillingBlocks[PackedSubject] = SpillingBlocks()
+        for packed in self.subjects.values():
+            assert packed is not None
+            subjects.append(recompact_subject(packed, alternatives, alternatives_index))
+
+        ds = ExperimentalData(name, alternatives)
+        ds.subjects = subjects.blocks
+        ds.observ_count = self.observ_count
+        return ds
+
 class ExperimentalData(Dataset):
     class ViewDialog(QDialog, uic.view_dataset.Ui_ViewDataset):
         def __init__(self, ds: ExperimentalData) -> None:
@@ -81,7 +294,12 @@ class ExperimentalData(Dataset):
 
             # we assign model to self to prevent GC
             self.model = util.tree_model.TreeModel(
-                util.tree_model.PackedRootNode(SubjectNode, SubjectC.decode_from_memory, 'Subject', ds.subjects),
+                util.tree_model.PackedRootNode(
+                    SubjectNode,
+                    lambda packed: Subject.unpack(PackedSubject(packed), ds.alternatives),
+                    'Subject',
+                    views(ds.subjects),
+                ),
                 headers=('Subject', 'Menu', 'Default', 'Choice'),
             )
             self.twRows.setModel(self.model)
@@ -91,70 +309,64 @@ class ExperimentalData(Dataset):
 
     def __init__(self, name: str, alternatives: Sequence[str]) -> None:
         Dataset.__init__(self, name, alternatives)
-        self.subjects: list[PackedSubject] = []
+        self.subjects: Sequence[PackedSubject] = []
         self.observ_count: int = 0
 
     @staticmethod
     def from_csv(name: str, rows: Sequence[Sequence[str]], indices: tuple[int,int,Optional[int],int]) -> ExperimentalData:
-        i_s, i_m, i_d, i_c = indices  # CSV column indices: subject, menu, default, choice
-
-        subjects_raw: dict[str,list[ChoiceRow_str]] = collections.defaultdict(list)
+        importer = CsvImporter(indices)
         for row in rows:
-            # row[i_s] is the name of the subject
-            cr = ChoiceRow_str(
-                menu=parse_set(row[i_m]),
-                default=(row[i_d] if i_d is not None else None) or None,  # empty string -> None
-                choice=parse_set(row[i_c]),
-            )
+            importer.add_row(row)
 
-            if (cr.default is not None) and (cr.default not in cr.menu):
-                raise CsvError('%s: default alternative "%s" does not appear in its menu "%s".' % (
-                    row[i_s], cr.default, set(cr.menu)
-                ))
+        return importer.finish(name)
 
-            subjects_raw[row[i_s]].append(cr)
+    @staticmethod
+    def load_from_csv(worker: Worker, fname: str, indices: tuple[int,int,Optional[int],int], name: Optional[str] = None) -> ExperimentalData:
+        # like from_csv but streams the file, skipping the header
+        importer = CsvImporter(indices)
+        worker.set_work_size(os.path.getsize(fname))
 
-        subjects: list[PackedSubject] = []
-        alternatives_dataset: set[str] = set()
-        observ_count = 0
+        with open(fname, 'rb') as f_bin:
+            rows = csv.reader(line.strip() for line in io.TextIOWrapper(f_bin))
+            next(rows, None)  # header
 
-        for subject_name, choices in subjects_raw.items():
-            alternatives_subj: set[str] = set()
-            for cr in choices:
-                alternatives_subj |= cr.menu
-                alternatives_subj |= cr.choice
-
-            alternatives_dataset |= alternatives_subj
-
-            alternatives = sorted(alternatives_subj)  # order matters!
-            alt_map = dict()
-            for i, alt in enumerate(alternatives):
-                alt_map[alt] = i
-
-            subject = Subject(
-                name=subject_name,
-                alternatives=alternatives,
-                choices=[
-                    ChoiceRow(
-                        menu=frozenset(alt_map[x] for x in cr.menu),
-                        default=alt_map[cr.default] if cr.default else None,  # cr.default == "" -> None
-                        choice=frozenset(alt_map[x] for x in cr.choice),
-                    )
-                    for cr in choices
-                ]
-            )
-            observ_count += len(subject.choices)
-            subjects.append(PackedSubject(SubjectC.encode_to_memory(subject)))
+            for i, row in enumerate(rows):
+                if not row:
+                    continue  # blank line
 
-        ds = ExperimentalData(name, sorted(alternatives_dataset))
-        ds.subjects = subjects
-        ds.observ_count = observ_count
+                importer.add_row(row)
+
+                if i % 4096 == 0:
+                    # the position of the underlying binary file
+                    # is ahead by a buffer at most, which is good enough
+                    worker.set_progress(f_bin.tell())
+
+        ds = importer.finish(name or os.path.basename(fname))
+        worker.set_progress(os.path.getsize(fname))
         return ds
 
     def clear_subjects(self):
         self.subjects = []
         self.observ_count = 0
 
+    def compact_legacy_subjects(self) -> None:
+        # after loading from a legacy workspace file
+        alternatives_index = {alt: i for i, alt in enumerate(self.alternatives)}
+        self.subjects = spilled(
+            compact_legacy_subject(packed, self.alternatives, alternatives_index)
+            for packed in views(self.subjects)
+        )
+
+    def columns(self) -> ColumnarSubjects:
+        return ColumnarSubjects.from_packed(views(self.subjects), self.alternatives)
+
+    @staticmethod
+    def from_columns(name: str, alternatives: Sequence[str], columns: ColumnarSubjects) -> ExperimentalData:
+        ds = ExperimentalData(name, alternatives)
+        ds.subjects = spilled(columns.to_packed())
+        ds.observ_count = columns.row_count
+        return ds
+
     def label_size(self):
         return '%d subjs, %d observations' % (len(self.subjects), self.observ_count)
 
@@ -172,49 +384,89 @@ class ExperimentalData(Dataset):
         else:
             return None
 
-    def analysis_simulation(self, worker : Worker, options : 'gui.copycat_simulation.Options') -> ExperimentalData:
-        subjects : list[PackedSubject] = []
+    def config_power_analysis(self, _experimental_features : bool) -> Optional[gui.power_analysis.Options]:
+        dlg = gui.power_analysis.PowerAnalysis(self)
+        if dlg.exec() == QDialog.Accepted:
+            return dlg.value()
+        else:
+            return None
+
+    def analysis_power_analysis(self, worker : Worker, options : gui.power_analysis.Options) -> PowerAnalysis:
+        with worker.core_session.core() as core:
+            worker.interrupt = lambda: core.cancel()  # register interrupt hook
+
+            # every replication is a random copy of the whole dataset
+            request = dataset.power_analysis.Request(
+                batch=simulation.BatchRequest(
+                    name='random',
+                    alternatives=self.alternatives,
+                    subjects=simulation.Registered(simulation.register_templates(core, self.subjects)),
+                    gen_choices=options.gen_choices,
+                    preserve_deferrals=options.preserve_deferrals,
+                    first_index=1,
+                    last_index=1,
+                    seed=options.seed,
+                ),
+                replications=options.replications,
+            )
+            replications = dataset.power_analysis.run(worker, core, request)
+
+        ds = PowerAnalysis(self.name + ' (power analysis)')
+        ds.seed = options.seed
+        ds.replications = replications
+        return ds
 
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()  # register interrupt hook
+    def analysis_simulation(self, worker : Worker, options : 'gui.copycat_simulation.Options') -> ExperimentalData | DatasetWithMessage:
+        subjects : SpillingBlocks[PackedSubject] = SpillingBlocks()
+        subject_filter = gui.subject_filter.CompiledFilter(options.subject_filter) \
+            if options.subject_filter is not None else None
+
+        with worker.core_session.core() as core:
+            worker.interrupt = lambda: core.cancel()  # register interrupt hook
 
             worker.set_work_size(len(self.subjects) * options.multiplicity)
-            position = 0
-            iteration_counter = 0
-            for subject_packed in self.subjects:
-                for j in range(options.multiplicity):
-                    while True:
-                        iteration_counter += 1
-                        response = simulation.run(core, simulation.Request(
-                            name='random%d' % (j+1),
-                            alternatives=self.alternatives,  # we don't use subject.alternatives here
-                            gen_menus=simulation.GenMenus(
-                                generator=simulation.Copycat(subject_packed),
-                                defaults=False,  # this will be ignored, anyway
-                            ),
-                            gen_choices=options.gen_choices,
-                            preserve_deferrals=options.preserve_deferrals,
-                        ))
-
-                        subject_accepted = gui.subject_filter.accepts(
-                            options.subject_filter,
-                            core,
-                            response.subject_packed,
-                        )
-
-                        if subject_accepted:
-                            subjects.append(response.subject_packed)
-
-                            position += 1
-                            if iteration_counter % 256 == 0:
-                                worker.set_progress(position)
-                            break
-                        else:
-                            continue
+
+            # the templates stay in the core so that running the simulation again,
+            # and regenerating subjects rejected by the filter, does not send them again;
+            # then all templates go in one request, every one of them multiplicity times
+            request = simulation.BatchRequest(
+                name='random',
+                alternatives=self.alternatives,  # we don't use subject.alternatives here
+                subjects=simulation.Registered(simulation.register_templates(core, self.subjects)),
+                gen_choices=options.gen_choices,
+                preserve_deferrals=options.preserve_deferrals,
+                first_index=1,
+                last_index=options.multiplicity,
+                seed=options.seed,
+            )
+
+            responses : Iterable[simulation.Response]
+            if subject_filter is None:
+                responses = simulation.run_batch(core, request)
+            else:
+                responses = simulation.run_batch_filtered(
+                    worker, core, request,
+                    lambda subjects: subject_filter.accepts_many(core, subjects),
+                )
+
+            for response in responses:
+                subjects.append(response.subject_packed)
+                if len(subjects) % 256 == 0:
+                    worker.set_progress(len(subjects))
 
         ds = ExperimentalData(name=options.name, alternatives=self.alternatives)
-        ds.subjects = subjects
+        ds.subjects = subjects.blocks
         ds.observ_count = options.multiplicity * self.observ_count
+
+        if subject_filter is not None:
+            message = subject_filter.describe(len(subjects))
+            log.info('subject filter: %s' % message)
+            return DatasetWithMessage(ds, dataset.ShowMessageBox(
+                type=dataset.MessageBoxType.INFORMATION,
+                title='Subject filter',
+                message=message,
+            ))
+
         return ds
 
     @dataclass
@@ -228,117 +480,213 @@ class ExperimentalData(Dataset):
         )
 
     def analysis_merge_choices(self, worker : Worker, config : MergeOptions) -> ExperimentalData:
-        subjects : list[PackedSubject] = []
-        observ_count : int = 0
-
-        # we group by pairs (menu, default)
-        MenuDef = tuple[frozenset[int], Optional[int]]
+        columns = dataset.columnar.merge_choices(
+            self.columns(),
+            track_deferrals_separately=config.track_deferrals_separately,
+        )
 
+        subjects : SpillingBlocks[PackedSubject] = SpillingBlocks()
         worker.set_work_size(len(self.subjects))
-        for i, subject_packed in enumerate(self.subjects):
-            subject = Subject.unpack(subject_packed)
+        for subject in columns.subjects():
+            subjects.append(subject.pack(self.alternatives))
+            worker.set_progress(len(subjects))
 
-            choices : list[ChoiceRow] = []
-            menu_idx : dict[MenuDef, int] = {}
-            deferrals_seen : set[MenuDef] = set()
+        ds = ExperimentalData(name=self.name + ' (merged)', alternatives=self.alternatives)
+        ds.subjects = subjects.blocks
+        ds.observ_count = columns.row_count
+        return ds
 
-            for cr in subject.choices:
-                # deferrals are kept separately if requested
-                if config.track_deferrals_separately and (not cr.choice):
-                    if (cr.menu, cr.default) in deferrals_seen:
-                        # this deferral has already been seen, just skip it
-                        continue
-                    else:
-                        # this is the first time we've seen deferral at this menu
-                        # add that deferral to the output
-                        # but don't add it to the index
-                        choices.append(cr)
-                        deferrals_seen.add((cr.menu, cr.default))
-                        observ_count += 1
-                        continue
+    def estimate_model(
+        self,
+        worker : Worker,
+        options : gui.estimation.Options,
+        subjects : Sequence[PackedSubject],
+        this_model : model.Model,
+        indices : Sequence[int],
+        estimates : list[dict[model.Model, estimation_result.PackedResponse]],
+        step : Callable[[], None],
+    ) -> None:
+        # fills in estimates[i][this_model] for subjects[i], for all i in indices,
+        # from the result cache or from the core; step() is called for every estimate
+        cache = worker.result_cache
+        model_options = EstimationOptionsC.encode_to_memory(
+            (this_model, options.distance_score, options.disregard_deferrals)
+        )
 
-                idx = menu_idx.get((cr.menu, cr.default))
-                if idx is None:
-                    # not there yet
-                    menu_idx[cr.menu, cr.default] = len(choices)
-                    choices.append(cr)
-                    observ_count += 1
+        keys : list[bytes] = []
+        missing : list[int] = []
+        if cache is None:
+            missing = list(indices)
+        else:
+            keys = [cache.key('estimation', model_options, subjects[i]) for i in indices]
+            for i, response in zip(indices, cache.get_many(keys)):
+                if response is None:
+                    missing.append(i)
                 else:
-                    # already there, expand the choice
-                    choices[idx] = ChoiceRow(
-                        menu=cr.menu,
-                        default=cr.default,
-                        choice=cr.choice | choices[idx].choice,
-                    )
-
-            subjects.append(Subject(
-                name=subject.name,
-                alternatives=subject.alternatives,
-                choices=choices,
-            ).pack())
-            worker.set_progress(i+1)
+                    estimates[i][this_model] = estimation_result.PackedResponse(response)
+                    step()
+
+        if not missing:
+            return
+
+        key_of = dict(zip(indices, keys))
+        new : list[tuple[bytes, bytes]] = []
+
+        with worker.core_session.core() as core:
+            worker.interrupt = lambda: core.cancel()  # register interrupt hook
+
+            # all subjects go in one request so that the core can keep
+            # all its threads busy until the end; the responses stream back
+            # in the order of completion, tagged with the index in the request
+            request = estimation_result.Request(
+                subjects=[subjects[i] for i in missing],
+                models=[this_model],
+                disable_parallelism=options.disable_parallelism,
+                disregard_deferrals=options.disregard_deferrals,
+                distance_score=options.distance_score,
+            )
 
-        ds = ExperimentalData(name=self.name + ' (merged)', alternatives=self.alternatives)
-        ds.subjects = subjects
-        ds.observ_count = observ_count
-        return ds
+            try:
+                for j, response in core.call_streaming(
+                    'estimation-streaming',
+                    estimation_result.RequestC,
+                    estimation_result.PackedResponseC,
+                    request,
+                ):
+                    i = missing[j]
+                    estimates[i][this_model] = response
+
+                    if cache is not None:
+                        new.append((key_of[i], response))
+                        if len(new) >= PUT_BATCH_SIZE:
+                            cache.put_many(new)
+                            new = []
+
+                    step()
+            finally:
+                # keep what we have even if interrupted
+                if cache is not None:
+                    cache.put_many(new)
 
     def analysis_estimation(self, worker : Worker, options : gui.estimation.Options) -> EstimationResult:
-        CHUNK_SIZE = 64
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()  # register interrupt hook
-
-            rows : list[estimation_result.PackedResponse] = []
-            worker.set_work_size(len(self.subjects))
-            for i in range(0, len(self.subjects), CHUNK_SIZE):
-                request = estimation_result.Request(
-                    subjects=self.subjects[i:i+CHUNK_SIZE],
-                    models=options.models,
-                    disable_parallelism=options.disable_parallelism,
-                    disregard_deferrals=options.disregard_deferrals,
-                    distance_score=options.distance_score,
-                )
+        # Estimates are computed (and cached) one model at a time, so that re-running
+        # the estimation with more models ticked only estimates the new ones.
+        # The estimates are then combined as if the core estimated all models at once.
+        SRC = model.SequentiallyRationalizableChoice()
+        UC = model.UndominatedChoice(strict=True)
+        UM = model.PreorderMaximization(model.PreorderParams(strict=True, total=True))
+
+        # duplicate subjects are estimated only once
+        dedup = Deduplication(self.subjects)
+        subjects = dedup.representatives
+
+        estimates : list[dict[model.Model, estimation_result.PackedResponse]] = [{} for _ in subjects]
+        everyone = range(len(subjects))
+
+        # counted here rather than with worker.step() because not all workers keep their position
+        position = 0
+        def step() -> None:
+            nonlocal position
+            position += 1
+            worker.set_progress(position)
+
+        worker.set_work_size(len(subjects) * len(options.models))
+        for this_model in options.models:
+            if this_model != SRC:
+                self.estimate_model(worker, options, subjects, this_model, everyone, estimates, step)
+
+        def combined(i : int) -> estimation_result.PackedResponse:
+            responses = [estimates[i][m] for m in options.models if m in estimates[i]]
+            if len(responses) == 1:
+                return responses[0]  # nothing to combine
+
+            return estimation_result.PackedResponse(estimation_result.ResponseC.encode_to_memory(
+                estimation_result.combine_responses([
+                    estimation_result.ResponseC.decode_from_memory(r) for r in responses
+                ])
+            ))
+
+        if SRC in options.models:
+            # like the core, we estimate SRC only for subjects
+            # that are not rationalised perfectly by strict UC or UM
+            needs_src = []
+            for i in everyone:
+                if estimates[i]:
+                    response = estimation_result.ResponseC.decode_from_memory(combined(i))
+                    if 0 in (
+                        estimation_result.upper_bound_for(response, UC),
+                        estimation_result.upper_bound_for(response, UM),
+                    ):
+                        step()
+                        continue
 
-                responses = core.call(
-                    'estimation',
-                    estimation_result.RequestC,
-                    estimation_result.PackedResponsesC,
-                    request
-                )
-                rows.extend(responses)
+                needs_src.append(i)
 
-                worker.set_progress(len(rows))
+            self.estimate_model(worker, options, subjects, SRC, needs_src, estimates, step)
 
-            if options.distance_score != gui.estimation.DistanceScore.HOUTMAN_MAKS:
-                suffix = f' (model est., {options.distance_score.value})'
-            else:
-                suffix = ' (model est.)'
+        rows = spilled(dedup.fan_out(map(combined, everyone), estimation_result.renamed_response))
 
-            ds = EstimationResult(
-                self.name + suffix,
-                self.alternatives,
-            )
-            ds.subjects = rows
+        if options.distance_score != gui.estimation.DistanceScore.HOUTMAN_MAKS:
+            suffix = f' (model est., {options.distance_score.value})'
+        else:
+            suffix = ' (model est.)'
 
+        ds = EstimationResult(
+            self.name + suffix,
+            self.alternatives,
+        )
+        ds.subjects = rows
         return ds
 
+    def call_deduplicated(
+        self,
+        worker : Worker,
+        name : str,
+        codec_resp : Codec[Resp],
+        compute : Callable[[Sequence[PackedSubject]], Generator[Resp, None, None]],
+    ) -> Iterator[Resp]:
+        # the responses for all subjects, in order; duplicate subjects are computed only once
+        # and the responses come from the result cache where possible
+        dedup = Deduplication(self.subjects)
+        return dedup.fan_out(
+            cached_calls(worker.result_cache, name, b'', codec_resp, dedup.representatives, compute),
+            renamed,
+        )
+
+    def call_per_subject(self, worker : Worker, name : str, codec_resp : Codec[Resp]) -> Iterator[Resp]:
+        # one core request per subject, dealt out to a pool of cores
+        def compute(subjects : Sequence[PackedSubject]) -> Generator[Resp, None, None]:
+            with worker.core_session.pool(len(subjects)) as pool:
+                worker.interrupt = lambda: pool.cancel()  # interrupt hook
+                yield from pool.call_many(name, PackedSubjectC, codec_resp, subjects)
+
+        return self.call_deduplicated(worker, name, codec_resp, compute)
+
     def analysis_consistency_deterministic(self, worker : Worker, _config : None) -> DeterministicConsistencyResult:
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()  # interrupt hook
-
-            rows = []
-
-            worker.set_work_size(len(self.subjects))
-            for i, subject in enumerate(self.subjects):
-                response = core.call(
-                    'consistency-deterministic',
-                    PackedSubjectC,
-                    dataset.deterministic_consistency_result.SubjectRawC,
-                    subject
-                )
-                rows.append(response)
+        def compute(subjects : Sequence[PackedSubject]) -> Generator[dataset.deterministic_consistency_result.SubjectRaw, None, None]:
+            with worker.core_session.pool(len(subjects)) as pool:
+                worker.interrupt = lambda: pool.cancel()  # interrupt hook
+
+                # the batches are cut as the cores ask for them
+                for results in pool.call_many(
+                    'consistency-deterministic-batch',
+                    PackedSubjectsC,
+                    dataset.deterministic_consistency_result.SubjectResultsC,
+                    chunks(subjects),
+                ):
+                    yield from map(dataset.deterministic_consistency_result.unwrap, results)
 
-                worker.set_progress(i+1)
+        rows : list[dataset.deterministic_consistency_result.SubjectRaw] = []
+
+        worker.set_work_size(len(self.subjects))
+        for row in self.call_deduplicated(
+            worker,
+            'consistency-deterministic',
+            dataset.deterministic_consistency_result.SubjectRawC,
+            compute,
+        ):
+            rows.append(row)
+            worker.set_progress(len(rows))
 
         ds = DeterministicConsistencyResult(
             self.name + ' (deterministic consistency)',
@@ -348,22 +696,16 @@ class ExperimentalData(Dataset):
         return ds
 
     def analysis_consistency_stochastic(self, worker : Worker, _config : None) -> StochasticConsistencyResult:
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()  # interrupt hook
-
-            rows = []
-
-            worker.set_work_size(len(self.subjects))
-            for i, subject in enumerate(self.subjects):
-                response = core.call(
-                    'consistency-stochastic',
-                    PackedSubjectC,
-                    dataset.stochastic_consistency_result.SubjectC,
-                    subject
-                )
-                rows.append(response)
+        rows = []
 
-                worker.set_progress(i+1)
+        worker.set_work_size(len(self.subjects))
+        for i, response in enumerate(self.call_per_subject(
+            worker,
+            'consistency-stochastic',
+            dataset.stochastic_consistency_result.SubjectC,
+        )):
+            rows.append(response)
+            worker.set_progress(i+1)
 
         ds = StochasticConsistencyResult(
             self.name + ' (stochastic consistency)',
@@ -376,17 +718,13 @@ class ExperimentalData(Dataset):
         subjects = []
         worker.set_work_size(len(self.subjects))
 
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()
-
-            for i, subject in enumerate(self.subjects):
-                subjects.append(core.call(
-                    "summary",
-                    PackedSubjectC,
-                    dataset.experiment_stats.SubjectC,
-                    subject
-                ))
-                worker.set_progress(i+1)
+        for i, response in enumerate(self.call_per_subject(
+            worker,
+            "summary",
+            dataset.experiment_stats.SubjectC,
+        )):
+            subjects.append(response)
+            worker.set_progress(i+1)
 
         ds = ExperimentStats(
             name=self.name + ' (info)',
@@ -406,7 +744,8 @@ class ExperimentalData(Dataset):
         )
 
     def export_detailed(self) -> Iterator[Optional[tuple[str,str,Optional[str],str]]]:
-        for subject in map(SubjectC.decode_from_memory, self.subjects):
+        for packed in views(self.subjects):
+            subject = Subject.unpack(packed, self.alternatives)
             for cr in subject.choices:
                 yield (
                     subject.name,
@@ -421,19 +760,13 @@ class ExperimentalData(Dataset):
         subjects = []
         worker.set_work_size(len(self.subjects))
 
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()
-
-            for i, subject in enumerate(self.subjects):
-                subjects.append(
-                    core.call(
-                        'tuple-intrans-menus',
-                        PackedSubjectC,
-                        dataset.tuple_intrans_menus.SubjectC,
-                        subject,
-                    )
-                )
-                worker.set_progress(i+1)
+        for i, response in enumerate(self.call_per_subject(
+            worker,
+            'tuple-intrans-menus',
+            dataset.tuple_intrans_menus.SubjectC,
+        )):
+            subjects.append(response)
+            worker.set_progress(i+1)
 
         ds = TupleIntransMenus(self.name + ' (cyclic menu tuples)', self.alternatives)
         ds.subjects = subjects
@@ -443,19 +776,13 @@ class ExperimentalData(Dataset):
         subjects = []
         worker.set_work_size(len(self.subjects))
 
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()
-
-            for i, subject in enumerate(self.subjects):
-                subjects.append(
-                    core.call(
-                        'tuple-intrans-alts',
-                        PackedSubjectC,
-                        dataset.tuple_intrans_alts.SubjectC,
-                        subject,
-                    )
-                )
-                worker.set_progress(i+1)
+        for i, response in enumerate(self.call_per_subject(
+            worker,
+            'tuple-intrans-alts',
+            dataset.tuple_intrans_alts.SubjectC,
+        )):
+            subjects.append(response)
+            worker.set_progress(i+1)
 
         ds = TupleIntransAlts(self.name + ' (cyclic alternative tuples)', self.alternatives)
         ds.subjects = subjects
@@ -466,21 +793,15 @@ class ExperimentalData(Dataset):
 
         subjects : list[dataset.integrity_check.Subject] = []
 
-        with Core() as core:
-            worker.interrupt = lambda: core.shutdown()
-
-            for i, subject in enumerate(self.subjects):
-                subj_issues = core.call(
-                    'integrity-check',
-                    PackedSubjectC,
-                    dataset.integrity_check.SubjectC,
-                    subject
-                )
-
-                if subj_issues.issues:
-                    subjects.append(subj_issues)
+        for i, subj_issues in enumerate(self.call_per_subject(
+            worker,
+            'integrity-check',
+            dataset.integrity_check.SubjectC,
+        )):
+            if subj_issues.issues:
+                subjects.append(subj_issues)
 
-                worker.set_progress(i+1)
+            worker.set_progress(i+1)
 
         if subjects:
             ds = dataset.integrity_check.IntegrityCheck(self.name + ' (integrity check)', self.alternatives)
@@ -535,6 +856,11 @@ class ExperimentalData(Dataset):
                 config=self.config_merge_choices,
                 run=self.analysis_merge_choices,
             ),
+            Analysis(
+                name='Power analysis',
+                config=self.config_power_analysis,
+                run=self.analysis_power_analysis,
+            ),
             Analysis(
                 name='Generate similar random dataset',
                 config=self.config_simulation,
@@ -545,7 +871,7 @@ class ExperimentalData(Dataset):
     @classmethod
     def get_codec_progress(_cls) -> CodecProgress[ExperimentalData]:
         DatasetHeaderC_encode, DatasetHeaderC_decode = DatasetHeaderC.enc_dec()
-        subjects_size, subjects_encode, subjects_decode = listCP(oneCP(PackedSubjectC)).enc_dec()
+        subjects_size, subjects_encode, subjects_decode = spillingListCP(PackedSubjectC).enc_dec()
         intC_encode, intC_decode = intC.enc_dec()
 
         def get_size(x : ExperimentalData) -> int:
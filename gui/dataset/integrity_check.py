@@ -9,6 +9,7 @@ from PyQt5.QtWidgets import QDialog, QTreeWidgetItem, QHeaderView
 from util.codec import Codec, FileIn, FileOut, listC, strC, intC, \
     tupleC, namedtupleC, setC, frozensetC
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 
 log = logging.getLogger(__name__)
 
@@ -35,7 +36,7 @@ class Subject(NamedTuple):
     name : str
     issues : List[Issue]
 
-SubjectC = namedtupleC(Subject, strC, listC(IssueC))
+SubjectC = compiled(namedtupleC(Subject, strC, listC(IssueC)))
 
 class IssueNode(util.tree_model.Node):
     def __init__(self, parent_node, row: int, alternatives : List[str], issue : Issue) -> None:
@@ -0,0 +1,227 @@
+import math
+from typing import NamedTuple, List, Sequence, Iterator, Optional, Tuple
+from PyQt5.QtWidgets import QDialog, QHeaderView
+
+import simulation
+import uic.view_dataset
+import util.tree_model
+from core import Core
+from gui.progress import Worker
+from dataset import Dataset, DatasetHeaderC, Analysis, ExportVariant
+from util.codec import FileIn, FileOut, namedtupleC, listC, intC
+from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
+
+class Request(NamedTuple):
+    batch : simulation.BatchRequest  # the subjects of every replication
+    replications : int
+
+RequestC = namedtupleC(Request, simulation.BatchRequestC, intC)
+
+class Replication(NamedTuple):
+    subject_count : int
+
+    # the number of subjects with violations of
+    congruence : int
+    strict_general_cycles : int
+    warp : int
+    contraction_consistency : int
+
+    congruence_total : int  # all congruence violations of all subjects
+    warp_pairs : List[int]  # histogram: warp_pairs[n] subjects have n WARP pairs
+
+ReplicationC = compiled(namedtupleC(Replication, intC, intC, intC, intC, intC, intC, listC(intC)))
+
+# (label, field of Replication)
+MEASURES = (
+    ('Congruence', 'congruence'),
+    ('Strict general cycles', 'strict_general_cycles'),
+    ('WARP', 'warp'),
+    ('Contraction consistency', 'contraction_consistency'),
+)
+
+class Summary(NamedTuple):
+    measure : str
+    mean : float
+    sd : float
+    min : float
+    q05 : float
+    median : float
+    q95 : float
+    max : float
+
+def quantile(xs_sorted : Sequence[float], q : float) -> float:
+    # nearest rank
+    return xs_sorted[min(len(xs_sorted) - 1, max(0, math.ceil(q * len(xs_sorted)) - 1))]
+
+def summarise(measure : str, xs : Sequence[float]) -> Summary:
+    xs_sorted = sorted(xs)
+    mean = sum(xs) / len(xs)
+    return Summary(
+        measure=measure,
+        mean=mean,
+        sd=math.sqrt(sum((x - mean)**2 for x in xs) / (len(xs) - 1)) if len(xs) > 1 else 0.0,
+        min=xs_sorted[0],
+        q05=quantile(xs_sorted, 0.05),
+        median=quantile(xs_sorted, 0.5),
+        q95=quantile(xs_sorted, 0.95),
+        max=xs_sorted[-1],
+    )
+
+def run(worker : Worker, core : Core, request : Request) -> List[Replication]:
+    # the core simulates and analyses the subjects itself
+    # and only sends back a summary of every replication
+    replications : List[Optional[Replication]] = [None] * request.replications
+    worker.set_work_size(request.replications)
+
+    done = 0
+    for i, replication in core.call_streaming('power-analysis', RequestC, ReplicationC, request):
+        replications[i] = replication
+        done += 1
+        worker.set_progress(done)
+
+    return [r for r in replications if r is not None]
+
+class SummaryNode(util.tree_model.Node):
+    def __init__(self, parent_node : util.tree_model.Node, row: int, summary: Summary) -> None:
+        util.tree_model.Node.__init__(
+            self, parent_node, row,
+            fields=(summary.measure,) + tuple('%.1f %%' % (100 * x) for x in summary[1:]),
+            child_count=0,
+        )
+
+class RootNode(util.tree_model.RootNode):
+    def __init__(self, summaries : List[Summary]) -> None:
+        util.tree_model.RootNode.__init__(self, len(summaries))
+        self.summaries = summaries
+
+    def create_child(self, row: int) -> SummaryNode:
+        return SummaryNode(self, row, self.summaries[row])
+
+class PowerAnalysis(Dataset):
+    # The distribution, over the replications, of the share of random subjects
+    # that violate each consistency condition.
+
+    class ViewDialog(QDialog, uic.view_dataset.Ui_ViewDataset):
+        def __init__(self, ds : 'PowerAnalysis') -> None:
+            QDialog.__init__(self)
+            self.setupUi(self)
+            self.setWindowTitle('Power analysis: %d replications, random seed %d' % (len(ds.replications), ds.seed))
+
+            self.ds = ds
+            self.model = util.tree_model.TreeModel(
+                RootNode(ds.summaries()),
+                headers=('Random subjects violating', 'Mean', 'SD', 'Min',
+                    '5th percentile', 'Median', '95th percentile', 'Max'),
+            )
+            self.twRows.setModel(self.model)
+
+            self.twRows.header().setSectionResizeMode(QHeaderView.ResizeToContents)
+            self.twRows.header().setStretchLastSection(False)
+
+    def __init__(self, name : str, alternatives : Sequence[str] = ()) -> None:
+        Dataset.__init__(self, name, alternatives)
+        self.seed = 0
+        self.replications : List[Replication] = []
+
+    def label_alts(self) -> str:
+        return ''  # no alternatives in this dataset
+
+    def label_size(self) -> str:
+        return '%d replications' % len(self.replications)
+
+    def summaries(self) -> List[Summary]:
+        replications = [r for r in self.replications if r.subject_count > 0]
+        if not replications:
+            return []
+
+        return [
+            summarise(label, [getattr(r, field) / r.subject_count for r in replications])
+            for label, field in MEASURES
+        ]
+
+    def warp_pairs(self) -> List[int]:
+        # the histogram of all replications together
+        histogram = [0] * max((len(r.warp_pairs) for r in self.replications), default=0)
+        for r in self.replications:
+            for n, count in enumerate(r.warp_pairs):
+                histogram[n] += count
+        return histogram
+
+    def get_analyses(self) -> Sequence[Analysis]:
+        return ()
+
+    def get_export_variants(self) -> Sequence[ExportVariant]:
+        return (
+            ExportVariant(
+                name='Summary',
+                column_names=('measure', 'mean', 'sd', 'min', 'q05', 'median', 'q95', 'max'),
+                get_rows=self.export_summary,
+                size=len(MEASURES),
+            ),
+            ExportVariant(
+                name='Replications',
+                column_names=(
+                    'replication',
+                    'subjects',
+                    'congruence',
+                    'strict_general_cycles',
+                    'warp',
+                    'contraction_consistency',
+                    'congruence_total',
+                ),
+                get_rows=self.export_replications,
+                size=len(self.replications),
+            ),
+            ExportVariant(
+                name='WARP pairs (histogram)',
+                column_names=('warp_pairs', 'subjects'),
+                get_rows=self.export_warp_pairs,
+                size=len(self.warp_pairs()),
+            ),
+        )
+
+    def export_summary(self) -> Iterator[Optional[Summary]]:
+        for summary in self.summaries():
+            yield summary
+            yield None  # bump progress
+
+    def export_replications(self) -> Iterator[Optional[Tuple[int,int,int,int,int,int,int]]]:
+        for i, r in enumerate(self.replications):
+            yield (
+                i + 1,
+                r.subject_count,
+                r.congruence,
+                r.strict_general_cycles,
+                r.warp,
+                r.contraction_consistency,
+                r.congruence_total,
+            )
+            yield None  # bump progress
+
+    def export_warp_pairs(self) -> Iterator[Optional[Tuple[int,int]]]:
+        for n, count in enumerate(self.warp_pairs()):
+            yield (n, count)
+            yield None  # bump progress
+
+    @classmethod
+    def get_codec_progress(_cls) -> CodecProgress['PowerAnalysis']:
+        DatasetHeaderC_encode, DatasetHeaderC_decode = DatasetHeaderC.enc_dec()
+        replications_size, replications_encode, replications_decode = listCP(oneCP(ReplicationC)).enc_dec()
+        intC_encode, intC_decode = intC.enc_dec()
+
+        def get_size(x : 'PowerAnalysis') -> int:
+            return replications_size(x.replications)
+
+        def encode(worker : Worker, f : FileOut, x : 'PowerAnalysis') -> None:
+            DatasetHeaderC_encode(f, (x.name, x.alternatives))
+            intC_encode(f, x.seed)
+            replications_encode(worker, f, x.replications)
+
+        def decode(worker : Worker, f : FileIn) -> 'PowerAnalysis':
+            ds = PowerAnalysis(*DatasetHeaderC_decode(f))
+            ds.seed = intC_decode(f)
+            ds.replications = replications_decode(worker, f)
+            return ds
+
+        return CodecProgress(get_size, encode, decode)
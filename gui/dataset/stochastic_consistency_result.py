@@ -13,6 +13,7 @@ from gui.progress import Worker
 from dataset import Dataset, DatasetHeaderC, ExportVariant, Analysis
 from util.codec import FileIn, FileOut, dataclassC, strC, intC
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 from util.tree_model import Node
 from PyQt5.QtGui import QIcon
 
@@ -31,7 +32,7 @@ class Subject:
 
     regularity : int
 
-SubjectC = dataclassC(Subject, strC, intC, intC, intC, intC)
+SubjectC = compiled(dataclassC(Subject, strC, intC, intC, intC, intC))
 
 class RootNode(util.tree_model.RootNode):
     def __init__(self, subjects: list[Subject]) -> None:
@@ -9,6 +9,7 @@ from dataset import Dataset, DatasetHeaderC, Analysis, ExportVariant
 from util.codec import Codec, FileIn, FileOut, listC, strC, intC, \
     tupleC, namedtupleC, setC, frozensetC
 from util.codec_progress import CodecProgress, listCP, oneCP
+from util.codec_compiler import compiled
 
 log = logging.getLogger(__name__)
 
@@ -22,7 +23,7 @@ class Subject(NamedTuple):
     name : str
     rows : List[Row]
 
-SubjectC = namedtupleC(Subject, strC, listC(RowC))
+SubjectC = compiled(namedtupleC(Subject, strC, listC(RowC)))
 
 class AltRowNode(util.tree_model.Node):
     def __init__(self, parent_node, row: int, alternatives : List[str], xs : FrozenSet[int]) -> None:
@@ -12,6 +12,17 @@ log = logging.getLogger(__name__)
 class ValidationError(Exception):
     pass
 
+def parse_seed(text : str, bits : int) -> int:
+    try:
+        seed = int(text.strip())
+    except ValueError:
+        raise ValidationError('The random seed must be a whole number.')
+
+    if not 0 <= seed < 2**bits:
+        raise ValidationError('The random seed must be between 0 and %d.' % (2**bits - 1))
+
+    return seed
+
 class ExceptionDialog(QDialog):
     def catch_exc(self, f : Callable) -> Callable:
         @functools.wraps(f)
@@ -13,7 +13,7 @@ import gui
 import simulation
 import gui.subject_filter
 import uic.copycat_simulation
-from dataset import SubjectC
+from dataset import Subject
 from gui.progress import Worker, Cancelled
 
 if TYPE_CHECKING:
@@ -28,6 +28,36 @@ class Options:
     gen_choices : simulation.GenChoices
     preserve_deferrals : bool
     subject_filter : Optional[gui.subject_filter.Options]
+    seed : int
+
+def choice_features(ds : ExperimentalData) -> tuple[bool, bool, bool]:
+    # are there menus with defaults, menus without defaults, and deferrals?
+    class MyWorker(Worker[tuple[bool, bool, bool]]):
+        def work(self) -> tuple[bool, bool, bool]:
+            has_defaults = False
+            has_nondefaults = False
+            has_deferrals = False
+
+            self.set_work_size(len(ds.subjects))
+            for i, subject in enumerate(Subject.unpack(packed, ds.alternatives) for packed in ds.subjects):
+                has_defaults |= any(cr.default is not None for cr in subject.choices)
+                has_nondefaults |= any(cr.default is None for cr in subject.choices)
+                has_deferrals |= any(not(cr.choice) for cr in subject.choices)
+                self.set_progress(i)
+
+                if has_defaults and has_nondefaults and has_deferrals:
+                    break
+
+            return has_defaults, has_nondefaults, has_deferrals
+
+    try:
+        return MyWorker().run_with_progress(
+            None,  # parent widget
+            'Analysing dataset...',
+        )
+    except Cancelled:
+        log.debug('dataset check cancelled')
+        return True, True, True
 
 class CopycatSimulation(uic.copycat_simulation.Ui_CopycatSimulation, gui.ExceptionDialog):
     def __init__(self, ds : ExperimentalData, experimental_features : bool) -> None:
@@ -39,36 +69,12 @@ class CopycatSimulation(uic.copycat_simulation.Ui_CopycatSimulation, gui.Excepti
         self.update_counts(self.sbMultiplicity.value())
         self.sbMultiplicity.valueChanged.connect(self.catch_exc(self.update_counts))
         self.leName.setText(ds.name + ' (random choices)')
+        self.leSeed.setText(str(simulation.random_seed()))
         if not experimental_features:
             self.gbFilter.setVisible(False)
 
-        class MyWorker(Worker):
-            def work(self):
-                has_defaults = False
-                has_nondefaults = False
-                has_deferrals = False
-
-                self.set_work_size(len(ds.subjects))
-                for i, subject in enumerate(map(SubjectC.decode_from_memory, ds.subjects)):
-                    has_defaults |= any(cr.default is not None for cr in subject.choices)
-                    has_nondefaults |= any(cr.default is None for cr in subject.choices)
-                    has_deferrals |= any(not(cr.choice) for cr in subject.choices)
-                    self.set_progress(i)
-
-                    if has_defaults and has_nondefaults and has_deferrals:
-                        break
-
-                return has_defaults, has_nondefaults, has_deferrals
-
-        try:
-            has_defaults, has_nondefaults, has_deferrals = MyWorker().run_with_progress(
-                None,  # parent widget
-                'Analysing dataset...',
-            )
-            self.genChoices.setDefault(has_defaults, has_nondefaults)
-        except Cancelled:
-            self.genChoices.setDefault(True, True)
-            log.debug('copycat simulation check cancelled')
+        has_defaults, has_nondefaults, has_deferrals = choice_features(ds)
+        self.genChoices.setDefault(has_defaults, has_nondefaults)
 
         self.cbPreserveDeferrals.setChecked(False)
         self.cbPreserveDeferrals.setEnabled(has_deferrals)
@@ -94,5 +100,6 @@ class CopycatSimulation(uic.copycat_simulation.Ui_CopycatSimulation, gui.Excepti
             subject_filter=
                 self.subjectFilter.value()
                 if self.gbFilter.isChecked()
-                else None
+                else None,
+            seed=gui.parse_seed(self.leSeed.text(), simulation.SEED_BITS),
         )
@@ -10,10 +10,13 @@ import gui
 import dataset
 import dataset.experimental_data
 import uic.import_csv
-from dataset import SubjectC
+from dataset import Subject
+from gui.progress import Worker, Cancelled
 
 log = logging.getLogger(__name__)
 
+PREVIEW_ROWS = 1024
+
 class ImportCsv(uic.import_csv.Ui_ImportCsv, gui.ExceptionDialog):
     def __init__(self, main_win):
         QDialog.__init__(self)
@@ -69,7 +72,7 @@ class ImportCsv(uic.import_csv.Ui_ImportCsv, gui.ExceptionDialog):
 
             i = 0
             self.tblPreview.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)  # autoresize is **SLOW**
-            for subj in map(SubjectC.decode_from_memory, ds.subjects):
+            for subj in (Subject.unpack(packed, ds.alternatives) for packed in ds.subjects):
                 for cr in subj.choices:
                     self.tblPreview.setItem(i, 0, QTableWidgetItem(subj.name))
                     self.tblPreview.setItem(i, 1, QTableWidgetItem(subj.csv_set(cr.menu)))
@@ -106,30 +109,36 @@ class ImportCsv(uic.import_csv.Ui_ImportCsv, gui.ExceptionDialog):
 
         preview()
 
-    def make_dataset(self, name='CSV preview') -> dataset.experimental_data.ExperimentalData:
+    def indices(self) -> tuple[int,int,Optional[int],int]:
         assert self.column_names is not None
-        assert self.rows is not None
 
-        indices = (
+        return (
             self.cbSubject.currentIndex(),
             self.cbMenu.currentIndex(),
             self.cbDefault.currentIndex() if self.cbDefault.currentIndex() < len(self.column_names) else None,
             self.cbChoice.currentIndex(),
         )
 
+    @staticmethod
+    def check_dataset(ds : dataset.experimental_data.ExperimentalData) -> None:
+        if '' in ds.alternatives:
+            raise Exception('dataset contains an alternative with an empty name')
+
+    def make_dataset(self, name='CSV preview') -> dataset.experimental_data.ExperimentalData:
+        assert self.rows is not None
+
         ds = dataset.experimental_data.ExperimentalData.from_csv(
             name=name,
             rows=self.rows,
-            indices=indices,
+            indices=self.indices(),
         )
-
-        if '' in ds.alternatives:
-            raise Exception('dataset contains an alternative with an empty name')
+        self.check_dataset(ds)
 
         return ds
 
     # override
     def accept(self) -> None:
+        # this checks only the preview rows, the rest is checked while importing
         try:
             _ = self.make_dataset()
         except Exception as e:
@@ -146,14 +155,28 @@ class ImportCsv(uic.import_csv.Ui_ImportCsv, gui.ExceptionDialog):
 
         def work():
             assert fname is not None
-            ds = self.make_dataset(name=os.path.basename(fname))
+            indices = self.indices()
+
+            class MyWorker(Worker):
+                def work(self) -> dataset.experimental_data.ExperimentalData:
+                    assert fname is not None
+                    return dataset.experimental_data.ExperimentalData.load_from_csv(self, fname, indices)
+
+            try:
+                ds = MyWorker().run_with_progress(self.main_win, 'Importing %s...' % os.path.basename(fname))
+            except Cancelled:
+                log.debug('CSV import cancelled')
+                return
+
+            self.check_dataset(ds)
             self.main_win.add_dataset(ds)
 
         fname, _something = QFileDialog.getOpenFileName(self, "Import CSV", filter="CSV files (*.csv)")
         if not fname:
             return
 
-        rows = dataset.load_raw_csv(fname)
+        # only what we need for the preview, the whole file is streamed on import
+        rows = dataset.load_raw_csv(fname, max_rows=1+PREVIEW_ROWS)
         if not rows:
             QMessageBox.warning(
                 self,
@@ -1,25 +1,31 @@
 import sys
+import time
 import logging
 import functools
 import os.path
 
-from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtCore import Qt, pyqtSlot, QSettings
 from PyQt5.QtGui import QIcon, QKeySequence
 from PyQt5.QtWidgets import QHeaderView, QMainWindow, QDialog, QMessageBox, \
     QTableWidgetItem, QFileDialog, QTreeWidgetItem, QProgressDialog, QMenu, QAction, \
-    QStyle, QShortcut, QInputDialog
+    QStyle, QShortcut, QInputDialog, QActionGroup
 
 import uic.main_window
 
 import doc
 import dataset
+import journal
 import workspace
 import simulation
 import platform_specific
+import branding
 import dataset.experimental_data
 import dataset.budgetary
-from core import Core
-from workspace import Workspace
+from core import CoreSession
+from util.result_cache import ResultCache
+from util.block_compression import Compression
+from util.packed_list import SpillingBlocks
+from workspace import Workspace, PersistenceError
 from gui.progress import Worker, Cancelled
 from typing import Optional, List, Tuple, Any, Set, Dict, Iterator, Iterable, Callable
 
@@ -32,6 +38,15 @@ import gui.subject_filter
 
 log = logging.getLogger(__name__)
 
+# generated subjects between progress updates
+PROGRESS_INTERVAL = 256
+
+SETTING_WORKSPACE_COMPRESSION = 'workspace/compression'
+
+def settings() -> QSettings:
+    # not under the application name, which includes the version
+    return QSettings('Prest', 'Prest')
+
 class MainWindowError(Exception):
     pass
 
@@ -53,6 +68,18 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
 
         # instance attributes
         self.workspace = workspace.Workspace()
+        self.core_session = CoreSession()  # started lazily
+        self.result_cache = ResultCache.open_default(salt=branding.VERSION)
+        self.workspace_compression = Compression.DEFAULT
+        try:
+            self.workspace_compression = Compression(settings().value(
+                SETTING_WORKSPACE_COMPRESSION, Compression.DEFAULT.value,
+            ))
+        except ValueError:
+            log.warning('ignoring unknown workspace compression setting')
+        self.journal : Optional[journal.Journal] = None
+        self.untitled_lock : Optional[journal.Lock] = None  # held while the app runs
+        self.file_lock : Optional[journal.Lock] = None  # held while the journal of windowFilePath() is kept
 
         # main menu
         self.actionGenerate_random_subjects.triggered.connect(self.catch_exc(self.dlg_simulation))
@@ -72,6 +99,29 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
         self.actionSoft_core_failure.triggered.connect(self.catch_exc(self.dlg_soft_core_failure))
         self.actionHidden_features.toggled.connect(self.catch_exc(self.enable_hidden_features))
 
+        # workspace compression, after "Save as"
+        m_compression = QMenu('Workspace compression', self.menuWorkspace)
+        g_compression = QActionGroup(m_compression)
+        for compression, label, tip in (
+            (Compression.FAST, 'Fast', 'Save quickly, into bigger files.'),
+            (Compression.DEFAULT, 'Balanced', 'Balance saving speed and file size.'),
+            (Compression.SMALL, 'Small', 'Save into smaller files, more slowly.'),
+        ):
+            a_compression = QAction(label, g_compression)
+            a_compression.setCheckable(True)
+            a_compression.setChecked(compression is self.workspace_compression)
+            a_compression.setStatusTip(tip)
+            a_compression.triggered.connect(self.catch_exc(
+                functools.partial(self.set_workspace_compression, compression)
+            ))
+            m_compression.addAction(a_compression)
+
+        workspace_actions = self.menuWorkspace.actions()
+        self.menuWorkspace.insertMenu(
+            workspace_actions[workspace_actions.index(self.actionWorkspaceSaveAs) + 1],
+            m_compression,
+        )
+
         self.tblDataSets.doubleClicked.connect(self.catch_exc(self.dlg_view_current_dataset))
         self.tblDataSets.customContextMenuRequested.connect(self.catch_exc(self.context_menu))
 
@@ -100,6 +150,8 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
             log.exception('could not start doc server')
             # it's running elsewhere
 
+        self.start_untitled()
+
     def enable_debugging_tools(self) -> None:
         log.debug('enabling debugging tools...')
         self.menuDebugging_tools.menuAction().setVisible(True)
@@ -132,9 +184,10 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
             log.debug('context menu requested but no item selected')
             return
 
-        ds = self.workspace.datasets[
-            self.tblDataSets.row(item)
-        ]
+        loaded = self.dataset_at(self.tblDataSets.row(item))
+        if loaded is None:
+            return  # loading cancelled
+        ds : dataset.Dataset = loaded
 
         menu = QMenu(self)
         icon_hidden = QIcon(platform_specific.get_embedded_file_path(
@@ -143,7 +196,9 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
         ))
 
         a_view = QAction("View...", menu)
-        a_view.triggered.connect(self.catch_exc(ds.dlg_view))
+        a_view.triggered.connect(self.catch_exc(
+            functools.partial(ds.dlg_view, core_session=self.core_session)
+        ))
         a_view.setStatusTip('Display the dataset in a separate window. Also available via double click.')
         menu.addAction(a_view)
 
@@ -155,6 +210,9 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
             )
             if ok and new_name:
                 ds.name = new_name
+                if self.journal is not None:
+                    self.journal.rename(self.workspace.datasets.index(ds), new_name)
+                self.setWindowModified(True)
                 self.refresh_datasets()
 
         a_rename = QAction("Rename...", menu)
@@ -281,6 +339,8 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
                     event.ignore()
                     return
 
+        # the changes have been saved or the user does not want them
+        self.stop_journal(discard=True)
         event.accept()
 
     def dlg_workspace_clear(self, _flag) -> None:
@@ -304,10 +364,12 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
                     )
                     return
 
+        self.stop_journal(discard=True)
         self.workspace.datasets = []
         self.setWindowModified(False)
         self.setWindowFilePath('')
         self.refresh_datasets()
+        self.start_journal(base='')
 
     def dlg_workspace_load(self, _flag) -> None:
         if self.isWindowModified():
@@ -343,26 +405,182 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
 
             try:
                 MyWorker(self.workspace).run_with_progress(self, "Loading %s..." % fname)
-                self.refresh_datasets()
-                self.setWindowFilePath(fname)
-                self.setWindowModified(False)
             except Cancelled:
                 log.info('PWF load cancelled')
+                return
+
+            # the changes to the previous workspace have been saved or dropped
+            self.stop_journal(discard=True)
+
+            self.refresh_datasets()
+            self.setWindowFilePath(fname)
+            self.setWindowModified(False)
+
+            if self.journal_fname() is not None and self.offer_recovery(fname):
+                self.start_journal(base=None)  # continue the recovered journal
+            else:
+                self.start_journal(base=fname)
+
+    def start_untitled(self) -> None:
+        # untitled workspaces have a journal of their own in the user data directory;
+        # the journals left behind by crashed instances are offered for recovery
+        try:
+            dirname = platform_specific.get_user_data_dir()
+            os.makedirs(dirname, exist_ok=True)
+            orphans = journal.find_orphans(dirname)
+        except OSError as e:
+            log.warning('could not use user data directory: %s' % e)
+            return
+
+        recovered = self.offer_orphan_recovery(orphans)
+        for lock in orphans:
+            if lock is not recovered:
+                lock.release()
+
+        if recovered is not None:
+            self.untitled_lock = recovered
+            self.start_journal(base=None)  # continue the recovered journal
+            return
+
+        try:
+            self.untitled_lock = journal.new_untitled(dirname)
+        except OSError as e:
+            log.warning('could not create untitled workspace journal: %s' % e)
+            return
+
+        self.start_journal(base='')
+
+    def journal_fname(self) -> Optional[str]:
+        # the workspace file whose journal we're keeping, if any
+        if self.windowFilePath():
+            if self.file_lock is None:
+                try:
+                    self.file_lock = journal.Lock.acquire(self.windowFilePath())
+                except OSError as e:
+                    log.warning('could not lock journal for %s: %s' % (self.windowFilePath(), e))
+                    return None
+
+                if self.file_lock is None:
+                    log.warning('%s is open in another instance, not keeping a journal' % self.windowFilePath())
+                    return None
+
+            return self.file_lock.fname
+        elif self.untitled_lock is not None:
+            return self.untitled_lock.fname
+        else:
+            return None
+
+    def start_journal(self, base : Optional[str]) -> None:
+        # base: see journal.Journal
+        fname = self.journal_fname()
+        if fname is not None:
+            self.journal = journal.Journal(fname, self.workspace.datasets, base)
+
+    def stop_journal(self, discard : bool) -> None:
+        if self.journal is not None:
+            if discard:
+                self.journal.close_and_discard()
+            else:
+                self.journal.close()
+            self.journal = None
+
+        # the untitled lock is kept for the next untitled workspace
+        if self.file_lock is not None:
+            self.file_lock.release()
+            self.file_lock = None
+
+    def offer_recovery(self, fname : str) -> bool:
+        # returns True if the workspace has been replaced with the recovered one
+        if not journal.has_records(fname):
+            return False
+
+        answer = QMessageBox.question(
+            self,
+            "Recover workspace",
+            "Prest was not shut down properly. Do you want to recover the unsaved changes to %s?" % (
+                self.windowFilePath() or 'the workspace',
+            ),
+            defaultButton=QMessageBox.Yes,
+        )
+        if answer != QMessageBox.Yes:
+            return False
+
+        return self.recover(fname)
+
+    def offer_orphan_recovery(self, orphans : List[journal.Lock]) -> Optional[journal.Lock]:
+        # returns the orphan whose workspace replaced the current one, if any;
+        # the orphans are discarded if the user does not want any of them
+        if not orphans:
+            return None
+
+        items = [
+            '%s (last changed %s)' % (
+                os.path.basename(lock.fname),
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(
+                    os.path.getmtime(journal.journal_path(lock.fname))
+                )),
+            )
+            for lock in orphans
+        ]
+        item, ok = QInputDialog.getItem(
+            self,
+            "Recover workspace",
+            "Prest was not shut down properly. Which unsaved workspace do you want to recover?",
+            items,
+            editable=False,
+        )
+        if not ok:
+            for lock in orphans:
+                journal.discard(lock.fname)
+            return None
+
+        lock = orphans[items.index(item)]
+        return lock if self.recover(lock.fname) else None
+
+    def recover(self, fname : str) -> bool:
+        # returns True if the workspace has been replaced with the recovered one
+        class MyWorker(Worker[Workspace]):
+            def work(self) -> Workspace:
+                return journal.recover(self, fname)
+
+        try:
+            self.workspace = MyWorker().run_with_progress(self, 'Recovering %s...' % fname)
+        except Cancelled:
+            log.info('recovery cancelled')
+            return False
+        except PersistenceError as e:
+            log.exception('could not recover workspace')
+            QMessageBox.warning(self, "Recover workspace", "Could not recover the workspace: %s" % e)
+            return False
+
+        self.refresh_datasets()
+        self.setWindowModified(True)
+        return True
+
+    def set_workspace_compression(self, compression : Compression, _flag : bool) -> None:
+        self.workspace_compression = compression
+        settings().setValue(SETTING_WORKSPACE_COMPRESSION, compression.value)
 
     def workspace_save_into(self, fname : str) -> bool:
         class MyWorker(Worker[None, Workspace]):
             def work(self, workspace : Workspace) -> None:
-                workspace.save_to_file(self, fname)
+                workspace.save_to_file(self, fname, compression)
+
+        compression = self.workspace_compression
 
         try:
             MyWorker(self.workspace).run_with_progress(self, 'Saving to %s...' % fname)
-            self.setWindowFilePath(fname)
-            self.setWindowModified(False)
-            return True
         except Cancelled:
             log.info('PWF save cancelled')
             return False
 
+        # the journal starts afresh on top of the saved file
+        self.stop_journal(discard=True)
+        self.setWindowFilePath(fname)
+        self.setWindowModified(False)
+        self.start_journal(base=fname)
+        return True
+
     # returns bool because it's used in workspace_load
     # True: saved successfully
     # False: save cancelled
@@ -397,6 +615,8 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
             return
 
         options = dlg.value()
+        subject_filter = gui.subject_filter.CompiledFilter(options.subject_filter) \
+            if options.subject_filter is not None else None
 
         class MyWorker(Worker):
             def work(self) -> dataset.experimental_data.ExperimentalData:
@@ -404,43 +624,54 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
                 ds = dataset.experimental_data.ExperimentalData(options.dataset_name, [])
                 ds.alternatives = options.alternatives
                 ds.observ_count = 0
+                subjects : SpillingBlocks[dataset.PackedSubject] = SpillingBlocks()
+
+                request = simulation.BatchRequest(
+                    name='random',
+                    alternatives=options.alternatives,
+                    subjects=simulation.Generated(options.gen_menus),
+                    gen_choices=options.gen_choices,
+                    preserve_deferrals=False,
+                    first_index=1,
+                    last_index=options.subject_count,
+                    seed=options.seed,
+                )
 
-                with Core() as core:
-                    self.interrupt = lambda: core.shutdown()
-
-                    for subj_nr in range(1, options.subject_count+1):
-                        while True:
-                            response = simulation.run(core, simulation.Request(
-                                name='random%d' % subj_nr,
-                                alternatives=options.alternatives,
-                                gen_menus=options.gen_menus,
-                                gen_choices=options.gen_choices,
-                                preserve_deferrals=False,
-                            ))
-
-                            subject_accepted = gui.subject_filter.accepts(
-                                options.subject_filter,
-                                core,
-                                response.subject_packed,
-                            )
-
-                            if subject_accepted:
-                                ds.subjects.append(response.subject_packed)
-                                ds.observ_count += response.observation_count
-                                self.set_progress(subj_nr)
-                                # move on to the next subject
-                                break
-                            else:
-                                # retry
-                                continue
+                with self.core_session.core() as core:
+                    self.interrupt = lambda: core.cancel()
 
+                    responses : Iterable[simulation.Response]
+                    if subject_filter is None:
+                        responses = simulation.run_batch(core, request)
+                    else:
+                        responses = simulation.run_batch_filtered(
+                            self, core, request,
+                            lambda subjects: subject_filter.accepts_many(core, subjects),
+                        )
+
+                    for response in responses:
+                        subjects.append(response.subject_packed)
+                        ds.observ_count += response.observation_count
+                        if len(subjects) % PROGRESS_INTERVAL == 0:
+                            self.set_progress(len(subjects))
+
+                ds.subjects = subjects.blocks
                 return ds
 
+        worker = MyWorker()
+        worker.core_session = self.core_session
+
         try:
-            new_ds = MyWorker().run_with_progress(self, 'Generating subjects...')
+            new_ds = worker.run_with_progress(self, 'Generating subjects...')
             self.add_dataset(new_ds)
         except Cancelled:
             log.debug('simulation cancelled')
+            return
+
+        if subject_filter is not None:
+            message = subject_filter.describe(len(new_ds.subjects))
+            log.info('subject filter: %s' % message)
+            QMessageBox.information(self, 'Subject filter', message)
 
     def show_console_window(self, should_show: bool):
         if should_show:
@@ -454,19 +685,26 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
 
     def shutdown(self):
         log.debug('shutting GUI down')
-        # nothing else to do
+        self.stop_journal(discard=False)
+        if self.untitled_lock is not None:
+            self.untitled_lock.release()
+            self.untitled_lock = None
+        self.core_session.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
 
     def dlg_view_current_dataset(self, _flag):
         ds = self.selected_dataset()
         if ds is not None:
-            ds.dlg_view()
+            ds.dlg_view(core_session=self.core_session)
 
     def dlg_crash_core(self, _flag):
-        with Core() as core:
+        # the dead core is replaced on next use
+        with self.core_session.core() as core:
             core.crash()
 
     def dlg_soft_core_failure(self, _flag):
-        with Core() as core:
+        with self.core_session.core() as core:
             core.soft_failure()
 
     def dlg_dataset_import(self, _flag):
@@ -479,6 +717,8 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
         # insert into datasets
         self.workspace.datasets.append(ds)
         self.setWindowModified(True)
+        if self.journal is not None:
+            self.journal.add(ds)
 
         self.add_dataset_to_table(ds)
 
@@ -489,8 +729,10 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
         self.tblDataSets.removeRow(idx)
         self.workspace.datasets.pop(idx)
         self.setWindowModified(True)
+        if self.journal is not None:
+            self.journal.delete(idx)
 
-    def add_dataset_to_table(self, ds : dataset.Dataset):
+    def add_dataset_to_table(self, ds : workspace.WorkspaceItem):
         # insert into the table widget
         tbl = self.tblDataSets
         j = tbl.rowCount()
@@ -516,6 +758,26 @@ class MainWindow(QMainWindow, uic.main_window.Ui_MainWindow, gui.ExceptionDialog
         idx = self.tblDataSets.currentRow()
 
         try:
-            return self.workspace.datasets[idx]
+            return self.dataset_at(idx)
         except IndexError as e:
             raise MainWindowError('Internal error: selecting non-existent dataset #%d' % idx) from e
+
+    def dataset_at(self, idx : int) -> Optional[dataset.Dataset]:
+        # datasets from workspace files are loaded when first needed;
+        # returns None if the user cancels that
+        ds = self.workspace.datasets[idx]
+        if not isinstance(ds, workspace.DatasetStub):
+            return ds
+
+        class MyWorker(Worker[dataset.Dataset, workspace.DatasetStub]):
+            def work(self, stub : workspace.DatasetStub) -> dataset.Dataset:
+                return stub.load(self)
+
+        try:
+            loaded = MyWorker(ds).run_with_progress(self, 'Loading %s...' % ds.name)
+        except Cancelled:
+            log.info('dataset loading cancelled')
+            return None
+
+        self.workspace.datasets[idx] = loaded
+        return loaded
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+
+from PyQt5.QtWidgets import QDialog
+
+import gui
+import simulation
+import uic.power_analysis
+from gui.copycat_simulation import choice_features
+
+if TYPE_CHECKING:
+    from dataset.experimental_data import ExperimentalData
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class Options:
+    replications : int
+    gen_choices : simulation.GenChoices
+    preserve_deferrals : bool
+    seed : int
+
+class PowerAnalysis(uic.power_analysis.Ui_PowerAnalysis, gui.ExceptionDialog):
+    def __init__(self, ds : ExperimentalData) -> None:
+        QDialog.__init__(self)
+        self.setupUi(self)
+
+        self.leSeed.setText(str(simulation.random_seed()))
+
+        has_defaults, has_nondefaults, has_deferrals = choice_features(ds)
+        self.genChoices.setDefault(has_defaults, has_nondefaults)
+
+        self.cbPreserveDeferrals.setChecked(False)
+        self.cbPreserveDeferrals.setEnabled(has_deferrals)
+
+    def value(self) -> Options:
+        return Options(
+            replications=self.sbReplications.value(),
+            gen_choices=self.genChoices.value(),
+            preserve_deferrals=self.cbPreserveDeferrals.isChecked(),
+            seed=gui.parse_seed(self.leSeed.text(), simulation.SEED_BITS),
+        )
@@ -10,6 +10,8 @@ from PyQt5.QtWidgets import QDialog
 
 import gui
 import uic.progress
+from core import CoreSession
+from util.result_cache import ResultCache
 from dataclasses import dataclass
 
 log = logging.getLogger(__name__)
@@ -50,6 +52,13 @@ class Worker(Generic[Result, *Args], QThread):
     work_size = pyqtSignal(int)
     progress = pyqtSignal(int)
 
+    # where the work gets its cores from;
+    # the GUI hands in its long-lived session, everyone else starts fresh cores
+    core_session : CoreSession = CoreSession(persistent=False)
+
+    # the GUI also hands in its result cache; no caching otherwise
+    result_cache : Optional[ResultCache] = None
+
     def __init__(self, *args : *Args) -> None:
         QObject.__init__(self)
         self.result : Result | NoResult = NoResult()
@@ -151,7 +160,7 @@ class Worker(Generic[Result, *Args], QThread):
             raise Cancelled()
         else:
             if interrupted:
-                # this exception was likely caused by killing the core
+                # this exception was likely caused by interrupting the core
                 # via worker.interrupt(), after the user requested cancel
                 # let's ignore it
                 raise Cancelled()
@@ -160,7 +169,7 @@ class Worker(Generic[Result, *Args], QThread):
 
 class MockWorker(Worker):
     def __init__(self):
-        pass
+        self.position = 0
 
     def set_work_size(self, _size : int) -> None:
         pass
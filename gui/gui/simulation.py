@@ -25,6 +25,7 @@ class Options:
     gen_menus : simulation.GenMenus
     gen_choices : simulation.GenChoices
     subject_filter : Optional[gui.subject_filter.Options]
+    seed : int
 
 class Simulation(uic.simulation.Ui_Simulation, gui.ExceptionDialog):
     def __init__(self, experimental_features : bool) -> None:
@@ -33,6 +34,7 @@ class Simulation(uic.simulation.Ui_Simulation, gui.ExceptionDialog):
 
         self.leAlternatives.textChanged.connect(self.catch_exc(self.update_alternatives))
         self.update_alternatives('')
+        self.leSeed.setText(str(simulation.random_seed()))
 
         if not experimental_features:
             self.gbFilter.setVisible(False)
@@ -68,5 +70,6 @@ class Simulation(uic.simulation.Ui_Simulation, gui.ExceptionDialog):
             subject_filter=
                 self.subjectFilter.value()
                 if self.gbFilter.isChecked()
-                else None
+                else None,
+            seed=gui.parse_seed(self.leSeed.text(), simulation.SEED_BITS),
         )
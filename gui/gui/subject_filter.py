@@ -1,6 +1,6 @@
 import logging
 from dataclasses import dataclass
-from typing import Any, Optional
+from typing import Any, Sequence
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget
@@ -20,24 +20,52 @@ class Options:
     run_consistency_analysis : bool
     condition_code : str
 
-def accepts(options : Optional[Options], core : Core, subject_packed : dataset.PackedSubject) -> bool:
-    if options is None:
-        return True
-
-    env : dict[str, Any] = {}
-
-    if options.run_consistency_analysis:
-        env['consistency'] = core.call(
-            'consistency',
-            dataset.PackedSubjectC,
-            dataset.deterministic_consistency_result.SubjectRawC,
-            subject_packed
+class CompiledFilter:
+    # The condition is compiled once and evaluated on whole batches of candidates,
+    # with one core request per batch for the consistency analysis.
+    #
+    # Counts the candidates so that we can tell the user how picky the filter is.
+
+    def __init__(self, options : Options) -> None:
+        self.options = options
+        self.code = compile(options.condition_code, '<subject filter>', 'eval')
+        self.attempts = 0
+        self.accepted = 0
+
+    def accepts_many(self, core : Core, subjects : Sequence[dataset.PackedSubject]) -> list[bool]:
+        envs : list[dict[str, Any]] = [{} for _ in subjects]
+
+        if self.options.run_consistency_analysis and subjects:
+            outcomes = core.call(
+                'consistency-deterministic-batch',
+                dataset.PackedSubjectsC,
+                dataset.deterministic_consistency_result.SubjectResultsC,
+                list(subjects),
+            )
+            for env, outcome in zip(envs, outcomes):
+                env['consistency'] = dataset.deterministic_consistency_result.unwrap(outcome)
+
+        verdicts = []
+        for env in envs:
+            result : Any = eval(self.code, env)
+            assert isinstance(result, bool)  # SubjectFilter.value() checks this
+            verdicts.append(result)
+
+        self.attempts += len(verdicts)
+        self.accepted += sum(verdicts)
+        return verdicts
+
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.attempts if self.attempts else 1.0
+
+    def describe(self, subject_count : int) -> str:
+        return '%d candidates were generated for %d subjects: acceptance rate %.1f%%, %.2f attempts per subject.' % (
+            self.attempts,
+            subject_count,
+            100 * self.acceptance_rate(),
+            self.attempts / subject_count if subject_count else 0,
         )
 
-    result : Any = eval(options.condition_code, env)
-    assert isinstance(result, bool)  # SubjectFilter.value() checks this
-    return result
-
 class SubjectFilter(QWidget, uic.subject_filter.Ui_SubjectFilter):
     def __init__(self, parent : QWidget) -> None:
         QWidget.__init__(self, parent)
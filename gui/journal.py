@@ -0,0 +1,448 @@
+import io
+import os
+import copy
+import zlib
+import queue
+import logging
+import itertools
+import threading
+import contextlib
+from typing import cast, NamedTuple, Optional, Union, Iterator, BinaryIO
+
+import dataset
+import branding
+import platform_specific
+from gui.progress import Worker, MockWorker
+from util.codec import FileIn, FileOut, strC, intC, CodecError
+from util.block_compression import Compression, BlockWriter, BlockReader, \
+    BlockCompressionError, thread_pool
+from workspace import Workspace, WorkspaceItem, DatasetStub, DatasetCP, \
+    PersistenceError, Fingerprint, get_fingerprint, check_version
+
+log = logging.getLogger(__name__)
+
+# An append-only log of the changes to a workspace since it was last saved,
+# kept next to the workspace file so that the changes survive a crash.
+#
+#   signature, version, Prest version
+#   base: the workspace file that the records apply to ('' = empty workspace)
+#   fingerprint of the base
+#   records
+#
+# Every record is
+#
+#   length of the body (8 bytes, little endian), CRC32 of the body (4 bytes, little endian), body
+#
+# and the body starts with the record type. A crash may leave a truncated record
+# at the end of the journal; recovery stops there.
+#
+# Compaction saves the whole workspace into a checkpoint file
+# and starts a new journal with the checkpoint as its base.
+#
+# Only one process may keep the journal of a workspace file at a time;
+# it holds the lock file next to the journal while it does so.
+# Untitled workspaces have a journal of their own in every process,
+# and the journals that are not locked any more have been left behind by a crash.
+
+JOURNAL_SIGNATURE = b'Prest Journal\0'
+JOURNAL_FORMAT_VERSION = 1
+
+RECORD_HEADER_SIZE = 12
+
+RECORD_ADD = 1
+RECORD_RENAME = 2
+RECORD_DELETE = 3
+
+# compact after this many records
+COMPACTION_RECORDS = 64
+
+class Add(NamedTuple):
+    ds : dataset.Dataset
+
+class Rename(NamedTuple):
+    position : int
+    name : str
+
+class Delete(NamedTuple):
+    position : int
+
+Record = Union[Add, Rename, Delete]
+
+def journal_path(fname : str) -> str:
+    return fname + '.journal'
+
+def checkpoint_path(fname : str) -> str:
+    return fname + '.checkpoint'
+
+def lock_path(fname : str) -> str:
+    return fname + '.lock'
+
+# untitled workspaces: UNTITLED_PREFIX + pid (+ '-' + number) + UNTITLED_SUFFIX
+UNTITLED_PREFIX = 'untitled-'
+UNTITLED_SUFFIX = '.pwf'
+
+def encode_record(record : Record) -> bytes:
+    f_raw = io.BytesIO()
+    f = cast(FileOut, f_raw)
+    if isinstance(record, Add):
+        f.write(bytes([RECORD_ADD]))
+        # the journal should keep up with the user so we don't compress much
+        with thread_pool() as pool, BlockWriter(f, Compression.FAST, pool) as f_block:
+            DatasetCP.encode(MockWorker(), cast(FileOut, f_block), record.ds)
+    elif isinstance(record, Rename):
+        f.write(bytes([RECORD_RENAME]))
+        intC.encode(f, record.position)
+        strC.encode(f, record.name)
+    elif isinstance(record, Delete):
+        f.write(bytes([RECORD_DELETE]))
+        intC.encode(f, record.position)
+    else:
+        raise ValueError('unknown journal record: %s' % record)
+
+    return f_raw.getvalue()
+
+def decode_record(body : bytes) -> Record:
+    f = cast(FileIn, io.BytesIO(body))
+    kind = f.read(1)[0]
+    if kind == RECORD_ADD:
+        with thread_pool() as pool, BlockReader(f, pool) as f_block:
+            return Add(cast(dataset.Dataset, DatasetCP.decode(MockWorker(), cast(FileIn, f_block))))
+    elif kind == RECORD_RENAME:
+        position = intC.decode(f)
+        return Rename(position, strC.decode(f))
+    elif kind == RECORD_DELETE:
+        return Delete(intC.decode(f))
+    else:
+        raise CodecError('unknown journal record type: %d' % kind)
+
+def apply_record(datasets : list[WorkspaceItem], record : Record) -> None:
+    if isinstance(record, Add):
+        datasets.append(record.ds)
+    elif isinstance(record, Rename):
+        # the datasets may be shared with the UI
+        renamed = copy.copy(datasets[record.position])
+        renamed.name = record.name
+        datasets[record.position] = renamed
+    elif isinstance(record, Delete):
+        datasets.pop(record.position)
+    else:
+        raise ValueError('unknown journal record: %s' % record)
+
+def write_header(f : FileOut, base : str, fingerprint : Fingerprint) -> None:
+    f.write(JOURNAL_SIGNATURE)
+    intC.encode(f, JOURNAL_FORMAT_VERSION)
+    strC.encode(f, branding.VERSION)
+    strC.encode(f, base)
+    intC.encode(f, fingerprint[0])
+    intC.encode(f, fingerprint[1])
+
+def write_record(f : BinaryIO, body : bytes) -> None:
+    f.write(len(body).to_bytes(8, 'little') + zlib.crc32(body).to_bytes(4, 'little'))
+    f.write(body)
+
+def read_header(f : FileIn) -> tuple[str, Fingerprint]:
+    sig = f.read(len(JOURNAL_SIGNATURE))
+    if sig != JOURNAL_SIGNATURE:
+        raise PersistenceError('not a Prest journal file')
+
+    version = intC.decode(f)
+    prest_version = strC.decode(f)
+    check_version(version, JOURNAL_FORMAT_VERSION, prest_version)
+
+    base = strC.decode(f)
+    fingerprint = (intC.decode(f), intC.decode(f))
+    return base, fingerprint
+
+def read_records(f : BinaryIO) -> Iterator[bytes]:
+    # bodies of the complete records
+    while True:
+        header = f.read(RECORD_HEADER_SIZE)
+        if not header:
+            return
+
+        length = int.from_bytes(header[:8], 'little')
+        crc = int.from_bytes(header[8:], 'little')
+        body = f.read(length)
+        if len(header) < RECORD_HEADER_SIZE or len(body) < length or zlib.crc32(body) != crc:
+            log.warning('ignoring a truncated journal record at offset %d' % (f.tell() - len(body) - len(header)))
+            return
+
+        yield body
+
+def file_fingerprint(fname : str) -> Fingerprint:
+    with open(fname, 'rb') as f:
+        return get_fingerprint(f)
+
+def has_records(fname : str) -> bool:
+    # is there a journal with anything to recover for the workspace file?
+    try:
+        with open(journal_path(fname), 'rb') as f:
+            read_header(cast(FileIn, f))
+            return next(read_records(f), None) is not None
+    except FileNotFoundError:
+        return False
+    except (OSError, PersistenceError, CodecError) as e:
+        log.warning('could not read journal for %s: %s' % (fname, e))
+        return False
+
+def recover(worker : Worker, fname : str) -> Workspace:
+    # the workspace as it was when the last record was written;
+    # the base workspace file must not have changed since the journal was started
+    with open(journal_path(fname), 'rb') as f_raw:
+        f = cast(FileIn, f_raw)  # assert we're doing input
+        base, fingerprint = read_header(f)
+        bodies = list(read_records(f))
+
+    ws = Workspace()
+    if base:
+        base = find_base(base, fingerprint)
+        ws.load_from_file(worker, base)
+
+        if base != fname:
+            # the checkpoint is rewritten by compaction so we can't load from it lazily
+            ws.datasets = [
+                ds.load(worker) if isinstance(ds, DatasetStub) else ds
+                for ds in ws.datasets
+            ]
+
+    worker.set_work_size(len(bodies))
+    for i, body in enumerate(bodies):
+        try:
+            apply_record(ws.datasets, decode_record(body))
+        except (CodecError, BlockCompressionError, IndexError) as e:
+            raise PersistenceError('corrupted journal: %s' % journal_path(fname)) from e
+        worker.set_progress(i + 1)
+
+    return ws
+
+def find_base(base : str, fingerprint : Fingerprint) -> str:
+    # a crash during compaction may leave the new checkpoint under its temporary name
+    for candidate in (base, base + '.new'):
+        with contextlib.suppress(FileNotFoundError):
+            if file_fingerprint(candidate) == fingerprint:
+                return candidate
+
+    raise PersistenceError('the workspace file has changed since the journal was written: %s' % base)
+
+def fsync_file(path : str) -> None:
+    with open(path, 'r+b') as f:
+        os.fsync(f.fileno())
+
+def fsync_dir(path : str) -> None:
+    # makes the files created or renamed in the directory survive a power cut;
+    # directories can't be opened (nor need to be synced) on Windows
+    if platform_specific.is_windows():
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_header_file(path : str, base : str, fingerprint : Fingerprint) -> None:
+    # durably, so that it can replace the journal
+    with open(path, 'wb') as f_raw:
+        write_header(cast(FileOut, f_raw), base, fingerprint)
+        f_raw.flush()
+        os.fsync(f_raw.fileno())
+
+class Lock:
+    # The right to keep the journal of fname, see above.
+
+    def __init__(self, fname : str, f : BinaryIO) -> None:
+        self.fname = fname
+        self.f = f
+
+    @staticmethod
+    def acquire(fname : str) -> Optional['Lock']:
+        # None if another process holds the lock
+        f = open(lock_path(fname), 'a+b')
+        if not platform_specific.try_lock(f):
+            f.close()
+            return None
+
+        return Lock(fname, f)
+
+    def release(self) -> None:
+        self.f.close()
+
+        # the lock file marks an orphaned journal, if there is one
+        if not os.path.exists(journal_path(self.fname)):
+            with contextlib.suppress(OSError):
+                os.remove(lock_path(self.fname))
+
+def new_untitled(dirname : str) -> Lock:
+    # an untitled workspace in dirname, locked, with no journal yet
+    for n in itertools.count():
+        suffix = '-%d' % n if n else ''
+        fname = os.path.join(dirname, '%s%d%s%s' % (UNTITLED_PREFIX, os.getpid(), suffix, UNTITLED_SUFFIX))
+        if os.path.exists(journal_path(fname)):
+            continue  # left behind by an earlier process with the same pid
+
+        lock = Lock.acquire(fname)
+        if lock is not None:
+            return lock
+
+    assert False, 'unreachable'
+
+def find_orphans(dirname : str) -> list[Lock]:
+    # untitled workspaces in dirname with something to recover,
+    # whose processes have crashed; they are locked for the caller
+    # and the most recently changed come first
+    orphans : list[tuple[float, Lock]] = []
+    journal_suffix = journal_path(UNTITLED_SUFFIX)
+    for name in os.listdir(dirname):
+        if not name.startswith(UNTITLED_PREFIX) or not name.endswith(journal_suffix):
+            continue
+
+        fname = os.path.join(dirname, name[:-len(journal_suffix)] + UNTITLED_SUFFIX)
+        lock = Lock.acquire(fname)
+        if lock is None:
+            continue  # still running
+
+        if has_records(fname):
+            orphans.append((os.path.getmtime(journal_path(fname)), lock))
+        else:
+            discard(fname)
+            lock.release()
+
+    orphans.sort(key=lambda mtime_lock: -mtime_lock[0])
+    return [lock for _mtime, lock in orphans]
+
+def discard(fname : str) -> None:
+    checkpoint = checkpoint_path(fname)
+    for path in (journal_path(fname), checkpoint, checkpoint + '.new'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+class Journal:
+    # Writes the records in a background thread so that the UI never waits for the disk.
+    # The writer thread keeps its own copy of the list of datasets for compaction.
+    #
+    # Errors are logged and stop the journal; the workspace can still be saved as usual.
+
+    def __init__(self, fname : str, datasets : list[WorkspaceItem], base : Optional[str]) -> None:
+        # fname: the workspace file whose journal this is
+        # base: the file that contains `datasets`, if any, or None for a new journal
+        #       that continues the existing one (after recovery)
+        self.fname = fname
+        self.queue : queue.Queue[Optional[Record]] = queue.Queue()
+        self.failed = False
+        self.datasets = list(datasets)
+
+        self.f : Optional[BinaryIO] = None
+        self.record_count = 0
+        try:
+            if base is None:
+                self.f = open(journal_path(fname), 'ab')
+            else:
+                self.f = self.start(base)
+        except OSError as e:
+            log.warning('could not open journal for %s: %s' % (fname, e))
+            self.failed = True
+
+        self.thread = threading.Thread(target=self.run, name='journal', daemon=True)
+        self.thread.start()
+
+    def start(self, base : str) -> BinaryIO:
+        # atomically replace the journal with an empty one on top of base
+        dirname = os.path.dirname(os.path.abspath(self.fname))
+        fname_tmp = journal_path(self.fname) + '.tmp'
+        write_header_file(fname_tmp, base, file_fingerprint(base) if base else (0, 0))
+        fsync_dir(dirname)
+        os.replace(fname_tmp, journal_path(self.fname))
+        fsync_dir(dirname)
+
+        self.record_count = 0
+        return open(journal_path(self.fname), 'ab')
+
+    def add(self, ds : dataset.Dataset) -> None:
+        self.queue.put(Add(ds))
+
+    def rename(self, position : int, name : str) -> None:
+        self.queue.put(Rename(position, name))
+
+    def delete(self, position : int) -> None:
+        self.queue.put(Delete(position))
+
+    def run(self) -> None:
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+
+            if self.failed:
+                continue  # keep draining the queue
+
+            try:
+                self.write(record)
+            except Exception:
+                log.exception('journal failed, not journalling %s any more' % self.fname)
+                self.failed = True
+
+        if self.f is not None:
+            self.f.close()
+
+    def write(self, record : Record) -> None:
+        assert self.f is not None
+        write_record(self.f, encode_record(record))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+        apply_record(self.datasets, record)
+        self.record_count += 1
+
+        if self.record_count >= COMPACTION_RECORDS:
+            self.compact()
+
+    def compact(self) -> None:
+        # The checkpoint is written under a different name first
+        # so that the current journal remains valid until it's replaced.
+        # Everything is synced before every rename so that after a power cut,
+        # the journal never refers to a checkpoint that is not all on the disk.
+        assert self.f is not None
+        dirname = os.path.dirname(os.path.abspath(self.fname))
+        checkpoint = checkpoint_path(self.fname)
+        checkpoint_new = checkpoint + '.new'
+
+        log.debug('compacting journal for %s' % self.fname)
+        ws = Workspace()
+        ws.datasets = list(self.datasets)
+        ws.save_to_file(MockWorker(), checkpoint_new, Compression.FAST, unload=True)
+        fsync_file(checkpoint_new)
+        fingerprint = file_fingerprint(checkpoint_new)
+
+        self.f.close()
+        self.f = None
+
+        fname_tmp = journal_path(self.fname) + '.tmp'
+        write_header_file(fname_tmp, checkpoint, fingerprint)
+        fsync_dir(dirname)
+        os.replace(fname_tmp, journal_path(self.fname))
+        fsync_dir(dirname)
+
+        # renaming keeps the fingerprint
+        os.replace(checkpoint_new, checkpoint)
+        fsync_dir(dirname)
+
+        # all datasets now live in the checkpoint so we don't keep them in memory
+        # nor encode them again at the next compaction
+        self.datasets = [
+            DatasetStub(checkpoint, ds.fingerprint, ds.entry)
+            for ds in ws.datasets
+            if isinstance(ds, DatasetStub)
+        ]
+        assert len(self.datasets) == len(ws.datasets)
+        self.f = open(journal_path(self.fname), 'ab')
+        self.record_count = 0
+
+    def close(self) -> None:
+        # waits for the pending records to be written
+        self.queue.put(None)
+        self.thread.join()
+
+    def close_and_discard(self) -> None:
+        # the changes are no longer needed, e.g. because the workspace has been saved
+        self.close()
+        discard(self.fname)
@@ -131,6 +131,18 @@ def get_ordering_key(model : Model) -> Any:
     except ValueError:
         return 1024   # not mentioned
 
+# the order of models in the core (derived Ord),
+# where None < False < True in PreorderParams
+def get_core_ordering_key(model : Model) -> tuple[int, tuple[int, ...]]:
+    fields : list[int] = []
+    for field in model[:-1]:  # skip the tag
+        if isinstance(field, PreorderParams):
+            fields.extend(-1 if x is None else int(x) for x in field)
+        else:
+            fields.append(int(field))
+
+    return model.tag, tuple(fields)
+
 def get_name(model : Model) -> str:
     name = SPECIAL_NAMES.get(model)
     if name:
@@ -5,7 +5,7 @@ import os
 import sys
 import ctypes
 import logging
-from typing import Optional, cast, Callable
+from typing import Optional, BinaryIO, cast, Callable
 
 log = logging.getLogger(__name__)
 
@@ -61,3 +61,39 @@ def get_embedded_file_path(*fnames : str, criterion : Callable[[str], bool] = os
                 return path
 
     raise FileNotFound(*fnames)
+
+def get_user_data_dir() -> str:
+    if is_windows():
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~/AppData/Local')
+        return os.path.join(base, 'Prest', 'Data')
+    elif sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Application Support/Prest')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+        return os.path.join(base, 'prest')
+
+def get_user_cache_dir() -> str:
+    if is_windows():
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~/AppData/Local')
+        return os.path.join(base, 'Prest', 'Cache')
+    elif sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/Prest')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        return os.path.join(base, 'prest')
+
+def try_lock(f : BinaryIO) -> bool:
+    # an exclusive lock on the open file, released when the file is closed
+    # or the process exits; False if someone else holds it
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+
+    return True
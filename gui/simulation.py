@@ -1,9 +1,17 @@
-from typing import NamedTuple, Union, List, cast
+import random
+import hashlib
+import logging
+import weakref
+from typing import NamedTuple, Union, List, Sequence, Iterator, Callable, cast
 
 from core import Core
-from dataset import ChoiceRow, ChoiceRowC, Menu, MenuC, Subject, SubjectC, \
-    PackedSubject, PackedSubjectC
-from util.codec import listC, bytesC, enumC, intC, namedtupleC, boolC, strC
+from gui.progress import Worker
+from dataset import ChoiceRow, ChoiceRowC, Menu, MenuC, Subject, \
+    PackedSubject, PackedSubjectC, subject_name, rename_subject
+from util.codec import listC, bytesC, enumC, intC, namedtupleC, boolC, strC, noneC
+from util.packed_list import views
+
+log = logging.getLogger(__name__)
 
 class Exhaustive(NamedTuple):
     tag : int = 0
@@ -75,3 +83,240 @@ ResponseC = namedtupleC(Response, PackedSubjectC, intC)
 
 def run(core : Core, request : Request) -> Response:
     return core.call('simulation', RequestC, ResponseC, request)
+
+class Generated(NamedTuple):
+    gen_menus : GenMenus
+    tag : int = 0
+
+class Copycats(NamedTuple):
+    templates : Sequence[PackedSubject]
+    tag : int = 1
+
+class Registered(NamedTuple):
+    # copycat templates uploaded with register_templates()
+    handles : Sequence[int]
+    tag : int = 2
+
+BatchSubjects = Union[
+    Generated,
+    Copycats,
+    Registered,
+]
+
+BatchSubjectsC = enumC('BatchSubjects', {
+    Generated: (GenMenusC,),
+    Copycats: (listC(PackedSubjectC),),
+    Registered: (listC(intC),),
+})
+
+class BatchRequest(NamedTuple):
+    # generated subjects are named name+str(i) for i in first_index .. last_index (inclusive);
+    # every copycat template gives one subject named template_name+name+str(i) for every i
+    #
+    # the k-th subject of the batch, counting from zero, comes from the random stream
+    # first_stream+k of the seed, so the same seed always gives the same subjects
+    name : str
+    alternatives : List[str]
+    subjects : BatchSubjects
+    gen_choices : GenChoices
+    preserve_deferrals : bool
+    first_index : int
+    last_index : int
+    seed : int
+    first_stream : int = 0
+
+BatchRequestC = namedtupleC(BatchRequest, strC, listC(strC), BatchSubjectsC, GenChoicesC, boolC, intC, intC, intC, intC)
+
+SEED_BITS = 64
+
+def random_seed() -> int:
+    return random.SystemRandom().getrandbits(SEED_BITS)
+
+ChunkC = listC(ResponseC)
+
+# the core forgets all templates before it would keep more than this many;
+# the templates are uploaded at most this many at a time
+MAX_TEMPLATES = 1 << 16
+TEMPLATE_CHUNK_SIZE = 1024
+
+# template digest -> handle, for every core;
+# the core keeps the templates until it dies or clears them, and so do we
+TEMPLATE_HANDLES : weakref.WeakKeyDictionary[Core, dict[bytes, int]] = weakref.WeakKeyDictionary()
+
+def template_digest(template : Union[PackedSubject, memoryview]) -> bytes:
+    return hashlib.blake2b(template, digest_size=16).digest()
+
+def register_templates(core : Core, templates : Sequence[PackedSubject]) -> list[int]:
+    # uploads the templates that the core does not have yet
+    handles = TEMPLATE_HANDLES.setdefault(core, {})
+    digests = [template_digest(t) for t in views(templates)]
+
+    def missing() -> list[int]:
+        # the position of the first occurrence of every missing template
+        positions : dict[bytes, int] = {}
+        for i, digest in enumerate(digests):
+            if digest not in handles:
+                positions.setdefault(digest, i)
+        return list(positions.values())
+
+    positions = missing()
+    if handles and len(handles) + len(positions) > MAX_TEMPLATES:
+        log.debug('clearing %d copycat templates' % len(handles))
+        core.call('simulation-clear-templates', noneC, noneC, None)
+        handles.clear()
+        positions = missing()
+
+    for lo in range(0, len(positions), TEMPLATE_CHUNK_SIZE):
+        chunk = positions[lo:lo+TEMPLATE_CHUNK_SIZE]
+        first = core.call('simulation-register-templates', listC(PackedSubjectC), intC, [templates[i] for i in chunk])
+        handles.update(zip((digests[i] for i in chunk), range(first, first + len(chunk))))
+
+    return [handles[digest] for digest in digests]
+
+def run_batch(core : Core, request : BatchRequest) -> Iterator[Response]:
+    # the core streams the subjects in chunks, tagged with their indices;
+    # we yield them in order, as soon as possible
+    pending : dict[int, list[Response]] = {}
+    next_chunk = 0
+    for i, chunk in core.call_streaming('simulation-batch', BatchRequestC, ChunkC, request):
+        pending[i] = chunk
+        while next_chunk in pending:
+            yield from pending.pop(next_chunk)
+            next_chunk += 1
+
+def retry_request(request : BatchRequest, positions : Sequence[int], first_stream : int) -> BatchRequest:
+    # one new candidate for every given position in the batch, in the same order,
+    # from the streams first_stream onwards, which must not have been used yet;
+    # the candidates don't get the names of their positions
+    per_template = request.last_index - request.first_index + 1
+
+    subjects : BatchSubjects
+    if isinstance(request.subjects, Copycats):
+        templates = request.subjects.templates
+        subjects = Copycats([templates[p // per_template] for p in positions])
+        last_index = request.first_index
+    elif isinstance(request.subjects, Registered):
+        handles = request.subjects.handles
+        subjects = Registered([handles[p // per_template] for p in positions])
+        last_index = request.first_index
+    else:
+        subjects = request.subjects
+        last_index = request.first_index + len(positions) - 1
+
+    return request._replace(subjects=subjects, last_index=last_index, first_stream=first_stream)
+
+class FilterError(Exception):
+    pass
+
+# rejection sampling gives up once a subject has been rejected this many times in a row
+# or once enough candidates have been checked to tell that the filter accepts hardly any
+FILTER_MAX_ATTEMPTS = 1000
+FILTER_MIN_ACCEPTANCE_RATE = 0.001
+FILTER_MIN_CHECKED = 10000
+
+def template_count(subjects : BatchSubjects) -> int:
+    if isinstance(subjects, Copycats):
+        return len(subjects.templates)
+    elif isinstance(subjects, Registered):
+        return len(subjects.handles)
+    else:
+        return 1  # generated subjects count as one template
+
+def template_slice(subjects : BatchSubjects, lo : int, hi : int) -> BatchSubjects:
+    if isinstance(subjects, Copycats):
+        return Copycats(subjects.templates[lo:hi])
+    elif isinstance(subjects, Registered):
+        return Registered(subjects.handles[lo:hi])
+    else:
+        return subjects
+
+def split_request(request : BatchRequest, max_size : int) -> Iterator[BatchRequest]:
+    # consecutive parts of the batch, with at most max_size subjects each;
+    # together they give the same subjects, with the same names, as the whole batch
+    per_template = request.last_index - request.first_index + 1
+    if per_template > max_size:
+        # parts of the indices of one template
+        for t in range(template_count(request.subjects)):
+            for lo in range(0, per_template, max_size):
+                hi = min(lo + max_size, per_template)
+                yield request._replace(
+                    subjects=template_slice(request.subjects, t, t + 1),
+                    first_index=request.first_index + lo,
+                    last_index=request.first_index + hi - 1,
+                    first_stream=request.first_stream + t * per_template + lo,
+                )
+    else:
+        # whole templates
+        step = max_size // max(per_template, 1)
+        for t in range(0, template_count(request.subjects), step):
+            yield request._replace(
+                subjects=template_slice(request.subjects, t, t + step),
+                first_stream=request.first_stream + t * per_template,
+            )
+
+def run_batch_filtered(
+    worker : Worker,
+    core : Core,
+    request : BatchRequest,
+    accepts_many : Callable[[Sequence[PackedSubject]], Sequence[bool]],
+    chunk_size : int = 1024,
+) -> Iterator[Response]:
+    # Rejection sampling: the subjects rejected by the filter are replaced
+    # with new candidates until all are accepted; the accepted replacements
+    # then take over the names of the subjects they replace.
+    #
+    # The batch is processed in chunks of chunk_size subjects, which are yielded
+    # in order as soon as all their subjects have been accepted. Every round generates
+    # and checks all candidates of the chunk in one go, from streams after those
+    # of the whole batch and of the previous rounds, so the result depends only on the seed
+    # (and the chunk size). Progress is reported after every round.
+    #
+    # The filter may need the core so the candidates are generated before they're checked.
+    next_stream = request.first_stream \
+        + template_count(request.subjects) * (request.last_index - request.first_index + 1)
+    done = 0
+    checked = 0
+    accepted = 0
+    for chunk in split_request(request, chunk_size):
+        responses = list(run_batch(core, chunk))
+        names : dict[int, str] = {}  # the original names of the replaced subjects
+        candidates = list(range(len(responses)))  # positions of the unchecked candidates
+        rounds = 0
+        while True:
+            verdicts = accepts_many([responses[p].subject_packed for p in candidates])
+            rounds += 1
+            checked += len(verdicts)
+            accepted += sum(verdicts)
+
+            candidates = [p for p, ok in zip(candidates, verdicts) if not ok]
+            worker.set_progress(done + len(responses) - len(candidates))
+            if not candidates:
+                break
+
+            if rounds >= FILTER_MAX_ATTEMPTS:
+                p = candidates[0]
+                raise FilterError(
+                    'The subject filter rejected %d candidates in a row for %s. Is the condition too strict?'
+                    % (rounds, names.get(p, subject_name(responses[p].subject_packed)))
+                )
+
+            if checked >= FILTER_MIN_CHECKED and accepted < FILTER_MIN_ACCEPTANCE_RATE * checked:
+                raise FilterError(
+                    'The subject filter accepted only %d of %d candidates. Is the condition too strict?'
+                    % (accepted, checked)
+                )
+
+            # read the whole stream before calling the core again
+            replacements = list(run_batch(core, retry_request(chunk, candidates, next_stream)))
+            next_stream += len(candidates)
+            for p, response in zip(candidates, replacements):
+                names.setdefault(p, subject_name(responses[p].subject_packed))
+                responses[p] = response
+
+        for p, name in names.items():
+            responses[p] = responses[p]._replace(
+                subject_packed=rename_subject(responses[p].subject_packed, name),
+            )
+
+        done += len(responses)
+        yield from responses
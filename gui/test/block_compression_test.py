@@ -0,0 +1,45 @@
+import io
+import random
+
+import pytest
+
+import util.block_compression
+from util.block_compression import Compression, BlockWriter, BlockReader, \
+    BlockCompressionError, thread_pool
+
+def compress(data : bytes, compression : Compression, pieces : int) -> bytes:
+    f = io.BytesIO()
+    with thread_pool() as pool, BlockWriter(f, compression, pool) as writer:
+        step = len(data) // pieces + 1
+        for i in range(0, len(data), step):
+            writer.write(data[i:i+step])
+    return f.getvalue()
+
+@pytest.mark.parametrize('compression', list(Compression))
+def test_roundtrip(compression : Compression, monkeypatch : pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(util.block_compression, 'BLOCK_SIZE', 1000)
+    rng = random.Random(1)
+    data = bytes(rng.randrange(16) for _ in range(50_000))
+    compressed = compress(data, compression, 333)
+
+    with thread_pool() as pool:
+        reader = BlockReader(io.BytesIO(compressed), pool)
+        assert reader.read(10) == data[:10]
+        assert reader.read(2500) == data[10:2510]  # across blocks
+        assert reader.read() == data[2510:]
+        assert reader.read(1) == b''
+
+def test_empty() -> None:
+    compressed = compress(b'', Compression.DEFAULT, 1)
+    with thread_pool() as pool:
+        assert BlockReader(io.BytesIO(compressed), pool).read() == b''
+
+def test_corrupted() -> None:
+    compressed = compress(b'hello' * 1000, Compression.DEFAULT, 1)
+    with thread_pool() as pool:
+        with pytest.raises(BlockCompressionError):
+            BlockReader(io.BytesIO(compressed[:-10]), pool).read()
+
+        corrupted = compressed[:10] + bytes([compressed[10] ^ 0xff]) + compressed[11:]
+        with pytest.raises(BlockCompressionError):
+            BlockReader(io.BytesIO(corrupted), pool).read()
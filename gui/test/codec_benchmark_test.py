@@ -0,0 +1,137 @@
+import time
+import random
+from fractions import Fraction
+from typing import Any, Callable
+
+import numpy as np
+import pytest
+
+import dataset
+import dataset.budgetary
+import dataset.budgetary_consistency
+import dataset.deterministic_consistency_result
+import dataset.estimation_result
+import dataset.experiment_stats
+import dataset.integrity_check
+import dataset.stochastic_consistency_result
+import dataset.tuple_intrans_alts
+import dataset.tuple_intrans_menus
+from dataset import Subject, ChoiceRow
+from util.codec import Codec
+
+def random_subject(rng : random.Random, alt_count : int, row_count : int) -> Subject:
+    choices = []
+    for _ in range(row_count):
+        menu = frozenset(rng.sample(range(alt_count), rng.randint(1, alt_count)))
+        choices.append(ChoiceRow(
+            menu=menu,
+            default=rng.choice([None, min(menu)]),
+            choice=frozenset(rng.sample(sorted(menu), rng.randint(0, 2) if len(menu) > 1 else 1)),
+        ))
+
+    return Subject(
+        name='subject',
+        alternatives=['alt%d' % i for i in range(alt_count)],
+        choices=choices,
+    )
+
+def random_value(rng : random.Random, codec : Codec, size : int) -> Any:
+    # a random value guided by the codec structure,
+    # with collections getting smaller as they nest
+    spec = codec.spec
+    assert spec is not None, 'opaque codec'
+    kind = spec[0]
+
+    if kind == 'compiled':
+        return random_value(rng, spec[1], size)
+    elif kind == 'int':
+        return rng.choice([rng.randrange(128), rng.randrange(1 << 20)])
+    elif kind == 'intlist':
+        return [rng.randrange(1 << 10) for _ in range(rng.randint(0, size))]
+    elif kind in ('float', 'double'):
+        return float(np.float32(rng.random()))
+    elif kind == 'bytes':
+        return rng.randbytes(size)
+    elif kind == 'str':
+        return 'item%d' % rng.randrange(size * 10)
+    elif kind == 'none':
+        return None
+    elif kind == 'bool':
+        return rng.random() < 0.5
+    elif kind == 'maybe':
+        return rng.choice([None, random_value(rng, spec[1], size)])
+    elif kind == 'fraction':
+        return Fraction(rng.randrange(1000), rng.randrange(1, 100))
+    elif kind == 'tuple':
+        return tuple(random_value(rng, c, size) for c in spec[1])
+    elif kind in ('namedtuple', 'dataclass'):
+        return spec[1](*[random_value(rng, c, size) for c in spec[2]])
+    elif kind in ('list', 'set', 'frozenset'):
+        ctor = {'list': list, 'set': set, 'frozenset': frozenset}[kind]
+        return ctor(random_value(rng, spec[1], size // 4 + 1) for _ in range(size))
+    elif kind == 'enum':
+        _tag, ty, codecs = rng.choice(spec[2])
+        return ty(*[random_value(rng, c, size) for c in codecs])
+    else:
+        raise ValueError(kind)
+
+def random_budgetary_subject(rng : random.Random, size : int) -> dataset.budgetary.Subject:
+    np_rng = np.random.default_rng(rng.randrange(1 << 32))
+    return dataset.budgetary.Subject(
+        name='subject',
+        prices=np_rng.random((size, 8), dtype=np.float32),
+        amounts=np_rng.random((size, 8), dtype=np.float32),
+    )
+
+def measure(label : str, f : Callable[[], object], repeat : int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    elapsed = (time.perf_counter() - start) / repeat
+
+    print('%s: %.1f µs' % (label, elapsed * 1e6))
+    return elapsed
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('alt_count,row_count', [(5, 50), (20, 500), (200, 500)])
+def test_subject_codec(alt_count : int, row_count : int) -> None:
+    subject = random_subject(random.Random(42), alt_count, row_count)
+    dictionary = subject.alternatives
+    packed = subject.pack(dictionary)
+    assert Subject.unpack(packed, dictionary) == subject
+
+    label = f'Subject {alt_count} alts, {row_count} rows'
+    measure(label + ' pack', lambda: subject.pack(dictionary), 100)
+    measure(label + ' unpack', lambda: Subject.unpack(packed, dictionary), 100)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('module', [
+    dataset,
+    dataset.budgetary,
+    dataset.budgetary_consistency,
+    dataset.deterministic_consistency_result,
+    dataset.estimation_result,
+    dataset.experiment_stats,
+    dataset.integrity_check,
+    dataset.stochastic_consistency_result,
+    dataset.tuple_intrans_alts,
+    dataset.tuple_intrans_menus,
+], ids=lambda module: module.__name__)
+def test_compiled_codec(module : Any) -> None:
+    compiled : Any = dataset.CompactSubjectC if module is dataset else module.SubjectC
+    assert compiled.spec[0] == 'compiled'
+    interpreted = compiled.spec[1]
+
+    rng = random.Random(42)
+    if module is dataset.budgetary:
+        subject = random_budgetary_subject(rng, 100)
+    else:
+        subject = random_value(rng, compiled, 20)
+
+    packed = interpreted.encode_to_memory(subject)
+    assert compiled.encode_to_memory(subject) == packed
+
+    label = module.__name__ + '.SubjectC'
+    for name, codec in (('interpreted', interpreted), ('compiled', compiled)):
+        measure(f'{label} {name} encode', lambda: codec.encode_to_memory(subject), 100)
+        measure(f'{label} {name} decode', lambda: codec.decode_from_memory(packed), 100)
@@ -1,8 +1,20 @@
+import io
 import pytest
-from hypothesis import given
+from typing import cast
+from hypothesis import given, settings
+from hypothesis import strategies as st
 from hypothesis.strategies import integers, lists, tuples, text
 
-from util.codec import intC, listC, tupleC, strC, bytesC
+from util.codec import Codec, intC, listC, tupleC, strC, bytesC, frozensetC, \
+    FileIn, FileOut, EOF, CodecError, boolC
+from util.codec_compiler import compiled
+
+import dataset
+import dataset.deterministic_consistency_result
+import dataset.estimation_result
+import dataset.integrity_check
+import dataset.stochastic_consistency_result
+import dataset.tuple_intrans_menus
 
 ints = integers(min_value=0)
 
@@ -14,6 +26,30 @@ def test_int(x):
 def test_list_int(xs):
     listC(intC).test(xs)
 
+@given(lists(integers(min_value=0, max_value=2**70)))
+def test_list_int_wire_format(xs):
+    # the bulk path must produce what intC would, item by item
+    f = io.BytesIO()
+    intC.encode(cast(FileOut, f), len(xs))
+    for x in xs:
+        intC.encode(cast(FileOut, f), x)
+
+    assert listC(intC).encode_to_memory(xs) == f.getvalue()
+
+@settings(max_examples=20)
+@given(lists(integers(min_value=0, max_value=2**40), min_size=600, max_size=800))
+def test_list_int_long(xs):
+    listC(intC).test(xs)
+
+@given(lists(integers(min_value=0, max_value=2**40)).map(frozenset))
+def test_frozenset_int(xs):
+    frozensetC(intC).test(xs)
+
+def test_list_int_eof():
+    bs = listC(intC).encode_to_memory([1, 300, 70000])
+    with pytest.raises(EOF):
+        listC(intC).decode_from_memory(bs[:-1])
+
 @given(lists(text()))
 def test_list_str(xs):
     listC(strC).test(xs)
@@ -21,3 +57,123 @@ def test_list_str(xs):
 @given(tuples(lists(text()), ints, lists(tuples(ints, text()))))
 def test_complicated(xs):
     tupleC(listC(strC), intC, listC(tupleC(intC, strC))).test(xs)
+
+@given(tuples(lists(text()), ints, lists(tuples(ints, text()))), integers(min_value=0, max_value=16))
+def test_decode_buf(xs, prefix_length):
+    codec = tupleC(listC(strC), intC, listC(tupleC(intC, strC)))
+    bs = codec.encode_to_memory(xs)
+
+    # decode from the middle of a buffer
+    buf = memoryview(b'\xff' * prefix_length + bs + b'\xff')
+    assert codec.decode_buf(buf, prefix_length) == (xs, prefix_length + len(bs))
+
+@given(lists(tuples(ints, text())))
+def test_decode_buf_fallback(xs):
+    # codecs without a buffer decoder are decoded via a file-like view
+    codec = listC(tupleC(Codec(intC.encode, intC.decode), Codec(strC.encode, strC.decode)))
+    bs = codec.encode_to_memory(xs)
+    assert codec.decode_buf(memoryview(bs)) == (xs, len(bs))
+
+def test_decode_buf_eof():
+    bs = tupleC(strC, bytesC).encode_to_memory(('abc', b'def'))
+    with pytest.raises(EOF):
+        tupleC(strC, bytesC).decode_buf(memoryview(bs[:-1]))
+
+    bs = listC(intC).encode_to_memory([1, 300, 70000, 2])
+    for length in range(len(bs)):
+        with pytest.raises(EOF):
+            listC(intC).decode_buf(memoryview(bs[:length]))
+
+def construct(ty):
+    return lambda xs: ty(*xs)
+
+def values(codec):
+    # hypothesis strategy for the values of a codec with a spec
+    kind, *args = codec.spec
+
+    if kind == 'compiled':
+        return values(args[0])
+    elif kind == 'int':
+        return integers(min_value=0, max_value=2**70)
+    elif kind == 'intlist':
+        return lists(integers(min_value=0, max_value=2**70))
+    elif kind == 'double':
+        return st.floats(allow_nan=False)
+    elif kind == 'bytes':
+        return st.binary()
+    elif kind == 'str':
+        return text()
+    elif kind == 'bool':
+        return st.booleans()
+    elif kind == 'fraction':
+        return st.fractions(min_value=0)
+    elif kind == 'maybe':
+        return st.none() | values(args[0])
+    elif kind == 'tuple':
+        return tuples(*map(values, args[0]))
+    elif kind in ('namedtuple', 'dataclass'):
+        return tuples(*map(values, args[1])).map(construct(args[0]))
+    elif kind in ('list', 'set', 'frozenset'):
+        return lists(values(args[0]), max_size=5).map({
+            'list': list, 'set': set, 'frozenset': frozenset,
+        }[kind])
+    elif kind == 'enum':
+        return st.one_of(*[
+            tuples(*map(values, codecs)).map(construct(ty))
+            for _tag, ty, codecs in args[1]
+        ])
+    else:
+        raise ValueError(kind)
+
+COMPILED_CODECS = [
+    dataset.CompactSubjectC,
+    dataset.deterministic_consistency_result.SubjectC,
+    dataset.estimation_result.ResponseC,
+    dataset.estimation_result.SubjectC,
+    dataset.integrity_check.SubjectC,
+    dataset.stochastic_consistency_result.SubjectC,
+    dataset.tuple_intrans_menus.SubjectC,
+    compiled(tupleC(listC(tupleC(intC, strC)), bytesC)),
+]
+
+@pytest.mark.parametrize('codec', COMPILED_CODECS)
+@settings(max_examples=50)
+@given(data=st.data())
+def test_compiled(codec, data):
+    x = data.draw(values(codec))
+    interpreted = codec.spec[1]
+
+    bs = interpreted.encode_to_memory(x)
+    assert codec.encode_to_memory(x) == bs
+    assert codec.decode(cast(FileIn, io.BytesIO(bs))) == x
+    assert codec.decode_buf(memoryview(b'\xff' + bs), 1) == (x, len(bs) + 1)
+
+def test_compiled_eof():
+    codec = dataset.CompactSubjectC
+    bs = codec.encode_to_memory(dataset.CompactSubject('x', dataset.NamedAlternatives(['a', 'b']), [
+        dataset.ChoiceRow(frozenset([0, 1]), 300, frozenset([1])),
+    ]))
+
+    for length in range(len(bs)):
+        with pytest.raises(EOF):
+            codec.decode_buf(memoryview(bs[:length]))
+        with pytest.raises(EOF):
+            codec.decode(cast(FileIn, io.BytesIO(bs[:length])))
+
+def test_compiled_errors():
+    with pytest.raises(CodecError):
+        compiled(listC(intC)).encode_to_memory([1, -1])
+    with pytest.raises(CodecError):
+        compiled(tupleC(intC, intC)).encode_to_memory((1, 2, 3))
+    with pytest.raises(CodecError):
+        compiled(tupleC(boolC)).decode_from_memory(b'\x02')
+
+def test_compiled_opaque():
+    # codecs without a spec are left as they are
+    codec = Codec(intC.encode, intC.decode)
+    assert compiled(codec) is codec
+
+    # ...and called from compiled code
+    outer = compiled(listC(tupleC(codec, strC)))
+    xs = [(1, 'a'), (300, 'b')]
+    assert outer.decode_from_memory(outer.encode_to_memory(xs)) == xs
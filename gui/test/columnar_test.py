@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from hypothesis import given
+from hypothesis.strategies import integers, lists, frozensets, text, none, composite, DrawFn
+
+from dataset import Subject, ChoiceRow, PackedSubject
+from dataset.columnar import ColumnarSubjects, NO_DEFAULT
+from dataset.experimental_data import ExperimentalData
+from util.codec import CodecError
+from util.packed_list import MappedBlocks, views
+
+@composite
+def subjects(draw : DrawFn) -> Subject:
+    alt_count = draw(integers(min_value=0, max_value=150))
+    alts = frozensets(integers(min_value=0, max_value=max(0, alt_count-1)), max_size=alt_count)
+    menus = draw(lists(alts, max_size=10))
+    return Subject(
+        name=draw(text()),
+        alternatives=['alt%d' % i for i in range(alt_count)],
+        choices=[
+            ChoiceRow(
+                menu=menu,
+                default=draw(none() | integers(min_value=0, max_value=max(0, alt_count-1))),
+                choice=draw(alts),
+            )
+            for menu in menus
+        ],
+    )
+
+@given(lists(subjects(), max_size=5))
+def test_roundtrip(xs : list[Subject]) -> None:
+    columns = ColumnarSubjects.from_packed([x.pack() for x in xs])
+    assert len(columns) == len(xs)
+    assert columns.row_count == sum(len(x.choices) for x in xs)
+    assert list(columns.subjects()) == xs
+    assert [Subject.unpack(x) for x in columns.to_packed()] == xs
+
+    # zero-copy views of spilled subjects decode the same
+    mapped = ColumnarSubjects.from_packed(views(MappedBlocks([x.pack() for x in xs])))
+    assert list(mapped.subjects()) == xs
+
+def test_columns() -> None:
+    rows = [
+        'subjA Ca,Hi,Pa Pa Ca',
+        'subjA Ca,Pa  ',
+        'subjB Ca Ca Ca',
+    ]
+    ds = ExperimentalData.from_csv('X', [r.split(' ') for r in rows], (0,1,2,3))
+    columns = ds.columns()
+
+    assert columns.names == ['subjA', 'subjB']
+    assert columns.offsets.tolist() == [0, 2, 3]
+    assert columns.row_subjects().tolist() == [0, 0, 1]
+    assert columns.menus[:, 0].tolist() == [0b111, 0b101, 0b1]
+    assert columns.defaults.tolist() == [2, NO_DEFAULT, 0]
+    assert columns.choices[:, 0].tolist() == [0b1, 0, 0b1]
+
+    ds2 = ExperimentalData.from_columns('Y', ds.alternatives, columns)
+    assert ds2.subjects == ds.subjects
+    assert ds2.observ_count == ds.observ_count
+
+def test_wide() -> None:
+    subject = Subject('s', ['alt%d' % i for i in range(200)], [
+        ChoiceRow(frozenset([0, 63, 64, 199]), 199, frozenset([64])),
+    ])
+    columns = ColumnarSubjects.from_subjects([subject])
+
+    assert columns.menus.shape == (1, 4)
+    assert columns.menus.tolist() == [[1 | (1 << 63), 1, 0, 1 << 7]]
+    assert list(columns.subjects()) == [subject]
+
+def test_empty() -> None:
+    columns = ColumnarSubjects.from_subjects([])
+    assert len(columns) == 0
+    assert columns.row_count == 0
+    assert list(columns.subjects()) == []
+    assert columns.menus.dtype == np.uint64
+
+def test_truncated() -> None:
+    packed = Subject('s', ['a', 'b'], [
+        ChoiceRow(frozenset([0, 1]), 1, frozenset([0])),
+        ChoiceRow(frozenset([0, 1]), None, frozenset()),
+    ]).pack()
+
+    for length in range(len(packed)):
+        with pytest.raises(CodecError):
+            ColumnarSubjects.from_packed([PackedSubject(packed[:length])])
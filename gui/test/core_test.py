@@ -0,0 +1,216 @@
+import itertools
+import queue
+import threading
+import tracemalloc
+from typing import Any, Iterator, cast
+
+import pytest
+
+import dataset.experimental_data  # imports gui.subject_filter in the right order
+import simulation
+from core import Core, CorePool, CoreSession, CoreDeath, Failure, Interrupted
+from dataset import Subject, ChoiceRow, subject_name
+from dataset.experimental_data import ExperimentalData
+from dataset.experiment_stats import Subject as StatsSubject
+from gui.progress import MockWorker
+from util.codec import Codec, strC
+from util.packed_list import MappedBlocks
+
+def test_call_many() -> None:
+    messages = ['message %d' % i for i in range(1000)]
+
+    with Core() as core:
+        assert list(core.call_many('echo', strC, strC, messages, window=8)) == messages
+
+def test_call_many_early_exit() -> None:
+    with Core() as core:
+        responses = core.call_many('echo', strC, strC, ['a', 'b', 'c', 'd'], window=2)
+        assert next(responses) == 'a'
+        responses.close()
+
+        # the remaining responses must have been drained
+        assert core.call('echo', strC, strC, 'e') == 'e'
+
+def test_call_many_failure() -> None:
+    with Core() as core:
+        with pytest.raises(Failure):
+            list(core.call_many('fail', strC, strC, ['x', 'y', 'z']))
+
+        # the core is still in sync after a soft failure
+        assert core.call('echo', strC, strC, 'e') == 'e'
+
+def batch_request(subject_count : int) -> simulation.BatchRequest:
+    return simulation.BatchRequest(
+        name='random',
+        alternatives=['A', 'B', 'C'],
+        subjects=simulation.Generated(simulation.GenMenus(simulation.Exhaustive(), False)),
+        gen_choices=simulation.Uniform(forced_choice=True, multiple_choice=False),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=subject_count,
+        seed=42,
+    )
+
+def test_call_streaming() -> None:
+    with Core() as core:
+        items = list(core.call_streaming('simulation-batch', simulation.BatchRequestC, simulation.ChunkC, batch_request(3000)))
+        assert sorted(i for i, _chunk in items) == list(range(len(items)))
+        assert sum(len(chunk) for _i, chunk in items) == 3000
+
+        assert core.call('echo', strC, strC, 'e') == 'e'
+
+def test_call_streaming_early_exit() -> None:
+    with Core() as core:
+        items = core.call_streaming('simulation-batch', simulation.BatchRequestC, simulation.ChunkC, batch_request(3000))
+        next(items)
+        items.close()
+
+        # the rest of the stream is drained and the core survives
+        with core.busy:
+            pass
+        assert core.call('echo', strC, strC, 'e') == 'e'
+
+def test_call_streaming_cancel() -> None:
+    with Core() as core:
+        items = core.call_streaming('simulation-batch', simulation.BatchRequestC, simulation.ChunkC, batch_request(3000))
+        next(items)
+
+        core.cancel()
+        with pytest.raises(Interrupted):
+            list(items)
+
+        with core.busy:
+            pass
+        assert core.call('echo', strC, strC, 'e') == 'e'
+
+def test_pool_order() -> None:
+    messages = ['message %d' % i for i in range(1000)]
+
+    with CorePool(3) as pool:
+        assert len(pool.cores) <= 3
+        assert list(pool.call_many('echo', strC, strC, messages, window=4)) == messages
+
+def test_pool_failure() -> None:
+    with CorePool(2) as pool:
+        with pytest.raises(Failure):
+            list(pool.call_many('fail', strC, strC, ['x', 'y', 'z']))
+
+        assert list(pool.call_many('echo', strC, strC, ['a', 'b', 'c'])) == ['a', 'b', 'c']
+
+def test_pool_request_error() -> None:
+    def requests() -> Iterator[str]:
+        yield 'a'
+        yield 'b'
+        raise ValueError('no more requests')
+
+    with CorePool(2) as pool:
+        with pytest.raises(ValueError):
+            list(pool.call_many('echo', strC, strC, requests()))
+
+        assert list(pool.call_many('echo', strC, strC, ['a', 'b', 'c'])) == ['a', 'b', 'c']
+
+def test_session_reuse() -> None:
+    session = CoreSession()
+    try:
+        with session.core() as core:
+            pid = core.core.pid
+
+        with session.core() as core:
+            assert core.core.pid == pid
+            assert core.call('echo', strC, strC, 'e') == 'e'
+    finally:
+        session.close()
+
+def test_session_restart() -> None:
+    session = CoreSession()
+    try:
+        with pytest.raises(CoreDeath):
+            with session.core() as core:
+                core.crash()
+
+        # the dead core has been replaced
+        with session.core() as core:
+            assert core.call('echo', strC, strC, 'e') == 'e'
+    finally:
+        session.close()
+
+def test_pool_cancel() -> None:
+    messages = ['message %d' % i for i in range(1000)]
+
+    session = CoreSession()
+    try:
+        with session.pool(2) as pool:
+            cores = list(pool.cores)
+            responses = pool.call_many('echo', strC, strC, messages, window=4)
+            assert next(responses) == messages[0]
+
+            pool.cancel()
+            with pytest.raises(Interrupted):
+                list(responses)
+
+        # wait for the in-flight responses to be drained
+        for core in cores:
+            with core.busy:
+                pass
+
+        # the cores have survived the cancellation
+        pids = {core.core.pid for core in cores}
+        with session.pool(2) as pool:
+            assert {core.core.pid for core in pool.cores} == pids
+            assert list(pool.call_many('echo', strC, strC, messages)) == messages
+    finally:
+        session.close()
+
+class FakeCore:
+    # answers the summary requests in Python, through the real request pipelines
+    def __init__(self) -> None:
+        self.busy = threading.Lock()
+        self.stdin_lock = threading.Lock()
+        self.responses : queue.Queue[StatsSubject] = queue.Queue()
+
+    call_many = Core.call_many
+
+    def send(self, name : str, _codec_req : Codec[Any], request : Any) -> None:
+        assert name == 'summary'
+        self.responses.put(StatsSubject(subject_name(request), 0, 0, 0, 0))
+
+    def receive(self, _codec_resp : Codec[Any]) -> StatsSubject:
+        return self.responses.get()
+
+class FakeSession(CoreSession):
+    def checkout(self) -> Core:
+        return cast(Core, FakeCore())
+
+    def checkin(self, cores : list[Core]) -> None:
+        pass
+
+def test_pool_mapped_dataset() -> None:
+    # the spilled subjects are streamed to the cores, not loaded all at once
+    alternatives = [x * 2000 for x in 'abcd']  # big subjects that are quick to decode
+    menus = [frozenset(menu) for menu in itertools.combinations(range(4), 2)] \
+        + [frozenset(menu) for menu in itertools.combinations(range(4), 3)]
+    subjects = MappedBlocks(
+        Subject('s%d' % i, alternatives, [
+            # the rows spell out i in binary, so that all subjects are different
+            ChoiceRow(menu, None, frozenset([min(menu) if (i >> j) & 1 else max(menu)]))
+            for j, menu in enumerate(menus)
+        ]).pack()
+        for i in range(400)
+    )
+    size = sum(len(subject) for subject in subjects.views())
+
+    ds = ExperimentalData('ds', alternatives)
+    ds.subjects = subjects
+    worker = MockWorker()
+    worker.core_session = FakeSession()
+
+    tracemalloc.start()
+    try:
+        stats = ds.analysis_summary_stats(worker, None)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        subjects.close()
+
+    assert [s.name for s in stats.subjects] == ['s%d' % i for i in range(400)]
+    assert peak < size / 4
@@ -0,0 +1,112 @@
+import os
+import random
+import pathlib
+from typing import Optional
+
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import lists, tuples, sampled_from, frozensets
+
+from gui.progress import MockWorker
+from dataset import Subject, SubjectHeaderC, AllAlternatives, SomeAlternatives, NamedAlternatives
+from dataset.experimental_data import ExperimentalData, CsvImporter, CsvError
+
+class RecordingWorker(MockWorker):
+    def __init__(self) -> None:
+        self.size : Optional[int] = None
+        self.positions : list[int] = []
+
+    def set_work_size(self, size : int) -> None:
+        self.size = size
+
+    def set_progress(self, value : int) -> None:
+        self.positions.append(value)
+
+def grouped(rows : list[list[str]]) -> list[list[str]]:
+    # stable sort by the first appearance of the subject
+    first : dict[str, int] = {}
+    for i, row in enumerate(rows):
+        first.setdefault(row[0], i)
+    return sorted(rows, key=lambda row: first[row[0]])
+
+def unpacked(ds : ExperimentalData) -> list[Subject]:
+    return [Subject.unpack(s, ds.alternatives) for s in ds.subjects]
+
+alts = frozensets(sampled_from(['a', 'b', 'c', 'd']), min_size=1)
+csv_rows = lists(
+    tuples(sampled_from(['s1', 's2', 's3', 's4']), alts, alts).map(
+        lambda r: [r[0], ','.join(sorted(r[1])), ','.join(sorted(r[2] & r[1]))]
+    ),
+    max_size=40,
+)
+
+@settings(max_examples=50)
+@given(csv_rows)
+def test_ungrouped(rows : list[list[str]]) -> None:
+    ds = ExperimentalData.from_csv('X', rows, (0, 1, None, 2))
+    expected = ExperimentalData.from_csv('X', grouped(rows), (0, 1, None, 2))
+
+    assert unpacked(ds) == unpacked(expected)
+    assert ds.alternatives == expected.alternatives
+    assert ds.observ_count == len(rows)
+
+def test_spill() -> None:
+    rows = [['s%d' % (i % 7), 'a,b,c', 'b'] for i in range(500)]
+    importer = CsvImporter((0, 1, None, 2))
+    importer.BUFFER_ROWS = 64
+    for row in rows:
+        importer.add_row(row)
+    assert any(f is not None for f in importer.spill_files)
+
+    ds = importer.finish('X')
+    assert [s.name for s in unpacked(ds)] == ['s%d' % i for i in range(7)]
+    assert ds.observ_count == 500
+    assert unpacked(ds) == unpacked(ExperimentalData.from_csv('X', grouped(rows), (0, 1, None, 2)))
+
+def test_load_from_csv(tmp_path : pathlib.Path) -> None:
+    rng = random.Random(1)
+    rows = [
+        ['s%d' % rng.randrange(20), 'a,b,c', rng.choice(['', 'a', 'b']), rng.choice(['a', 'c', ''])]
+        for _ in range(10000)
+    ]
+
+    fname = os.path.join(tmp_path, 'data.csv')
+    with open(fname, 'w') as f:
+        f.write('subject,menu,default,choice\n')
+        for row in rows:
+            f.write('%s,"%s",%s,%s\n' % tuple(row))
+        f.write('\n')
+
+    worker = RecordingWorker()
+    ds = ExperimentalData.load_from_csv(worker, fname, (0, 1, 2, 3))
+
+    assert ds.name == 'data.csv'
+    assert unpacked(ds) == unpacked(ExperimentalData.from_csv('X', rows, (0, 1, 2, 3)))
+    assert worker.size == os.path.getsize(fname)
+    assert worker.positions == sorted(worker.positions)
+    assert worker.positions[-1] == worker.size
+
+def test_compact_alternatives() -> None:
+    rows = [
+        ['s1', 'a,b,c', 'a'],
+        ['s2', 'a,c', 'c'],
+        ['s3', 'a,b', 'b'],
+    ]
+    ds = ExperimentalData.from_csv('X', rows, (0, 1, None, 2))
+
+    # the alternatives refer to the dataset
+    assert [SubjectHeaderC.decode_from_memory(s)[1] for s in ds.subjects] == [
+        AllAlternatives(3),
+        SomeAlternatives([0, 2]),
+        AllAlternatives(2),
+    ]
+    assert [s.alternatives for s in unpacked(ds)] == [['a', 'b', 'c'], ['a', 'c'], ['a', 'b']]
+
+    # subjects with alternatives outside the dataset keep their names
+    subject = Subject('s4', ['a', 'd'], [])
+    assert SubjectHeaderC.decode_from_memory(subject.pack(ds.alternatives))[1] == NamedAlternatives(['a', 'd'])
+    assert Subject.unpack(subject.pack(ds.alternatives), ds.alternatives) == subject
+
+def test_bad_default() -> None:
+    with pytest.raises(CsvError):
+        ExperimentalData.from_csv('X', [['s', 'a,b', 'c', 'a']], (0, 1, 2, 3))
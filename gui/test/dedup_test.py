@@ -0,0 +1,61 @@
+from hypothesis import given
+from hypothesis.strategies import integers, lists, frozensets, none, tuples, permutations, data, DataObject
+
+from dataset import Subject, ChoiceRow
+from dataset.dedup import Deduplication, renamed
+from dataset.experiment_stats import Subject as StatsSubject
+from dataset.stochastic_consistency_result import Subject as StochasticSubject
+from util.packed_list import MappedBlocks
+
+def subject(name : str, rows : list[tuple[set[int], int]]) -> Subject:
+    return Subject(name, ['a', 'b', 'c'], [
+        ChoiceRow(frozenset(menu), None, frozenset([choice]))
+        for menu, choice in rows
+    ])
+
+def test_dedup() -> None:
+    subjects = [
+        subject('s1', [({0, 1}, 0), ({1, 2}, 2)]),
+        subject('s2', [({0, 1}, 1), ({1, 2}, 2)]),
+        subject('s3', [({1, 2}, 2), ({0, 1}, 0)]),  # s1 with the rows swapped
+        subject('s4', [({0, 1}, 0), ({1, 2}, 2)]),  # s1 renamed
+        subject('s5', [({0, 1}, 0)]),
+    ]
+
+    dedup = Deduplication([s.pack() for s in subjects])
+    assert list(dedup.groups) == [0, 1, 0, 0, 2]
+    assert [Subject.unpack(s).name for s in dedup.representatives] == ['s1', 's2', 's5']
+    assert dedup.ratio == 5 / 3
+
+    responses = [StatsSubject(name, 0, 0, 0, 0) for name in ['s1', 's2', 's5']]
+    assert [r.name for r in dedup.fan_out(responses, renamed)] == ['s1', 's2', 's3', 's4', 's5']
+
+def test_mapped() -> None:
+    # hashed straight from the spilled blocks; the representatives are read when needed
+    packed = [subject('s%d' % i, [({0, 1}, i % 2), ({1, 2}, 2)]).pack() for i in range(6)]
+    blocks = MappedBlocks(packed)
+    dedup = Deduplication(blocks)
+    assert list(dedup.groups) == [0, 1, 0, 1, 0, 1]
+    assert list(dedup.representatives) == packed[:2]
+
+    responses = [StatsSubject(name, 0, 0, 0, 0) for name in ['s0', 's1']]
+    assert [r.name for r in dedup.fan_out(responses, renamed)] == ['s%d' % i for i in range(6)]
+    blocks.close()
+
+def test_renamed() -> None:
+    assert renamed(StatsSubject('a', 1, 2, 3, 4), 'b') == StatsSubject('b', 1, 2, 3, 4)
+    assert renamed(StochasticSubject('a', 1, 2, 3, 4), 'b') == StochasticSubject('b', 1, 2, 3, 4)
+
+@given(data())
+def test_permuted(d : DataObject) -> None:
+    rows = d.draw(lists(tuples(frozensets(integers(0, 2), min_size=1), integers(0, 2)), max_size=8))
+    shuffled = d.draw(permutations(rows))
+    subjects = [
+        Subject('x', ['a', 'b', 'c'], [ChoiceRow(menu, None, frozenset([c])) for menu, c in rows]),
+        Subject('y', ['a', 'b', 'c'], [ChoiceRow(menu, None, frozenset([c])) for menu, c in shuffled]),
+        Subject('z', ['a', 'b', 'c'], [ChoiceRow(menu, 0, frozenset([c])) for menu, c in rows]),
+    ]
+
+    dedup = Deduplication([s.pack() for s in subjects])
+    assert list(dedup.groups[:2]) == [0, 0]
+    assert dedup.groups[2] == (0 if not rows else 1)
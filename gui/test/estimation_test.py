@@ -0,0 +1,142 @@
+import pathlib
+import contextlib
+from fractions import Fraction
+from typing import Iterator, Generator, Any, Optional, cast
+
+import cli
+import model
+from core import CoreSession
+import dataset.estimation_result as estimation_result
+from dataset import Subject, ChoiceRow
+from dataset.estimation_result import Penalty, InstanceInfo, Response, ResponseC, \
+    InstanceRepr, PackedResponse, combine_responses
+from dataset.experimental_data import ExperimentalData
+from gui.estimation import Options, DistanceScore
+from gui.progress import MockWorker, Worker
+from util.codec import Codec
+from util.result_cache import ResultCache
+
+UM = model.PreorderMaximization(model.PreorderParams(strict=True, total=True))
+UM_NS = model.PreorderMaximization(model.PreorderParams(strict=False, total=True))
+UC = model.UndominatedChoice(strict=True)
+SRC = model.SequentiallyRationalizableChoice()
+TT = model.TopTwo()
+
+def penalty(lo : int, hi : int) -> Penalty:
+    return Penalty(Fraction(lo), Fraction(hi))
+
+def instance(m : model.Model, p : Penalty, data : bytes) -> InstanceInfo:
+    return InstanceInfo(m, p, InstanceRepr(data))
+
+def test_core_ordering() -> None:
+    models : list[model.Model] = [SRC, TT, UC, UM, UM_NS, model.PreorderMaximization(model.PreorderParams(None, None))]
+    assert sorted(models, key=model.get_core_ordering_key) == \
+        [models[5], models[4], models[3], UC, TT, SRC]
+
+def test_combine() -> None:
+    a = Response('s', penalty(1, 1), [instance(TT, penalty(1, 1), b'a')])
+    b = Response('s', penalty(2, 2), [instance(UC, penalty(2, 2), b'b')])
+    c = Response('s', penalty(0, 3), [instance(UM, penalty(0, 3), b'c1'), instance(UM, penalty(3, 3), b'c2')])
+
+    # strictly better wins, in either order
+    assert combine_responses([a, b]) == a
+    assert combine_responses([b, a]) == a
+
+    # overlapping penalties are merged, hopeless instances are dropped
+    assert combine_responses([a, b, c]) == Response('s', penalty(0, 1), [
+        instance(UM, penalty(0, 3), b'c1'),
+        instance(TT, penalty(1, 1), b'a'),
+    ])
+
+class FakeCore:
+    # estimates model m for subject s with penalty (len(name), len(name))
+    # and the instance b'<model tag><subject name>'
+    def __init__(self) -> None:
+        self.requests : list[tuple[list[str], list[model.Model]]] = []
+
+    def call_streaming(
+        self, name : str, _codec_req : Codec[Any], _codec_item : Codec[Any], request : estimation_result.Request,
+    ) -> Generator[tuple[int, PackedResponse], None, None]:
+        assert name == 'estimation-streaming'
+        names = [Subject.unpack(s).name for s in request.subjects]
+        self.requests.append((names, list(request.models)))
+
+        for i, subject_name in reversed(list(enumerate(names))):
+            this_model, = request.models
+            p = penalty(len(subject_name), len(subject_name))
+            yield i, PackedResponse(ResponseC.encode_to_memory(Response(
+                subject_name, p, [instance(this_model, p, b'%d%s' % (this_model.tag, subject_name.encode()))]
+            )))
+
+    def shutdown(self) -> None:
+        pass
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.fake_core = FakeCore()
+
+    @contextlib.contextmanager
+    def core(self) -> Iterator[FakeCore]:
+        yield self.fake_core
+
+def estimate(
+    ds : ExperimentalData, cache : ResultCache, session : FakeSession, models : list[model.Model],
+    worker : Optional[Worker] = None,
+) -> list[Response]:
+    worker = worker or MockWorker()
+    worker.core_session = cast(CoreSession, session)
+    worker.result_cache = cache
+
+    result = ds.analysis_estimation(worker, Options(
+        models=models,
+        disable_parallelism=False,
+        disregard_deferrals=False,
+        distance_score=DistanceScore.HOUTMAN_MAKS,
+    ))
+    return [ResponseC.decode_from_memory(r) for r in result.subjects]
+
+def dataset_with_duplicates() -> ExperimentalData:
+    # the last two subjects are duplicates of the first two
+    ds = ExperimentalData('ds', ['a', 'b'])
+    ds.subjects = [
+        Subject(name, ['a', 'b'], [ChoiceRow(frozenset([0, 1]), None, frozenset([choice]))]).pack()
+        for name, choice in [('s', 0), ('ss', 1), ('sss', 0), ('ssss', 1)]
+    ]
+    return ds
+
+def test_incremental(tmp_path : pathlib.Path) -> None:
+    ds = dataset_with_duplicates()
+
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    session = FakeSession()
+
+    first = estimate(ds, cache, session, [UM])
+    assert session.fake_core.requests == [(['s', 'ss'], [UM])]
+    assert [r.subject_name for r in first] == ['s', 'ss', 'sss', 'ssss']
+    assert first[3] == Response('ssss', penalty(2, 2), [instance(UM, penalty(2, 2), b'0ss')])
+
+    # only the new model is estimated
+    session.fake_core.requests.clear()
+    second = estimate(ds, cache, session, [UM, TT])
+    assert session.fake_core.requests == [(['s', 'ss'], [TT])]
+    assert second[1] == Response('ss', penalty(2, 2), [
+        instance(UM, penalty(2, 2), b'0ss'),
+        instance(TT, penalty(2, 2), b'6ss'),
+    ])
+
+    # nothing new
+    session.fake_core.requests.clear()
+    assert estimate(ds, cache, session, [TT, UM]) == second
+    assert session.fake_core.requests == []
+
+    cache.close()
+
+def test_cli_worker(tmp_path : pathlib.Path) -> None:
+    # the command-line worker does not keep Worker.position
+    worker = cli.ProgressWorker()
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    responses = estimate(dataset_with_duplicates(), cache, FakeSession(), [UM, SRC], worker)
+    cache.close()
+
+    assert len(responses) == 4
+    assert worker.last_value == worker.size == 2 * 2  # two distinct subjects, two models
@@ -0,0 +1,69 @@
+import pathlib
+from typing import Iterator, Optional, Sequence
+
+import pytest
+import openpyxl
+
+import dataset
+import branding
+from dataset import Dataset, ExportVariant
+from gui.progress import MockWorker
+
+def variant(n : int, names : Sequence[str] = ()) -> ExportVariant:
+    # names: of the first subjects, instead of the default ones
+    def get_rows() -> Iterator[Optional[tuple]]:
+        for i in range(n):
+            yield (i + 1, names[i] if i < len(names) else 'subject %d' % (i + 1))
+            yield None  # bump progress
+
+    return ExportVariant(name='rows', column_names=('number', 'name'), size=n, get_rows=get_rows)
+
+class ProgressWorker(MockWorker):
+    def __init__(self) -> None:
+        super().__init__()
+        self.positions : list[int] = []
+
+    def set_progress(self, value : int) -> None:
+        self.positions.append(value)
+
+def export(tmp_path : pathlib.Path, variant : ExportVariant) -> openpyxl.Workbook:
+    fname = str(tmp_path / 'export.xlsx')
+    worker = ProgressWorker()
+    Dataset('ds', ()).export(fname, 'Excel files (*.xlsx)', variant, worker)
+    assert worker.positions == list(range(1, variant.size + 1))
+    return openpyxl.load_workbook(fname)
+
+def test_xlsx(tmp_path : pathlib.Path) -> None:
+    wb = export(tmp_path, variant(3))
+    assert wb.properties.creator == branding.PREST_VERSION
+    assert wb.sheetnames == ['Sheet']
+
+    ws = wb['Sheet']
+    assert list(ws.values) == [('number', 'name'), (1, 'subject 1'), (2, 'subject 2'), (3, 'subject 3')]
+    assert ws.column_dimensions['A'].width == 7
+    assert ws.column_dimensions['B'].width == 10
+
+def test_xlsx_empty(tmp_path : pathlib.Path) -> None:
+    wb = export(tmp_path, variant(0))
+    assert wb.sheetnames == ['Sheet']
+    assert list(wb['Sheet'].values) == [('number', 'name')]
+
+def test_xlsx_sheets(tmp_path : pathlib.Path, monkeypatch : pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dataset, 'XLSX_MAX_ROWS', 4)
+    monkeypatch.setattr(dataset, 'XLSX_WIDTH_SAMPLE', 2)
+
+    wb = export(tmp_path, variant(7, ['s1', 'second subject', 'the widest subject name']))
+    assert wb.sheetnames == ['Sheet', 'Sheet 2', 'Sheet 3']
+
+    rows = []
+    for ws in wb.worksheets:
+        values = list(ws.values)
+        assert values[0] == ('number', 'name')
+        assert len(values) <= 4
+        rows.extend(values[1:])
+
+        # only the first two rows were sampled
+        assert ws.column_dimensions['B'].width == len('second subject') + 1
+
+    assert rows == [(1, 's1'), (2, 'second subject'), (3, 'the widest subject name')] \
+        + [(i + 1, 'subject %d' % (i + 1)) for i in range(3, 7)]
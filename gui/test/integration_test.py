@@ -5,7 +5,7 @@ from typing import Optional, Tuple
 from gui.progress import MockWorker
 from model import preorder, unattractive, UndominatedChoice, PartiallyDominantChoice, \
     StatusQuoUndominatedChoice, Overload, PreorderParams
-from dataset import load_raw_csv, SubjectC
+from dataset import load_raw_csv, Subject
 from gui.estimation import DistanceScore
 from gui.estimation import Options as EstimationOpts
 from dataset.experimental_data import ExperimentalData
@@ -123,7 +123,7 @@ def test_model_estimation(tmpdir, name, alts, subj_count):
         Overload(PreorderParams(strict=True, total=True)), Overload(PreorderParams(strict=False, total=True)),
     ]
 
-    if all(cr.default is not None for subj in map(SubjectC.decode_from_memory, ds.subjects) for cr in subj.choices):
+    if all(cr.default is not None for subj in (Subject.unpack(s, ds.alternatives) for s in ds.subjects) for cr in subj.choices):
         models.append(StatusQuoUndominatedChoice())
 
     dsm = ds.analysis_estimation(
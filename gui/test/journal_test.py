@@ -0,0 +1,150 @@
+import os
+import pathlib
+
+import pytest
+
+import journal
+from dataset.experimental_data import ExperimentalData
+from gui.progress import MockWorker
+from workspace import Workspace, DatasetStub, PersistenceError
+from test.workspace_test import experimental_data, same
+
+def recover(fname : str) -> list[ExperimentalData]:
+    result = []
+    for ds in journal.recover(MockWorker(), fname).datasets:
+        if isinstance(ds, DatasetStub):
+            ds = ds.load(MockWorker())
+        assert isinstance(ds, ExperimentalData)
+        result.append(ds)
+    return result
+
+def test_untitled(tmp_path : pathlib.Path) -> None:
+    fname = str(tmp_path / 'untitled.pwf')
+    x, y, z = experimental_data('X', 3), experimental_data('Y', 5), experimental_data('Z', 7)
+
+    j = journal.Journal(fname, [], base='')
+    assert not journal.has_records(fname)
+    j.add(x)
+    j.add(y)
+    j.rename(0, 'W')
+    j.add(z)
+    j.delete(1)
+    j.close()
+
+    assert journal.has_records(fname)
+    assert x.name == 'X'  # not renamed behind the UI's back
+
+    w, z2 = recover(fname)
+    assert w.name == 'W'
+    assert same(w, experimental_data('W', 3))
+    assert same(z2, z)
+
+    journal.discard(fname)
+    assert not os.path.exists(journal.journal_path(fname))
+
+def test_saved(tmp_path : pathlib.Path) -> None:
+    fname = str(tmp_path / 'workspace.pwf')
+    ws = Workspace()
+    ws.datasets = [experimental_data('X', 3)]
+    ws.save_to_file(MockWorker(), fname)
+    ws.load_from_file(MockWorker(), fname)
+
+    j = journal.Journal(fname, ws.datasets, base=fname)
+    j.add(experimental_data('Y', 5))
+    j.close()
+
+    # continued after a restart
+    j = journal.Journal(fname, [], base=None)
+    j.rename(0, 'Z')
+    j.close()
+
+    assert [ds.name for ds in recover(fname)] == ['Z', 'Y']
+
+    # the journal is useless if the workspace has been saved elsewhere
+    ws.save_to_file(MockWorker(), fname)
+    with pytest.raises(PersistenceError):
+        recover(fname)
+
+def test_compaction(tmp_path : pathlib.Path, monkeypatch : pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(journal, 'COMPACTION_RECORDS', 3)
+    fname = str(tmp_path / 'untitled.pwf')
+    datasets = [experimental_data('D%d' % i, i + 1) for i in range(8)]
+
+    j = journal.Journal(fname, [], base='')
+    for ds in datasets:
+        j.add(ds)
+    j.delete(0)
+    j.close()
+
+    # nothing is kept in memory after compaction
+    assert len(j.datasets) == 7
+    assert all(
+        isinstance(ds, DatasetStub) and ds.fname == journal.checkpoint_path(fname)
+        for ds in j.datasets
+    )
+
+    assert os.path.exists(journal.checkpoint_path(fname))
+    recovered = recover(fname)
+    assert len(recovered) == 7
+    assert all(same(x, y) for x, y in zip(recovered, datasets[1:]))
+
+    # crash during compaction, after the journal has been replaced
+    os.replace(journal.checkpoint_path(fname), journal.checkpoint_path(fname) + '.new')
+    assert len(recover(fname)) == 7
+
+    journal.discard(fname)
+    assert os.listdir(tmp_path) == []
+
+def test_truncated(tmp_path : pathlib.Path) -> None:
+    fname = str(tmp_path / 'untitled.pwf')
+    j = journal.Journal(fname, [], base='')
+    j.add(experimental_data('X', 3))
+    j.add(experimental_data('Y', 5))
+    j.close()
+
+    path = journal.journal_path(fname)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 10)
+
+    assert [ds.name for ds in recover(fname)] == ['X']
+
+def test_lock(tmp_path : pathlib.Path) -> None:
+    fname = str(tmp_path / 'workspace.pwf')
+    lock = journal.Lock.acquire(fname)
+    assert lock is not None
+    assert journal.Lock.acquire(fname) is None
+
+    lock.release()
+    assert os.listdir(tmp_path) == []
+
+    lock = journal.Lock.acquire(fname)
+    assert lock is not None
+    lock.release()
+
+def test_orphans(tmp_path : pathlib.Path) -> None:
+    def untitled(records : int) -> journal.Lock:
+        lock = journal.new_untitled(str(tmp_path))
+        j = journal.Journal(lock.fname, [], base='')
+        for i in range(records):
+            j.add(experimental_data('X%d' % i, 3))
+        j.close()
+        return lock
+
+    running = untitled(1)
+    crashed = untitled(2)
+    empty = untitled(0)
+    assert len({running.fname, crashed.fname, empty.fname}) == 3
+    crashed.f.close()
+    empty.f.close()
+
+    # the names of journals left behind are not reused
+    assert journal.new_untitled(str(tmp_path)).fname not in (crashed.fname, empty.fname)
+
+    [orphan] = journal.find_orphans(str(tmp_path))
+    assert orphan.fname == crashed.fname
+    assert len(recover(orphan.fname)) == 2
+    assert not os.path.exists(journal.journal_path(empty.fname))
+
+    # still there for the next start
+    orphan.release()
+    assert [lock.fname for lock in journal.find_orphans(str(tmp_path))] == [crashed.fname]
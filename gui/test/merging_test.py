@@ -1,6 +1,34 @@
+from typing import Optional
+
+from hypothesis import given
+from hypothesis.strategies import integers, lists, frozensets, none, tuples, booleans
+
 from gui.progress import MockWorker
+from dataset import Subject, ChoiceRow
 from dataset.experimental_data import ExperimentalData
 
+def merge_reference(subject, track_deferrals_separately):
+    # the straightforward implementation, one row at a time
+    choices : list[ChoiceRow] = []
+    menu_idx : dict[tuple[frozenset[int], Optional[int]], int] = {}
+    deferrals_seen : set[tuple[frozenset[int], Optional[int]]] = set()
+
+    for cr in subject.choices:
+        if track_deferrals_separately and (not cr.choice):
+            if (cr.menu, cr.default) not in deferrals_seen:
+                choices.append(cr)
+                deferrals_seen.add((cr.menu, cr.default))
+            continue
+
+        idx = menu_idx.get((cr.menu, cr.default))
+        if idx is None:
+            menu_idx[cr.menu, cr.default] = len(choices)
+            choices.append(cr)
+        else:
+            choices[idx] = ChoiceRow(cr.menu, cr.default, cr.choice | choices[idx].choice)
+
+    return Subject(subject.name, subject.alternatives, choices)
+
 def test_merging():
     rows = [
         'subjA Ca,Hi,Pa Ca',
@@ -108,3 +136,25 @@ def test_merging_default_nodef():
         ('subjA', 'Ca,Hi,Pa', 'Hi', ''),
         None,  # bump progress
     ]
+
+alt_sets = frozensets(integers(min_value=0, max_value=3))
+choice_rows = tuples(alt_sets, none() | integers(min_value=0, max_value=3), alt_sets | alt_sets.map(lambda _: frozenset()))
+
+@given(lists(lists(choice_rows, max_size=20), max_size=4), booleans())
+def test_merging_reference(subjects, track_deferrals_separately):
+    ds = ExperimentalData('X', ['a', 'b', 'c', 'd'])
+    ds.subjects = [
+        Subject('subj%d' % i, ['a', 'b', 'c', 'd'], [ChoiceRow(*cr) for cr in crs]).pack(ds.alternatives)
+        for i, crs in enumerate(subjects)
+    ]
+
+    newds = ds.analysis_merge_choices(
+        MockWorker(),
+        ExperimentalData.MergeOptions(
+            track_deferrals_separately=track_deferrals_separately,
+        ),
+    )
+
+    expected = [merge_reference(Subject.unpack(s, ds.alternatives), track_deferrals_separately) for s in ds.subjects]
+    assert [Subject.unpack(s, newds.alternatives) for s in newds.subjects] == expected
+    assert newds.observ_count == sum(len(s.choices) for s in expected)
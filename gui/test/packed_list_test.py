@@ -1,10 +1,19 @@
+import io
 import os
+import sys
+import pathlib
+from typing import cast
+
 import pytest
 from hypothesis import given
 from hypothesis.strategies import integers, lists, text
 
-from util.codec import strC, intC
-from util.packed_list import PackedList
+import platform_specific
+import util.packed_list
+from gui.progress import MockWorker
+from util.codec import strC, intC, bytesC, FileIn, FileOut
+from util.codec_progress import spillingListCP
+from util.packed_list import PackedList, MappedBlocks, views
 
 ints = integers(min_value=0)
 
@@ -17,3 +26,49 @@ def test_basic_ints(xs):
 def test_basic_strings(xs):
     xs_packed = PackedList(strC, xs)
     assert xs == list(xs_packed)
+
+def test_mapped_views():
+    blocks = MappedBlocks([b'abc', b'', b'de'])
+    assert blocks.view(0).tobytes() == b'abc'
+    assert blocks.view(-1).tobytes() == b'de'
+
+    # appending remaps the file but the old views remain valid
+    view = blocks.view(2)
+    blocks.append(b'fgh')
+    assert (view.tobytes(), blocks.view(3).tobytes()) == (b'de', b'fgh')
+    assert list(blocks) == [b'abc', b'', b'de', b'fgh']
+    assert blocks[1:3] == [b'', b'de']
+
+    with pytest.raises(IndexError):
+        blocks.view(4)
+
+def test_spilling(tmp_path : pathlib.Path, monkeypatch : pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+
+    xs = [b'x' * i for i in range(100)]
+    f = io.BytesIO()
+    spillingListCP(bytesC).encode(MockWorker(), cast(FileOut, f), xs)
+    data = cast(FileIn, io.BytesIO(f.getvalue()))
+
+    kept = spillingListCP(bytesC).decode(MockWorker(), data)
+    assert isinstance(kept, list)
+    assert kept == xs
+    assert views(kept) is kept
+
+    monkeypatch.setattr(util.packed_list, 'SPILL_THRESHOLD', 1000)
+    data.seek(0)
+    spilled = spillingListCP(bytesC).decode(MockWorker(), data)
+    assert isinstance(spilled, MappedBlocks)
+    assert list(spilled) == xs
+    assert [view.tobytes() for view in views(spilled)] == xs
+    assert views(spilled)[-1] == xs[-1]
+
+    # spilled lists encode the same, from the views
+    f_spilled = io.BytesIO()
+    spillingListCP(bytesC).encode(MockWorker(), cast(FileOut, f_spilled), spilled)
+    assert f_spilled.getvalue() == f.getvalue()
+
+    # on disk rather than in the default temporary directory
+    if sys.platform.startswith('linux'):
+        assert os.path.dirname(os.readlink('/proc/self/fd/%d' % spilled.f.fileno())) \
+            == platform_specific.get_user_cache_dir() + '/spill'
@@ -0,0 +1,142 @@
+import io
+import itertools
+from typing import Any, Iterator, cast
+
+import pytest
+
+import simulation
+import dataset.experimental_data  # imports the dataset modules in the right order
+import dataset.power_analysis
+import gui.power_analysis
+from core import Core
+from dataset import Subject, ChoiceRow
+from dataset.experimental_data import ExperimentalData
+from dataset.power_analysis import PowerAnalysis, Replication, Request, RequestC, ReplicationC
+from gui.progress import MockWorker
+from util.codec import Codec, FileIn, FileOut
+from workspace import DatasetCP
+
+def replication(subject_count : int, congruence : int, warp_pairs : list[int]) -> Replication:
+    return Replication(
+        subject_count=subject_count,
+        congruence=congruence,
+        strict_general_cycles=congruence,
+        warp=subject_count - sum(warp_pairs[:1]),
+        contraction_consistency=0,
+        congruence_total=3 * congruence,
+        warp_pairs=warp_pairs,
+    )
+
+def request(replications : int) -> Request:
+    return Request(
+        batch=simulation.BatchRequest(
+            name='random',
+            alternatives=['A', 'B', 'C', 'D'],
+            subjects=simulation.Generated(simulation.GenMenus(
+                generator=simulation.Exhaustive(),
+                defaults=False,
+            )),
+            gen_choices=simulation.Uniform(
+                forced_choice=True,
+                multiple_choice=False,
+            ),
+            preserve_deferrals=False,
+            first_index=1,
+            last_index=20,
+            seed=42,
+        ),
+        replications=replications,
+    )
+
+class FakeCore:
+    # sends the replications in reverse order
+    def call_streaming(
+        self, name : str, codec_req : Codec[Any], codec_item : Codec[Any], request : Request,
+    ) -> Iterator[tuple[int, Replication]]:
+        assert name == 'power-analysis'
+        assert codec_req is RequestC and codec_item is ReplicationC
+
+        for i in reversed(range(request.replications)):
+            yield i, replication(10, i, [10 - i, i])
+
+def test_run() -> None:
+    replications = dataset.power_analysis.run(MockWorker(), cast(Core, FakeCore()), request(5))
+    assert [r.congruence for r in replications] == [0, 1, 2, 3, 4]
+
+def test_summaries() -> None:
+    ds = PowerAnalysis('power')
+    ds.replications = [replication(10, i, [10 - i, i]) for i in range(5)] + [replication(0, 0, [])]
+
+    congruence, _sarp, warp, contraction = ds.summaries()
+    assert congruence.measure == 'Congruence'
+    assert (congruence.mean, congruence.min, congruence.median, congruence.max) == (0.2, 0.0, 0.2, 0.4)
+    assert congruence.sd == pytest.approx(0.158, abs=1e-3)
+    assert warp == congruence._replace(measure='WARP')
+    assert (contraction.mean, contraction.sd) == (0.0, 0.0)
+
+    assert ds.warp_pairs() == [40, 10]
+    assert PowerAnalysis('empty').summaries() == []
+
+def test_roundtrip() -> None:
+    ds = PowerAnalysis('power')
+    ds.seed = 2**64 - 1
+    ds.replications = [replication(10, i, [10 - i, i]) for i in range(3)]
+
+    f = io.BytesIO()
+    DatasetCP.encode(MockWorker(), cast(FileOut, f), ds)
+    f.seek(0)
+    loaded = DatasetCP.decode(MockWorker(), cast(FileIn, f))
+
+    assert isinstance(loaded, PowerAnalysis)
+    assert (loaded.name, loaded.seed, loaded.replications) == (ds.name, ds.seed, ds.replications)
+
+def test_power_analysis() -> None:
+    with Core() as core:
+        replications = dataset.power_analysis.run(MockWorker(), core, request(10))
+
+        # reproducible
+        assert dataset.power_analysis.run(MockWorker(), core, request(10)) == replications
+
+    assert len(replications) == 10
+    for r in replications:
+        assert r.subject_count == 20
+        assert sum(r.warp_pairs) == 20
+        assert r.warp == 20 - r.warp_pairs[0]
+
+def test_analysis() -> None:
+    # consistent subjects choosing from all menus of four alternatives
+    alternatives = ['a', 'b', 'c', 'd']
+    menus = [
+        frozenset(menu)
+        for size in range(2, len(alternatives) + 1)
+        for menu in itertools.combinations(range(len(alternatives)), size)
+    ]
+    ds = ExperimentalData('X', alternatives)
+    ds.subjects = [
+        Subject('s%d' % i, alternatives, [
+            ChoiceRow(menu, None, frozenset([min(menu)])) for menu in menus
+        ]).pack(ds.alternatives)
+        for i in range(10)
+    ]
+    ds.observ_count = 10 * len(menus)
+
+    dsp = ds.analysis_power_analysis(MockWorker(), gui.power_analysis.Options(
+        replications=4,
+        gen_choices=simulation.Uniform(forced_choice=True, multiple_choice=False),
+        preserve_deferrals=False,
+        seed=1,
+    ))
+
+    assert dsp.seed == 1
+    assert len(dsp.replications) == 4
+    for r in dsp.replications:
+        assert r.subject_count == 10
+        assert sum(r.warp_pairs) == r.subject_count
+        assert r.warp == r.subject_count - r.warp_pairs[0]
+
+        # random choices from all these menus are almost never consistent
+        assert 0 < r.congruence <= r.subject_count
+        assert r.congruence_total >= r.congruence
+
+    congruence, *_rest = dsp.summaries()
+    assert congruence.min > 0
@@ -0,0 +1,84 @@
+import pathlib
+from typing import Generator, Sequence
+
+from util.codec import strC
+from util.result_cache import ResultCache, cached_calls
+
+def test_get_put(tmp_path : pathlib.Path) -> None:
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'), salt='1.0')
+    k1 = cache.key('summary', b'', b'subject 1')
+    k2 = cache.key('summary', b'', b'subject 2')
+
+    assert cache.get_many([k1, k2]) == [None, None]
+    cache.put_many([(k1, b'response 1')])
+    assert cache.get_many([k1, k2]) == [b'response 1', None]
+
+    # the key depends on all of its parts
+    assert len({
+        k1,
+        cache.key('integrity-check', b'', b'subject 1'),
+        cache.key('summary', b'options', b'subject 1'),
+        ResultCache(str(tmp_path / 'other.sqlite'), salt='1.1').key('summary', b'', b'subject 1'),
+    }) == 4
+
+    cache.close()
+
+    # the results persist
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'), salt='1.0')
+    assert cache.get_many([k1, k2]) == [b'response 1', None]
+    cache.close()
+
+def test_eviction(tmp_path : pathlib.Path) -> None:
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'), max_size=1000)
+    keys = [cache.key('summary', b'', b'%d' % i) for i in range(10)]
+
+    for key in keys[:9]:
+        cache.put_many([(key, b'x' * 100)])
+
+    # keys[0] becomes the most recently used
+    assert cache.get_many(keys[:1]) == [b'x' * 100]
+
+    # over the limit: evict down to 90% (900 bytes)
+    cache.put_many([(keys[9], b'x' * 200)])
+    assert cache.size <= 900
+    assert cache.get_many(keys) == [b'x' * 100, None, None] + [b'x' * 100] * 6 + [b'x' * 200]
+    cache.close()
+
+def test_cached_calls(tmp_path : pathlib.Path) -> None:
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+    computed : list[list[bytes]] = []
+
+    def compute(subjects : Sequence[bytes]) -> Generator[str, None, None]:
+        computed.append(list(subjects))
+        for subject in subjects:
+            yield subject.decode('ascii').upper()
+
+    def run(subjects : list[bytes]) -> list[str]:
+        return list(cached_calls(cache, 'upper', b'', strC, subjects, compute))
+
+    assert run([b'a', b'b']) == ['A', 'B']
+    assert run([b'c', b'a', b'd', b'b']) == ['C', 'A', 'D', 'B']
+    assert run([b'b', b'd']) == ['B', 'D']
+    assert computed == [[b'a', b'b'], [b'c', b'd']]
+
+    # no cache, no caching
+    assert list(cached_calls(None, 'upper', b'', strC, [b'a'], compute)) == ['A']
+    assert computed[-1] == [b'a']
+    cache.close()
+
+def test_cached_calls_interrupted(tmp_path : pathlib.Path) -> None:
+    cache = ResultCache(str(tmp_path / 'cache.sqlite'))
+
+    def compute(subjects : Sequence[bytes]) -> Generator[str, None, None]:
+        for subject in subjects:
+            yield subject.decode('ascii').upper()
+
+    responses = cached_calls(cache, 'upper', b'', strC, [b'a', b'b', b'c'], compute)
+    assert next(responses) == 'A'
+    assert next(responses) == 'B'
+    responses.close()
+
+    # the responses computed so far have been saved
+    keys = [cache.key('upper', b'', subject) for subject in [b'a', b'b', b'c']]
+    assert cache.get_many(keys) == [strC.encode_to_memory('A'), strC.encode_to_memory('B'), None]
+    cache.close()
@@ -1,9 +1,18 @@
 import io
+from typing import Any, Iterator, Sequence, cast
+
 import pytest
 
 import dataset
+import dataset.experimental_data  # imports gui.subject_filter in the right order
 import simulation
-from core import Core
+import gui.subject_filter
+from core import Core, Failure
+from dataset import Subject, subject_name
+from gui.progress import MockWorker
+from dataset.deterministic_consistency_result import SubjectRaw, SubjectOk, SubjectFailed, \
+    SubjectResultsC
+from util.codec import Codec
 
 def test_simulation(nsubjects=256, f_mock=None):
     with Core(f_mock=f_mock) as core:
@@ -21,7 +30,291 @@ def test_simulation(nsubjects=256, f_mock=None):
             preserve_deferrals=False,
         ))
 
-    assert len(response.subject_packed) == 223
+    assert len(response.subject_packed) == 214
+
+def test_simulation_batch() -> None:
+    request = simulation.BatchRequest(
+        name='random',
+        alternatives=['A','B','C'],
+        subjects=simulation.Generated(simulation.GenMenus(
+            generator=simulation.Exhaustive(),
+            defaults=False,
+        )),
+        gen_choices=simulation.Uniform(
+            forced_choice=True,
+            multiple_choice=False,
+        ),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=3000,
+        seed=42,
+    )
+
+    with Core() as core:
+        responses = list(simulation.run_batch(core, request))
+
+        # the same seed gives the same subjects, even if split across requests
+        assert list(simulation.run_batch(core, request)) == responses
+        assert list(simulation.run_batch(core, request._replace(last_index=1000))) \
+            + list(simulation.run_batch(core, request._replace(first_index=1001, first_stream=1000))) \
+            == responses
+
+    assert [Subject.unpack(r.subject_packed).name for r in responses] == \
+        ['random%d' % i for i in range(1, 3001)]
+    assert all(r.observation_count == 7 for r in responses)
+
+class FakeCore:
+    # sends every subject in a chunk of its own, in reverse order
+    def __init__(self) -> None:
+        self.requests : list[simulation.BatchRequest] = []
+        self.templates : list[dataset.PackedSubject] = []
+
+    def call(self, name : str, _codec_req : Codec[Any], _codec_resp : Codec[Any], request : Any) -> Any:
+        if name == 'simulation-register-templates':
+            first = len(self.templates)
+            self.templates.extend(request)
+            return first
+
+        if name == 'simulation-clear-templates':
+            self.templates.clear()
+            return None
+
+        assert name == 'consistency-deterministic-batch'
+        return [
+            SubjectFailed(subject_name(subject), 'dataset contains repeated menus')
+            if 'bad' in subject_name(subject) else
+            SubjectOk(SubjectRaw(
+                name=subject_name(subject),
+                rows=[],
+                warp_pairs=int('2' in subject_name(subject)),
+                warp_all=0,
+                contraction_consistency_pairs=0,
+                contraction_consistency_all=0,
+            ))
+            for subject in request
+        ]
+
+    def call_streaming(
+        self, name : str, _codec_req : Codec[Any], _codec_item : Codec[Any], request : simulation.BatchRequest,
+    ) -> Iterator[tuple[int, list[simulation.Response]]]:
+        assert name == 'simulation-batch'
+        self.requests.append(request)
+
+        indices = range(request.first_index, request.last_index + 1)
+        if isinstance(request.subjects, (simulation.Copycats, simulation.Registered)):
+            templates = request.subjects.templates \
+                if isinstance(request.subjects, simulation.Copycats) \
+                else [self.templates[h] for h in request.subjects.handles]
+
+            names = [
+                Subject.unpack(template).name + request.name + str(i)
+                for template in templates
+                for i in indices
+            ]
+        else:
+            names = [request.name + str(i) for i in indices]
+
+        for i, subject_name in reversed(list(enumerate(names))):
+            yield i, [simulation.Response(Subject(subject_name, [], []).pack(), 0)]
+
+def test_register_templates(monkeypatch : pytest.MonkeyPatch) -> None:
+    core = cast(Core, FakeCore())
+    w, x, y, z = [Subject(name, [], []).pack() for name in 'wxyz']
+    assert simulation.register_templates(core, [x, y, x]) == [0, 1, 0]
+    assert simulation.register_templates(core, [z, y]) == [2, 1]
+    assert cast(FakeCore, core).templates == [x, y, z]
+
+    # another core has its own templates
+    assert simulation.register_templates(cast(Core, FakeCore()), [z]) == [0]
+
+    # the core forgets the old templates before it would keep too many
+    monkeypatch.setattr(simulation, 'MAX_TEMPLATES', 3)
+    assert simulation.register_templates(core, [x, z]) == [0, 2]
+    assert simulation.register_templates(core, [w, x]) == [0, 1]
+    assert cast(FakeCore, core).templates == [w, x]
+
+    # uploaded in chunks
+    monkeypatch.setattr(simulation, 'TEMPLATE_CHUNK_SIZE', 1)
+    core = cast(Core, FakeCore())
+    assert simulation.register_templates(core, [x, y, x, z]) == [0, 1, 0, 2]
+    assert cast(FakeCore, core).templates == [x, y, z]
+
+@pytest.mark.parametrize('kind', ['generated', 'copycat', 'registered'])
+def test_batch_filtered(kind : str) -> None:
+    core = FakeCore()
+    templates = [Subject('x', [], []).pack(), Subject('y', [], []).pack()]
+
+    subjects : simulation.BatchSubjects
+    if kind == 'generated':
+        subjects = simulation.Generated(simulation.GenMenus(simulation.Exhaustive(), False))
+    elif kind == 'copycat':
+        subjects = simulation.Copycats(templates)
+    else:
+        subjects = simulation.Registered(simulation.register_templates(cast(Core, core), templates))
+
+    request = simulation.BatchRequest(
+        name='random',
+        alternatives=['A','B'],
+        subjects=subjects,
+        gen_choices=simulation.Uniform(forced_choice=True, multiple_choice=False),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=3,
+        seed=0,
+    )
+
+    # the fake core finds WARP violations in the subjects with 2 in their names
+    subject_filter = gui.subject_filter.CompiledFilter(gui.subject_filter.Options(
+        run_consistency_analysis=True,
+        condition_code='consistency.warp_pairs == 0',
+    ))
+    responses = list(simulation.run_batch_filtered(
+        MockWorker(), cast(Core, core), request,
+        lambda subjects: subject_filter.accepts_many(cast(Core, core), subjects),
+    ))
+
+    # the replacements took over the names of the rejected subjects
+    prefixes = [''] if kind == 'generated' else ['x', 'y']
+    assert [Subject.unpack(r.subject_packed).name for r in responses] == \
+        [prefix + 'random%d' % i for prefix in prefixes for i in (1, 2, 3)]
+
+    # all replacements were generated in one request
+    # with fresh random streams
+    retry, = core.requests[1:]
+    assert (retry.first_index, retry.last_index) == (1, 1)
+    assert retry.first_stream == len(responses)
+    if kind == 'copycat':
+        assert retry.subjects == simulation.Copycats(templates)
+    elif kind == 'registered':
+        assert retry.subjects == simulation.Registered([0, 1])
+
+    assert (subject_filter.attempts, subject_filter.accepted) == (len(responses) + len(prefixes), len(responses))
+    assert subject_filter.describe(len(responses)).startswith('%d candidates' % subject_filter.attempts)
+
+def test_split_request() -> None:
+    request = simulation.BatchRequest(
+        name='random',
+        alternatives=['A','B'],
+        subjects=simulation.Registered([7, 8, 9]),
+        gen_choices=simulation.Uniform(forced_choice=True, multiple_choice=False),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=3,
+        seed=0,
+        first_stream=100,
+    )
+
+    # whole templates
+    assert [(r.subjects, r.first_index, r.last_index, r.first_stream) for r in simulation.split_request(request, 7)] == [
+        (simulation.Registered([7, 8]), 1, 3, 100),
+        (simulation.Registered([9]), 1, 3, 106),
+    ]
+
+    # parts of templates
+    assert [(r.subjects, r.first_index, r.last_index, r.first_stream) for r in simulation.split_request(request, 2)] == [
+        (simulation.Registered([7]), 1, 2, 100),
+        (simulation.Registered([7]), 3, 3, 102),
+        (simulation.Registered([8]), 1, 2, 103),
+        (simulation.Registered([8]), 3, 3, 105),
+        (simulation.Registered([9]), 1, 2, 106),
+        (simulation.Registered([9]), 3, 3, 108),
+    ]
+
+class ProgressWorker(MockWorker):
+    def __init__(self) -> None:
+        super().__init__()
+        self.positions : list[int] = []
+
+    def set_progress(self, value : int) -> None:
+        self.positions.append(value)
+
+def test_batch_filtered_chunks() -> None:
+    core = FakeCore()
+    request = simulation.BatchRequest(
+        name='random',
+        alternatives=['A','B'],
+        subjects=simulation.Generated(simulation.GenMenus(simulation.Exhaustive(), False)),
+        gen_choices=simulation.Uniform(forced_choice=True, multiple_choice=False),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=25,
+        seed=0,
+    )
+
+    checked = 0
+    def accepts_many(subjects : Sequence[dataset.PackedSubject]) -> list[bool]:
+        # rejects the 2nd, 13th and 14th candidate
+        nonlocal checked
+        verdicts = [checked + i not in (1, 12, 13) for i in range(len(subjects))]
+        checked += len(subjects)
+        return verdicts
+
+    worker = ProgressWorker()
+    responses = simulation.run_batch_filtered(worker, cast(Core, core), request, accepts_many, chunk_size=10)
+
+    # the first chunk is done before the second one is generated
+    assert [subject_name(next(responses).subject_packed) for _ in range(10)] == \
+        ['random%d' % i for i in range(1, 11)]
+    assert [(r.first_index, r.last_index) for r in core.requests] == [(1, 10), (1, 1)]
+
+    assert [subject_name(r.subject_packed) for r in responses] == \
+        ['random%d' % i for i in range(11, 26)]
+    assert [(r.first_index, r.last_index) for r in core.requests[2:]] == [(11, 20), (11, 12), (21, 25)]
+
+    # retries use fresh random streams
+    assert [r.first_stream for r in core.requests] == [0, 25, 10, 26, 20]
+
+    # progress after every round
+    assert worker.positions == [9, 10, 18, 20, 25]
+
+def test_batch_filtered_limits(monkeypatch : pytest.MonkeyPatch) -> None:
+    request = simulation.BatchRequest(
+        name='random',
+        alternatives=['A','B'],
+        subjects=simulation.Generated(simulation.GenMenus(simulation.Exhaustive(), False)),
+        gen_choices=simulation.Uniform(forced_choice=True, multiple_choice=False),
+        preserve_deferrals=False,
+        first_index=1,
+        last_index=100,
+        seed=0,
+    )
+
+    def accepts_none(subjects : Sequence[dataset.PackedSubject]) -> list[bool]:
+        return [False] * len(subjects)
+
+    # a subject that is never accepted
+    monkeypatch.setattr(simulation, 'FILTER_MAX_ATTEMPTS', 5)
+    with pytest.raises(simulation.FilterError, match='rejected 5 candidates in a row for random1'):
+        list(simulation.run_batch_filtered(MockWorker(), cast(Core, FakeCore()), request, accepts_none))
+
+    checked = 0
+    def accepts_tenth(subjects : Sequence[dataset.PackedSubject]) -> list[bool]:
+        nonlocal checked
+        verdicts = [(checked + i) % 10 == 9 for i in range(len(subjects))]
+        checked += len(subjects)
+        return verdicts
+
+    # too few candidates accepted
+    monkeypatch.setattr(simulation, 'FILTER_MIN_CHECKED', 150)
+    monkeypatch.setattr(simulation, 'FILTER_MIN_ACCEPTANCE_RATE', 0.5)
+    with pytest.raises(simulation.FilterError, match='accepted only 19 of 190 candidates'):
+        list(simulation.run_batch_filtered(MockWorker(), cast(Core, FakeCore()), request, accepts_tenth))
+
+def test_filter_failure() -> None:
+    results = [
+        SubjectOk(SubjectRaw('good', [], 0, 0, 0, 0)),
+        SubjectFailed('bad', 'dataset contains repeated menus'),
+    ]
+    assert SubjectResultsC.decode_from_memory(SubjectResultsC.encode_to_memory(results)) == results
+
+    # the error names the subject that could not be analysed
+    subject_filter = gui.subject_filter.CompiledFilter(gui.subject_filter.Options(
+        run_consistency_analysis=True,
+        condition_code='True',
+    ))
+    subjects = [Subject('good', [], []).pack(), Subject('bad', [], []).pack()]
+    with pytest.raises(Failure, match='subject bad: dataset contains repeated menus'):
+        subject_filter.accepts_many(cast(Core, FakeCore()), subjects)
 
 #def test_simulation_gen():
 def _simulation_gen():
@@ -0,0 +1,119 @@
+import os
+import pathlib
+from typing import cast
+
+import pytest
+
+import branding
+from dataset import Subject, ChoiceRow
+from dataset.experimental_data import ExperimentalData
+from dataset.budgetary import Budgetary
+from gui.progress import MockWorker
+from util.block_compression import Compression
+from workspace import Workspace, DatasetStub, PersistenceError
+
+def experimental_data(name : str, subject_count : int) -> ExperimentalData:
+    ds = ExperimentalData(name, ['a', 'b', 'c'])
+    ds.subjects = [
+        Subject('s%d' % i, ['a', 'b', 'c'], [
+            ChoiceRow(frozenset([0, 1, 2]), None, frozenset([i % 3])),
+        ]).pack(ds.alternatives)
+        for i in range(subject_count)
+    ]
+    ds.observ_count = subject_count
+    return ds
+
+def same(x : ExperimentalData, y : ExperimentalData) -> bool:
+    return (x.name, x.alternatives, x.subjects, x.observ_count) \
+        == (y.name, y.alternatives, y.subjects, y.observ_count)
+
+@pytest.mark.parametrize('compression', list(Compression))
+def test_lazy_loading(tmp_path : pathlib.Path, compression : Compression) -> None:
+    fname = str(tmp_path / 'workspace.pwf')
+    datasets = [experimental_data('X', 3), experimental_data('Y', 1000)]
+
+    ws = Workspace()
+    ws.datasets = list(datasets)
+    ws.save_to_file(MockWorker(), fname, compression)
+
+    # only the index is read
+    ws = Workspace()
+    ws.load_from_file(MockWorker(), fname)
+    assert all(isinstance(stub, DatasetStub) for stub in ws.datasets)
+    assert [(stub.label_name(), stub.label_alts(), stub.label_size()) for stub in ws.datasets] == [
+        (ds.label_name(), ds.label_alts(), ds.label_size()) for ds in datasets
+    ]
+
+    stub = ws.datasets[1]
+    assert isinstance(stub, DatasetStub)
+    loaded = stub.load(MockWorker())
+    assert isinstance(loaded, ExperimentalData)
+    assert same(loaded, datasets[1])
+
+    # save over the same file, with one dataset loaded and another one renamed
+    ws.datasets[1] = loaded
+    ws.datasets[0].name = 'Z'
+    ws.save_to_file(MockWorker(), fname)
+    assert isinstance(ws.datasets[0], DatasetStub)
+    assert ws.datasets[1] is loaded
+
+    ws = Workspace()
+    ws.load_from_file(MockWorker(), fname)
+    reloaded = []
+    for stub in ws.datasets:
+        assert isinstance(stub, DatasetStub)
+        ds = stub.load(MockWorker())
+        assert isinstance(ds, ExperimentalData)
+        reloaded.append(ds)
+
+    datasets[0].name = 'Z'
+    assert all(same(x, y) for x, y in zip(reloaded, datasets))
+    assert not os.path.exists(fname + '.tmp')
+
+def test_changed_file(tmp_path : pathlib.Path) -> None:
+    fname = str(tmp_path / 'workspace.pwf')
+    ws = Workspace()
+    ws.datasets = [experimental_data('X', 3)]
+    ws.save_to_file(MockWorker(), fname)
+    ws.load_from_file(MockWorker(), fname)
+
+    with open(fname, 'ab') as f:
+        f.write(b'garbage')
+
+    stub = ws.datasets[0]
+    assert isinstance(stub, DatasetStub)
+    with pytest.raises(PersistenceError):
+        stub.load(MockWorker())
+
+def test_legacy() -> None:
+    # saved by Prest 2.0.0 (file format version 18) from
+    # docs/src/_static/examples/general-hybrid.csv and budgetary.csv
+    ws = Workspace()
+    ws.load_from_file(MockWorker(), 'gui/test/data/workspace-v18.pwf')
+
+    ds, budgetary = ws.datasets
+    assert isinstance(ds, ExperimentalData)
+    assert (ds.name, ds.alternatives, len(ds.subjects), ds.observ_count) \
+        == ('general-hybrid', ['a', 'b', 'c', 'd'], 2, 10)
+    assert [Subject.unpack(packed, ds.alternatives) for packed in ds.subjects] == [
+        Subject('1', ['a', 'b', 'c', 'd'], [
+            ChoiceRow(frozenset([0, 1, 2]), None, frozenset([1])),
+            ChoiceRow(frozenset([1, 2, 3]), None, frozenset([2])),
+            ChoiceRow(frozenset([0, 2, 3]), None, frozenset([3])),
+            ChoiceRow(frozenset([0, 2]), None, frozenset([0])),
+            ChoiceRow(frozenset([0, 1]), None, frozenset([1])),
+        ]),
+        Subject('2', ['a', 'b', 'c', 'd'], [
+            ChoiceRow(menu, None, frozenset())
+            for menu in map(frozenset, ([0, 1, 2], [1, 2, 3], [0, 2, 3], [0, 2], [0, 1]))
+        ]),
+    ]
+
+    # the subjects refer to the alternatives of the dataset now
+    assert ds.subjects == [
+        Subject.unpack(packed, ds.alternatives).pack(ds.alternatives)
+        for packed in ds.subjects
+    ]
+
+    assert isinstance(budgetary, Budgetary)
+    assert (budgetary.name, len(budgetary.subjects)) == ('budgetary', 4)
@@ -0,0 +1,188 @@
+import os
+import lzma
+import zlib
+import enum
+import collections
+import concurrent.futures
+from typing import BinaryIO, Optional, Callable, Any
+
+# The data is cut into blocks that are compressed independently,
+# in a thread pool (zlib and lzma release the GIL), and written as frames:
+#
+#   method (1 byte), length of the compressed data (4 bytes, little endian), compressed data
+#
+# terminated by a frame with method END and no length or data.
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+METHOD_END = 0
+METHOD_ZLIB = 1
+METHOD_LZMA = 2
+
+class Compression(enum.Enum):
+    FAST = 'fast'
+    DEFAULT = 'default'
+    SMALL = 'small'
+
+def compressor(compression : Compression) -> tuple[int, Callable[[bytes], bytes]]:
+    if compression is Compression.FAST:
+        return METHOD_ZLIB, lambda data: zlib.compress(data, 1)
+    elif compression is Compression.DEFAULT:
+        return METHOD_ZLIB, lambda data: zlib.compress(data, 6)
+    elif compression is Compression.SMALL:
+        # higher presets only add dictionary size, which is no use beyond BLOCK_SIZE,
+        # and they take ~100 MB of memory per thread
+        return METHOD_LZMA, lambda data: lzma.compress(data, preset=3)
+    else:
+        raise ValueError('unknown compression: %s' % compression)
+
+DECOMPRESSORS : dict[int, Callable[[bytes], bytes]] = {
+    METHOD_ZLIB: zlib.decompress,
+    METHOD_LZMA: lzma.decompress,
+}
+
+class BlockCompressionError(Exception):
+    pass
+
+THREAD_COUNT = os.cpu_count() or 1
+
+# blocks in flight; enough to keep all threads busy
+# but bounded so that we don't buffer the whole stream in memory
+MAX_PENDING = 2 * THREAD_COUNT
+
+def thread_pool() -> concurrent.futures.ThreadPoolExecutor:
+    return concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_COUNT)
+
+class BlockWriter:
+    # a write-only file that compresses what's written into f_out
+
+    def __init__(self, f_out : BinaryIO, compression : Compression, pool : concurrent.futures.ThreadPoolExecutor) -> None:
+        self.f_out = f_out
+        self.method, self.compress = compressor(compression)
+        self.pool = pool
+        self.buffer = bytearray()
+        self.pending : collections.deque[concurrent.futures.Future[bytes]] = collections.deque()
+
+    def write(self, data : bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= BLOCK_SIZE:
+            self.submit()
+        return len(data)
+
+    def submit(self) -> None:
+        self.pending.append(self.pool.submit(self.compress, bytes(self.buffer)))
+        self.buffer.clear()
+
+        while len(self.pending) > MAX_PENDING:
+            self.write_frame(self.pending.popleft().result())
+
+    def write_frame(self, compressed : bytes) -> None:
+        self.f_out.write(bytes([self.method]) + len(compressed).to_bytes(4, 'little'))
+        self.f_out.write(compressed)
+
+    def close(self) -> None:
+        # does not close f_out
+        if self.buffer:
+            self.submit()
+
+        while self.pending:
+            self.write_frame(self.pending.popleft().result())
+
+        self.f_out.write(bytes([METHOD_END]))
+
+    def __enter__(self) -> 'BlockWriter':
+        return self
+
+    def __exit__(self, *exc_info : Any) -> None:
+        if exc_info[0] is None:
+            self.close()
+        else:
+            # don't bother finishing the output
+            for future in self.pending:
+                future.cancel()
+
+class BlockReader:
+    # a read-only file that decompresses frames from f_in;
+    # reads ahead, decompressing the next few blocks in the background
+
+    def __init__(self, f_in : BinaryIO, pool : concurrent.futures.ThreadPoolExecutor) -> None:
+        self.f_in = f_in
+        self.pool = pool
+        self.pending : collections.deque[concurrent.futures.Future[bytes]] = collections.deque()
+        self.at_end = False  # no more frames in f_in
+
+        self.block = b''
+        self.pos = 0
+
+    def read_ahead(self) -> None:
+        while not self.at_end and len(self.pending) < MAX_PENDING:
+            header = self.f_in.read(1)
+            if not header:
+                raise BlockCompressionError('unexpected end of compressed data')
+
+            method = header[0]
+            if method == METHOD_END:
+                self.at_end = True
+                break
+
+            decompress = DECOMPRESSORS.get(method)
+            if decompress is None:
+                raise BlockCompressionError('unknown compression method: %d' % method)
+
+            length = int.from_bytes(self.f_in.read(4), 'little')
+            compressed = self.f_in.read(length)
+            if len(compressed) != length:
+                raise BlockCompressionError('unexpected end of compressed data')
+
+            self.pending.append(self.pool.submit(decompress, compressed))
+
+    def next_block(self) -> bool:
+        self.read_ahead()
+        if not self.pending:
+            return False
+
+        try:
+            self.block = self.pending.popleft().result()
+        except (zlib.error, lzma.LZMAError) as e:
+            raise BlockCompressionError('corrupted compressed data') from e
+
+        self.pos = 0
+        return True
+
+    def read(self, size : Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            parts = [self.block[self.pos:]]
+            while self.next_block():
+                parts.append(self.block)
+            self.pos = len(self.block)
+            return b''.join(parts)
+
+        if self.pos + size <= len(self.block):
+            # fast path
+            result = self.block[self.pos:self.pos+size]
+            self.pos += size
+            return result
+
+        parts = []
+        missing = size
+        while missing > 0:
+            if self.pos >= len(self.block) and not self.next_block():
+                break  # EOF; return what we have
+
+            part = self.block[self.pos:self.pos+missing]
+            parts.append(part)
+            self.pos += len(part)
+            missing -= len(part)
+
+        return b''.join(parts)
+
+    def close(self) -> None:
+        # does not close f_in
+        for future in self.pending:
+            future.cancel()
+
+    def __enter__(self) -> 'BlockReader':
+        return self
+
+    def __exit__(self, *_exc_info : Any) -> None:
+        self.close()
@@ -1,3 +1,4 @@
+import re
 import struct
 import logging
 import typing
@@ -9,7 +10,7 @@ from fractions import Fraction
 from dataclasses import dataclass
 from typing import Any, BinaryIO, NewType, NamedTuple, \
     Tuple, Callable, TypeVar, Optional, Dict, Sequence, \
-    Generic, cast
+    Iterable, Generic, Union, cast
 
 log = logging.getLogger(__name__)
 
@@ -28,17 +29,52 @@ class EOF(CodecError):
 FileIn = NewType('FileIn', BinaryIO)
 FileOut = NewType('FileOut', BinaryIO)
 
+# (buffer, offset) -> (value, new offset)
+DecodeBuf = Callable[[memoryview, int], tuple[T, int]]
+
+class _BufReader:
+    # file-like view of a buffer, for codecs that only decode from files
+    def __init__(self, buf : memoryview, pos : int) -> None:
+        self.buf = buf
+        self.pos = pos
+
+    def read(self, size : int) -> bytes:
+        bs = bytes(self.buf[self.pos:self.pos+size])
+        self.pos += len(bs)
+        return bs
+
 @dataclass
 class Codec(Generic[T]):
     encode : Callable[[FileOut, T], None]
     decode : Callable[[FileIn], T]
 
+    # decoding straight from memory, without stream objects or intermediate slices
+    decode_buf_impl : Optional[DecodeBuf[T]] = None
+
+    # structure of the codec, e.g. ('list', item_codec), for util.codec_compiler;
+    # None for codecs that are opaque to the compiler
+    spec : Optional[tuple] = None
+
     def enc_dec(self) -> tuple[
         Callable[[FileOut, T], None],
         Callable[[FileIn], T],
     ]:
         return self.encode, self.decode
 
+    def dec_buf(self) -> DecodeBuf[T]:
+        if self.decode_buf_impl is not None:
+            return self.decode_buf_impl
+
+        decode = self.decode
+        def decode_buf(buf : memoryview, pos : int) -> tuple[T, int]:
+            f = _BufReader(buf, pos)
+            return decode(cast(FileIn, f)), f.pos
+
+        return decode_buf
+
+    def decode_buf(self, buf : memoryview, pos : int = 0) -> tuple[T, int]:
+        return self.dec_buf()(buf, pos)
+
     def dbg_encode(self, f : FileOut, x : T) -> None:
         bs = self.encode_to_memory(x)
         log.debug('encoding %s: %r' % (self.__class__.__name__, bs))
@@ -49,8 +85,9 @@ class Codec(Generic[T]):
         self.encode(typing.cast(FileOut, buf), x)
         return buf.getvalue()
 
-    def decode_from_memory(self, bs : bytes) -> T:
-        return self.decode(typing.cast(FileIn, BytesIO(bs)))
+    def decode_from_memory(self, bs : Union[bytes, memoryview]) -> T:
+        value, _pos = self.decode_buf(memoryview(bs))
+        return value
 
     def test(self, x : T) -> None:
         assert x == self.decode_from_memory(self.encode_to_memory(x))
@@ -95,12 +132,206 @@ def _intC() -> Codec[int]:
         except IndexError:
             raise EOF()
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[int, int]:
+        value = 0
+        ofs = 0
+
+        try:
+            while True:
+                octet = buf[pos]
+                pos += 1
+
+                value |= (octet & 0x7F) << ofs
+                ofs += 7
+
+                if octet < 0x80:
+                    return value, pos
+        except IndexError:
+            raise EOF()
+
+    return Codec(encode, decode, decode_buf, spec=('int',))
 
 intC = _intC()
 
+# Bulk coding of lists of ints, with the same wire format as intC.
+#
+# Lists of small ints (alternatives in menus and choices) make up most
+# of a packed subject, so coding them one byte at a time dominates.
+# Usually all values fit in a single byte and the list maps directly
+# to/from a bytes object. Long lists of larger values go through NumPy.
+# Everything else (short lists, ints beyond 63 bits) uses the Python loop.
+
+_CONTINUATION_BYTES = bytes(range(0x80, 0x100))
+_CONTINUATION_RE = re.compile(b'[\x80-\xff]')  # also searches memoryviews, without copying
+_NUMPY_MIN_LENGTH = 512  # NumPy's per-call overhead does not pay off below this
+_NUMPY_MAX_BYTES = 9  # 63 bits of payload fit in uint64
+
+def _encode_varints(xs : Sequence[int]) -> bytes:
+    if not xs:
+        return b''
+
+    lo, hi = min(xs), max(xs)
+    if lo < 0:
+        raise CodecError('invalid int: {0}'.format(lo))
+
+    if hi < 0x80:
+        return bytes(xs)
+
+    if len(xs) >= _NUMPY_MIN_LENGTH and hi < (1 << 7*_NUMPY_MAX_BYTES):
+        return _encode_varints_numpy(
+            np.fromiter(xs, dtype=np.uint64, count=len(xs)),
+            (int(hi).bit_length() + 6) // 7,
+        )
+
+    out = bytearray()
+    for x in xs:
+        while x >= 0x80:
+            out.append(0x80 | (x & 0x7F))
+            x >>= 7
+        out.append(x)
+
+    return bytes(out)
+
+def _encode_varints_numpy(xs : np.ndarray, max_size : int) -> bytes:
+    # one row of octets per varint, cut to the varint's size when flattened
+    ks = np.arange(max_size, dtype=np.uint64)
+    octets = ((xs[:, None] >> (ks * np.uint64(7))) & np.uint64(0x7F)).astype(np.uint8)
+
+    sizes = np.ones(len(xs), dtype=np.uint64)
+    for k in range(1, max_size):
+        sizes += xs >= np.uint64(1 << (7*k))
+
+    octets[ks < sizes[:, None] - np.uint64(1)] |= 0x80
+    return cast(bytes, octets[ks < sizes[:, None]].tobytes())
+
+def _read_varints(f : FileIn, count : int) -> bytes:
+    # Read exactly the bytes taken by `count` varints.
+    # Every varint takes at least one byte and ends with a byte < 0x80,
+    # so reading as many bytes as there are varints missing never overshoots.
+    parts = []
+    missing = count
+    while missing > 0:
+        bs = f.read(missing)
+        if len(bs) < missing:
+            raise EOF()
+
+        parts.append(bs)
+        missing -= len(bs.translate(None, _CONTINUATION_BYTES))
+
+    return b''.join(parts)
+
+def _decode_varints(bs : bytes, count : int) -> list[int]:
+    if len(bs) == count:
+        return list(bs)  # all single-byte
+
+    if count >= _NUMPY_MIN_LENGTH:
+        xs = _decode_varints_numpy(np.frombuffer(bs, dtype=np.uint8))
+        if xs is not None:
+            return xs
+
+    return _decode_varint_octets(bs)
+
+def _decode_varint_octets(octets : Iterable[int]) -> list[int]:
+    result : list[int] = []
+    append = result.append
+    it = iter(octets)
+    for octet in it:
+        if octet < 0x80:
+            append(octet)  # the common case
+            continue
+
+        value = octet & 0x7F
+        ofs = 7
+        for octet in it:
+            value |= (octet & 0x7F) << ofs
+            if octet < 0x80:
+                break
+            ofs += 7
+
+        append(value)
+
+    return result
+
+def _decode_varints_buf(buf : memoryview, pos : int, count : int) -> tuple[list[int], int]:
+    end = pos + count
+    if end > len(buf):
+        raise EOF()
+
+    if not _CONTINUATION_RE.search(buf, pos, end):
+        return buf[pos:end].tolist(), end  # all single-byte
+
+    if count >= _NUMPY_MIN_LENGTH:
+        # the varints are somewhere in this window, if they're not too long
+        window = np.frombuffer(buf[pos:pos + count*_NUMPY_MAX_BYTES], dtype=np.uint8)
+        ends = np.flatnonzero(window < 0x80)
+        if len(ends) >= count:
+            size = int(ends[count-1]) + 1
+            xs = _decode_varints_numpy(window[:size])
+            if xs is not None:
+                return xs, pos + size
+
+    # like _decode_varint_octets() but it stops after `count` varints
+    result : list[int] = []
+    append = result.append
+    extra = 0  # bytes beyond the first one of each varint
+    it = iter(buf[pos:])
+    for octet, _ in zip(it, range(count)):
+        if octet < 0x80:
+            append(octet)
+            continue
+
+        value = octet & 0x7F
+        ofs = 7
+        for octet in it:
+            extra += 1
+            value |= (octet & 0x7F) << ofs
+            if octet < 0x80:
+                break
+            ofs += 7
+        else:
+            raise EOF()
+
+        append(value)
+
+    if len(result) < count:
+        raise EOF()
+
+    return result, end + extra
+
+def _decode_varints_numpy(octets : np.ndarray) -> Optional[list[int]]:
+    ends = np.flatnonzero(octets < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    sizes = ends - starts + 1
+    if sizes.max() > _NUMPY_MAX_BYTES:
+        return None  # would overflow
+
+    shifts = 7 * (np.arange(len(octets)) - np.repeat(starts, sizes))
+    values = (octets & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return cast(list[int], np.bitwise_or.reduceat(values, starts).tolist())
+
+def _intListC() -> Codec[list[int]]:
+    intC_encode, intC_decode = intC.enc_dec()
+    intC_decode_buf = intC.dec_buf()
+
+    def encode(f : FileOut, xs : list[int]) -> None:
+        intC_encode(f, len(xs))
+        if xs:
+            f.write(_encode_varints(xs))
+
+    def decode(f : FileIn) -> list[int]:
+        count = intC_decode(f)
+        return _decode_varints(_read_varints(f, count), count)
+
+    def decode_buf(buf : memoryview, pos : int) -> tuple[list[int], int]:
+        count, pos = intC_decode_buf(buf, pos)
+        return _decode_varints_buf(buf, pos, count)
+
+    return Codec(encode, decode, decode_buf, spec=('intlist',))
+
+intListC = _intListC()
+
 def _floatC() -> Codec[float]:
-    pack, unpack = struct.pack, struct.unpack
+    pack, unpack, unpack_from = struct.pack, struct.unpack, struct.unpack_from
 
     def encode(f : FileOut, x : float) -> None:
         f.write(pack('f', x))
@@ -108,12 +339,17 @@ def _floatC() -> Codec[float]:
     def decode(f : FileIn) -> float:
         return cast(float, unpack('f', f.read(4))[0])
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[float, int]:
+        if pos + 4 > len(buf):
+            raise EOF()
+        return cast(float, unpack_from('f', buf, pos)[0]), pos + 4
+
+    return Codec(encode, decode, decode_buf, spec=('float',))
 
 floatC = _floatC()
 
 def _doubleC() -> Codec[float]:
-    pack, unpack = struct.pack, struct.unpack
+    pack, unpack, unpack_from = struct.pack, struct.unpack, struct.unpack_from
 
     def encode(f : FileOut, x : float) -> None:
         f.write(pack('d', x))
@@ -121,12 +357,18 @@ def _doubleC() -> Codec[float]:
     def decode(f : FileIn) -> float:
         return cast(float, unpack('d', f.read(8))[0])
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[float, int]:
+        if pos + 8 > len(buf):
+            raise EOF()
+        return cast(float, unpack_from('d', buf, pos)[0]), pos + 8
+
+    return Codec(encode, decode, decode_buf, spec=('double',))
 
 doubleC = _doubleC()
 
 def _bytesC() -> Codec[bytes]:
     intC_encode, intC_decode = intC.enc_dec()
+    intC_decode_buf = intC.dec_buf()
 
     def encode(f : FileOut, x : bytes) -> None:
         intC_encode(f, len(x))
@@ -136,12 +378,20 @@ def _bytesC() -> Codec[bytes]:
         length = intC_decode(f)
         return f.read(length)
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[bytes, int]:
+        length, pos = intC_decode_buf(buf, pos)
+        end = pos + length
+        if end > len(buf):
+            raise EOF()
+        return bytes(buf[pos:end]), end
+
+    return Codec(encode, decode, decode_buf, spec=('bytes',))
 
 bytesC = _bytesC()
 
 def _strC() -> Codec[str]:
     bytesC_encode, bytesC_decode = bytesC.enc_dec()
+    intC_decode_buf = intC.dec_buf()
 
     def encode(f : FileOut, x : str) -> None:
         bytesC_encode(f, x.encode('utf8'))
@@ -149,13 +399,21 @@ def _strC() -> Codec[str]:
     def decode(f : FileIn) -> str:
         return bytesC_decode(f).decode('utf8')
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[str, int]:
+        length, pos = intC_decode_buf(buf, pos)
+        end = pos + length
+        if end > len(buf):
+            raise EOF()
+        return str(buf[pos:end], 'utf8'), end
+
+    return Codec(encode, decode, decode_buf, spec=('str',))
 
 strC = _strC()
 
 def tupleC(*codecs : Codec) -> Codec[tuple]:
     encodes = [c.encode for c in codecs]
     decodes = [c.decode for c in codecs]
+    decode_bufs = [c.dec_buf() for c in codecs]
 
     def encode(f : FileOut, xs : tuple) -> None:
         if len(encodes) != len(xs):
@@ -167,13 +425,21 @@ def tupleC(*codecs : Codec) -> Codec[tuple]:
     def decode(f : FileIn) -> tuple:
         return tuple(decode(f) for decode in decodes)
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[tuple, int]:
+        values = []
+        for decode_buf in decode_bufs:
+            value, pos = decode_buf(buf, pos)
+            values.append(value)
+        return tuple(values), pos
+
+    return Codec(encode, decode, decode_buf, spec=('tuple', codecs))
 
 NT = TypeVar('NT', bound=NamedTuple)
 
 def namedtupleC(cls : type[NT], *codecs : Codec) -> Codec[NT]:
     encodes = [c.encode for c in codecs]
     decodes = [c.decode for c in codecs]
+    decode_bufs = [c.dec_buf() for c in codecs]
 
     if len(codecs) != len(cls._fields):
         raise CodecError('namedtupleC: %d codecs provided for tuple %s' % (
@@ -191,7 +457,14 @@ def namedtupleC(cls : type[NT], *codecs : Codec) -> Codec[NT]:
     def decode(f : FileIn) -> NT:
         return cls(*[decode(f) for decode in decodes])
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[NT, int]:
+        values = []
+        for decode_buf in decode_bufs:
+            value, pos = decode_buf(buf, pos)
+            values.append(value)
+        return cls(*values), pos
+
+    return Codec(encode, decode, decode_buf, spec=('namedtuple', cls, codecs))
 
 
 # there are a couple of type: ignore comments here
@@ -205,6 +478,7 @@ DC = TypeVar('DC')
 def dataclassC(cls : type[DC], *codecs : Codec) -> Codec[DC]:
     encodes = [c.encode for c in codecs]
     decodes = [c.decode for c in codecs]
+    decode_bufs = [c.dec_buf() for c in codecs]
 
     if len(codecs) != len(dataclasses.fields(cls)):  # type: ignore
         raise CodecError('dataclassC: %d codecs provided for dataclass %s' % (
@@ -223,11 +497,23 @@ def dataclassC(cls : type[DC], *codecs : Codec) -> Codec[DC]:
     def decode(f : FileIn) -> DC:
         return cast(DC, cls(*[decode(f) for decode in decodes]))  # type: ignore
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[DC, int]:
+        values = []
+        for decode_buf in decode_bufs:
+            value, pos = decode_buf(buf, pos)
+            values.append(value)
+        return cast(DC, cls(*values)), pos  # type: ignore
+
+    return Codec(encode, decode, decode_buf, spec=('dataclass', cls, codecs))
 
 def listC(codec : Codec[E]) -> Codec[list[E]]:
+    if codec is intC:
+        return cast(Codec[list[E]], intListC)  # bulk fast path
+
     codec_encode, codec_decode = codec.enc_dec()
+    codec_decode_buf = codec.dec_buf()
     intC_encode, intC_decode = intC.enc_dec()
+    intC_decode_buf = intC.dec_buf()
 
     def encode(f : FileOut, xs : list[E]) -> None:
         intC_encode(f, len(xs))
@@ -238,10 +524,20 @@ def listC(codec : Codec[E]) -> Codec[list[E]]:
         length = intC_decode(f)
         return [codec_decode(f) for _ in range(length)]
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[list[E], int]:
+        length, pos = intC_decode_buf(buf, pos)
+        result = []
+        for _ in range(length):
+            item, pos = codec_decode_buf(buf, pos)
+            result.append(item)
+        return result, pos
+
+    return Codec(encode, decode, decode_buf, spec=('list', codec))
 
 def dictC(k : Codec[K], v : Codec[V]) -> Codec[dict[K,V]]:
-    _encode, _decode = listC(tupleC(k, v)).enc_dec()
+    items = listC(tupleC(k, v))
+    _encode, _decode = items.enc_dec()
+    _decode_buf = items.dec_buf()
 
     def encode(f : FileOut, x : dict[K,V]) -> None:
         _encode(f, cast(list[tuple], x.items()))
@@ -249,27 +545,44 @@ def dictC(k : Codec[K], v : Codec[V]) -> Codec[dict[K,V]]:
     def decode(f : FileIn) -> dict[K,V]:
         return dict(cast(list[tuple[K,V]], _decode(f)))
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[dict[K,V], int]:
+        xs, pos = _decode_buf(buf, pos)
+        return dict(cast(list[tuple[K,V]], xs)), pos
+
+    return Codec(encode, decode, decode_buf)
 
 def setC(codec : Codec[E]) -> Codec[set[E]]:
-    _encode, _decode = listC(codec).enc_dec()
+    items = listC(codec)
+    _encode, _decode = items.enc_dec()
+    _decode_buf = items.dec_buf()
 
     def decode(f : FileIn) -> set[E]:
         return set(_decode(f))
 
-    return Codec(_encode, decode)  # type: ignore
+    def decode_buf(buf : memoryview, pos : int) -> tuple[set[E], int]:
+        xs, pos = _decode_buf(buf, pos)
+        return set(xs), pos
+
+    return Codec(_encode, decode, decode_buf, spec=('set', codec))  # type: ignore
 
 def frozensetC(codec : Codec[E]) -> Codec[frozenset[E]]:
-    _encode, _decode = listC(codec).enc_dec()
+    items = listC(codec)
+    _encode, _decode = items.enc_dec()
+    _decode_buf = items.dec_buf()
 
     def decode(f : FileIn) -> frozenset[E]:
         return frozenset(_decode(f))
 
-    return Codec(_encode, decode)  # type: ignore
+    def decode_buf(buf : memoryview, pos : int) -> tuple[frozenset[E], int]:
+        xs, pos = _decode_buf(buf, pos)
+        return frozenset(xs), pos
+
+    return Codec(_encode, decode, decode_buf, spec=('frozenset', codec))  # type: ignore
 
 EnumTy = TypeVar('EnumTy', bound=Enum)
 def pyEnumC(cls : type[EnumTy], valC : Codec) -> Codec[EnumTy]:
     _encode, _decode = valC.enc_dec()
+    _decode_buf = valC.dec_buf()
 
     def encode(f : FileOut, x : EnumTy) -> None:
         _encode(f, x.value)
@@ -277,7 +590,11 @@ def pyEnumC(cls : type[EnumTy], valC : Codec) -> Codec[EnumTy]:
     def decode(f : FileIn) -> EnumTy:
         return cls(Enum(_decode(f)))
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[EnumTy, int]:
+        value, pos = _decode_buf(buf, pos)
+        return cls(Enum(value)), pos
+
+    return Codec(encode, decode, decode_buf)
 
 def enumC(name : str, alts : Dict[type, Tuple[Codec, ...]]) -> Codec:
     codecs_enc_get = {
@@ -290,7 +607,13 @@ def enumC(name : str, alts : Dict[type, Tuple[Codec, ...]]) -> Codec:
         for ty, codecs in alts.items()
     }.get
 
+    codecs_dec_buf_get = {
+        ty._field_defaults['tag']: (ty, tupleC(*codecs).dec_buf())  # type: ignore
+        for ty, codecs in alts.items()
+    }.get
+
     intC_encode, intC_decode = intC.enc_dec()
+    intC_decode_buf = intC.dec_buf()
 
     def encode(f : FileOut, x : tuple) -> None:
         *values, tag = x
@@ -309,7 +632,20 @@ def enumC(name : str, alts : Dict[type, Tuple[Codec, ...]]) -> Codec:
 
         return ty(*dec(f), tag)
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[Any, int]:
+        tag, pos = intC_decode_buf(buf, pos)
+        ty, dec = codecs_dec_buf_get(tag, (None, None))
+        if ty is None or dec is None:
+            raise CodecError(f'cannot decode enum tag: {name}/{tag}')
+
+        values, pos = dec(buf, pos)
+        return ty(*values, tag), pos
+
+    spec = ('enum', name, [
+        (ty._field_defaults['tag'], ty, codecs)  # type: ignore
+        for ty, codecs in alts.items()
+    ])
+    return Codec(encode, decode, decode_buf, spec=spec)
 
 def enum_by_typenameC(name : str, alts : Sequence[Tuple[type, Codec]]) -> Codec:
     codecs_enc_get = {
@@ -322,7 +658,13 @@ def enum_by_typenameC(name : str, alts : Sequence[Tuple[type, Codec]]) -> Codec:
         for ty, codec in alts
     }.get
 
+    codecs_dec_buf_get = {
+        ty.__name__: codec.dec_buf()
+        for ty, codec in alts
+    }.get
+
     strC_encode, strC_decode = strC.enc_dec()
+    strC_decode_buf = strC.dec_buf()
 
     def encode(f : FileOut, x : tuple) -> None:
         ty = type(x).__name__
@@ -341,7 +683,15 @@ def enum_by_typenameC(name : str, alts : Sequence[Tuple[type, Codec]]) -> Codec:
 
         return dec(f)
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[Any, int]:
+        ty, pos = strC_decode_buf(buf, pos)
+        dec = codecs_dec_buf_get(ty)
+        if dec is None:
+            raise CodecError(f'cannot decode enum class: {name}/{ty}')
+
+        return dec(buf, pos)
+
+    return Codec(encode, decode, decode_buf)
 
 def _noneC() -> Codec[None]:
     def encode(_f : FileOut, _x : None) -> None:
@@ -350,12 +700,16 @@ def _noneC() -> Codec[None]:
     def decode(_f : FileIn) -> None:
         return None
 
-    return Codec(encode, decode)
+    def decode_buf(_buf : memoryview, pos : int) -> tuple[None, int]:
+        return None, pos
+
+    return Codec(encode, decode, decode_buf, spec=('none',))
 
 noneC = _noneC()
 
 def _boolC() -> Codec[bool]:
     intC_encode, intC_decode = intC.enc_dec()
+    intC_decode_buf = intC.dec_buf()
 
     def encode(f : FileOut, x : bool) -> None:
         intC_encode(f, int(x))
@@ -369,13 +723,24 @@ def _boolC() -> Codec[bool]:
         else:
             raise CodecError('invalid bool code: %s' % tag)
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[bool, int]:
+        tag, pos = intC_decode_buf(buf, pos)
+        if tag == 0:
+            return False, pos
+        elif tag == 1:
+            return True, pos
+        else:
+            raise CodecError('invalid bool code: %s' % tag)
+
+    return Codec(encode, decode, decode_buf, spec=('bool',))
 
 boolC = _boolC()
 
 def maybe(codec : Codec[E]) -> Codec[Optional[E]]:
     enc, dec = codec.enc_dec()
+    dec_buf = codec.dec_buf()
     boolC_encode, boolC_decode = boolC.enc_dec()
+    boolC_decode_buf = boolC.dec_buf()
 
     def encode(f : FileOut, x : Optional[Any]) -> None:
         if x is None:
@@ -390,10 +755,18 @@ def maybe(codec : Codec[E]) -> Codec[Optional[E]]:
         else:
             return None
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[Optional[Any], int]:
+        present, pos = boolC_decode_buf(buf, pos)
+        if present:
+            return dec_buf(buf, pos)
+        else:
+            return None, pos
+
+    return Codec(encode, decode, decode_buf, spec=('maybe', codec))
 
 def newtypeC(codec : Codec[E], ctor : Callable[[E], F], proj : Callable[[F], E]) -> Codec[F]:
     enc, dec = codec.enc_dec()
+    dec_buf = codec.dec_buf()
 
     def encode(f : FileOut, x : F) -> None:
         enc(f, proj(x))
@@ -401,11 +774,17 @@ def newtypeC(codec : Codec[E], ctor : Callable[[E], F], proj : Callable[[F], E])
     def decode(f : FileIn) -> F:
         return ctor(dec(f))
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[F, int]:
+        value, pos = dec_buf(buf, pos)
+        return ctor(value), pos
+
+    return Codec(encode, decode, decode_buf)
 
 def numpyC(dtype : type) -> Codec[np.ndarray]:
     bytesC_enc, bytesC_dec = bytesC.enc_dec()
     l_enc, l_dec = listC(intC).enc_dec()
+    l_dec_buf = listC(intC).dec_buf()
+    intC_dec_buf = intC.dec_buf()
 
     def encode(f : FileOut, x : np.ndarray) -> None:
         assert x.dtype == dtype, f"expected array type: {dtype}, received: {x.dtype}"
@@ -415,15 +794,27 @@ def numpyC(dtype : type) -> Codec[np.ndarray]:
     def decode(f : FileIn) -> np.ndarray:
         shape = tuple(l_dec(f))
         stuff = bytesC_dec(f)
-        return np.reshape(
-            np.fromstring(stuff, dtype=dtype),  # type:ignore
-            newshape=shape,
-        )
 
-    return Codec(encode, decode)
+        # copy so that the array is writable
+        result : np.ndarray = np.frombuffer(stuff, dtype=dtype).copy()
+        return result.reshape(shape)
+
+    def decode_buf(buf : memoryview, pos : int) -> tuple[np.ndarray, int]:
+        shape, pos = l_dec_buf(buf, pos)
+        length, pos = intC_dec_buf(buf, pos)
+        end = pos + length
+        if end > len(buf):
+            raise EOF()
+
+        # copy so that the array does not keep the buffer alive
+        stuff : np.ndarray = np.frombuffer(buf[pos:end], dtype=dtype).copy()
+        return stuff.reshape(tuple(shape)), end
+
+    return Codec(encode, decode, decode_buf)
 
 def _fractionC() -> Codec[Fraction]:
     intC_enc, intC_dec = intC.enc_dec()
+    intC_dec_buf = intC.dec_buf()
 
     def encode(f : FileOut, x : Fraction) -> None:
         intC_enc(f, x.numerator)
@@ -435,6 +826,11 @@ def _fractionC() -> Codec[Fraction]:
             denominator=intC_dec(f),
         )
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[Fraction, int]:
+        numerator, pos = intC_dec_buf(buf, pos)
+        denominator, pos = intC_dec_buf(buf, pos)
+        return Fraction(numerator=numerator, denominator=denominator), pos
+
+    return Codec(encode, decode, decode_buf, spec=('fraction',))
 
 fractionC = _fractionC()
@@ -0,0 +1,355 @@
+# Codec compiler.
+#
+# Composite codecs built from namedtupleC, listC, maybe etc. are chains
+# of closures, with a call, a zip and a tuple per field. For the codecs
+# we decode a lot (subjects), we instead generate flat Python source
+# for encode/decode/decode_buf once, at import time, using the structure
+# recorded in Codec.spec. Varint loops are inlined and there's no
+# dispatch per field. Codecs without a spec are called as they are.
+#
+# The result is an ordinary Codec with the same wire format.
+
+import struct
+import logging
+import dataclasses
+from fractions import Fraction
+from typing import Any, Optional, TypeVar
+
+from util.codec import Codec, CodecError, EOF, \
+    _encode_varints, _read_varints, _decode_varints, _decode_varints_buf
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class _Source:
+    def __init__(self) -> None:
+        self.lines : list[str] = []
+        self.counter = 0
+        self.env : dict[str, Any] = {
+            'CodecError': CodecError,
+            'EOF': EOF,
+            'Fraction': Fraction,
+            'encode_varints': _encode_varints,
+            'read_varints': _read_varints,
+            'decode_varints': _decode_varints,
+            'decode_varints_buf': _decode_varints_buf,
+        }
+
+    def fresh(self, prefix : str = 'v') -> str:
+        self.counter += 1
+        return '%s%d' % (prefix, self.counter)
+
+    def const(self, value : Any) -> str:
+        name = self.fresh('k')
+        self.env[name] = value
+        return name
+
+    def line(self, depth : int, text : str) -> None:
+        self.lines.append('    ' * depth + text)
+
+    def compile(self, name : str) -> Any:
+        source = '\n'.join(self.lines) + '\n'
+        log.debug('compiled codec:\n%s', source)
+        exec(compile(source, '<codec %s>' % name, 'exec'), self.env)
+        return self.env[name]
+
+def _spec(codec : Codec) -> Optional[tuple]:
+    spec = codec.spec
+    if spec is not None and spec[0] == 'compiled':
+        return _spec(spec[1])
+    return spec
+
+def _is_int(codec : Codec) -> bool:
+    spec = _spec(codec)
+    return spec is not None and spec[0] == 'int'
+
+_STRUCTS = {'float': struct.Struct('f'), 'double': struct.Struct('d')}
+
+# -- encoding: everything is appended to `out`, written to the file at the end
+
+def _encode_int(src : _Source, x : str, d : int) -> None:
+    src.line(d, f'if 0 <= {x} < 0x80:')
+    src.line(d+1, f'out.append({x})')
+    src.line(d, f'elif {x} < 0:')
+    src.line(d+1, f"raise CodecError('invalid int: %s' % {x})")
+    src.line(d, 'else:')
+    src.line(d+1, f'rest = {x}')
+    src.line(d+1, 'while rest >= 0x80:')
+    src.line(d+2, 'out.append(0x80 | (rest & 0x7F))')
+    src.line(d+2, 'rest >>= 7')
+    src.line(d+1, 'out.append(rest)')
+
+def _encode_fields(src : _Source, codecs : tuple[Codec, ...], x : str, d : int) -> None:
+    src.line(d, f'if len({x}) != {len(codecs)}:')
+    src.line(d+1, "raise CodecError('tuple length mismatch')")
+
+    names = [src.fresh() for _ in codecs]
+    if names:
+        src.line(d, f'{", ".join(names)}, = {x}')
+    for codec, name in zip(codecs, names):
+        _encode(src, codec, name, d)
+
+def _encode(src : _Source, codec : Codec, x : str, d : int) -> None:
+    spec = _spec(codec)
+    kind = spec[0] if spec else None
+
+    if kind == 'int':
+        _encode_int(src, x, d)
+
+    elif kind == 'intlist' or (kind in ('list', 'set', 'frozenset') and _is_int(spec[1])):  # type: ignore
+        n = src.fresh()
+        src.line(d, f'{n} = len({x})')
+        _encode_int(src, n, d)
+        src.line(d, f'if {n}:')
+        src.line(d+1, f'out += encode_varints({x})')
+
+    elif kind in ('float', 'double'):
+        src.line(d, f'out += {src.const(_STRUCTS[kind].pack)}({x})')
+
+    elif kind in ('bytes', 'str'):
+        bs = src.fresh()
+        if kind == 'str':
+            src.line(d, f"{bs} = {x}.encode('utf8')")
+        else:
+            bs = x
+        n = src.fresh()
+        src.line(d, f'{n} = len({bs})')
+        _encode_int(src, n, d)
+        src.line(d, f'out += {bs}')
+
+    elif kind in ('tuple', 'namedtuple'):
+        _encode_fields(src, spec[-1], x, d)  # type: ignore
+
+    elif kind == 'dataclass':
+        # read the fields directly rather than via dataclasses.astuple(),
+        # which deep-copies the whole value
+        for field, field_codec in zip(dataclasses.fields(spec[1]), spec[2]):  # type: ignore
+            value = src.fresh()
+            src.line(d, f'{value} = {x}.{field.name}')
+            _encode(src, field_codec, value, d)
+
+    elif kind in ('list', 'set', 'frozenset'):
+        n, item = src.fresh(), src.fresh()
+        src.line(d, f'{n} = len({x})')
+        _encode_int(src, n, d)
+        src.line(d, f'for {item} in {x}:')
+        _encode(src, spec[1], item, d+1)  # type: ignore
+
+    elif kind == 'none':
+        src.line(d, 'pass')
+
+    elif kind == 'bool':
+        src.line(d, f'out.append(1 if {x} else 0)')
+
+    elif kind == 'maybe':
+        src.line(d, f'if {x} is None:')
+        src.line(d+1, 'out.append(0)')
+        src.line(d, 'else:')
+        src.line(d+1, 'out.append(1)')
+        _encode(src, spec[1], x, d+1)  # type: ignore
+
+    elif kind == 'fraction':
+        num, den = src.fresh(), src.fresh()
+        src.line(d, f'{num} = {x}.numerator')
+        src.line(d, f'{den} = {x}.denominator')
+        _encode_int(src, num, d)
+        _encode_int(src, den, d)
+
+    elif kind == 'enum':
+        _, name, alts = spec  # type: ignore
+        tag, values = src.fresh(), src.fresh()
+        src.line(d, f'{tag} = {x}[-1]')
+        for i, (alt_tag, _ty, codecs) in enumerate(alts):
+            src.line(d, f'{"if" if i == 0 else "elif"} {tag} == {alt_tag!r}:')
+            _encode_int(src, tag, d+1)
+            src.line(d+1, f'{values} = {x}[:-1]')
+            _encode_fields(src, codecs, values, d+1)
+        src.line(d, 'else:')
+        src.line(d+1, f"raise CodecError('cannot encode enum tag: %s/%s' % ({name!r}, {tag}))")
+
+    else:
+        src.line(d, f'out += {src.const(codec.encode_to_memory)}({x})')
+
+# -- decoding: the same generator serves both files and buffers,
+# only the primitive reads differ
+
+class _Decoder:
+    buffered : bool
+
+    def __init__(self, src : _Source) -> None:
+        self.src = src
+
+    def varint(self, target : str, d : int) -> None:
+        src = self.src
+        src.line(d, f'{target} = {self.octet()}')
+        self.advance(d, 1)
+        src.line(d, f'if {target} >= 0x80:')
+        src.line(d+1, f'{target} &= 0x7F')
+        src.line(d+1, 'ofs = 7')
+        src.line(d+1, 'while True:')
+        src.line(d+2, f'octet = {self.octet()}')
+        self.advance(d+2, 1)
+        src.line(d+2, f'{target} |= (octet & 0x7F) << ofs')
+        src.line(d+2, 'if octet < 0x80:')
+        src.line(d+3, 'break')
+        src.line(d+2, 'ofs += 7')
+
+    def octet(self) -> str:
+        return 'buf[pos]' if self.buffered else 'f_read(1)[0]'
+
+    def advance(self, d : int, size : int) -> None:
+        if self.buffered:
+            self.src.line(d, f'pos += {size}')
+
+    def take(self, target : str, size : str, d : int, wrap : str) -> None:
+        # target = wrap(next `size` bytes)
+        src = self.src
+        if self.buffered:
+            end = src.fresh()
+            src.line(d, f'{end} = pos + {size}')
+            src.line(d, f'if {end} > len(buf):')
+            src.line(d+1, 'raise EOF()')
+            src.line(d, f'{target} = {wrap % f"buf[pos:{end}]"}')
+            src.line(d, f'pos = {end}')
+        else:
+            src.line(d, f'{target} = {wrap % f"f_read({size})"}')
+
+    def fields(self, codecs : tuple[Codec, ...], d : int) -> list[str]:
+        names = [self.src.fresh() for _ in codecs]
+        for codec, name in zip(codecs, names):
+            self.decode(codec, name, d)
+        return names
+
+    def decode(self, codec : Codec, target : str, d : int) -> None:
+        src = self.src
+        spec = _spec(codec)
+        kind = spec[0] if spec else None
+
+        if kind == 'int':
+            self.varint(target, d)
+
+        elif kind == 'intlist' or (kind in ('list', 'set', 'frozenset') and _is_int(spec[1])):  # type: ignore
+            n = src.fresh()
+            self.varint(n, d)
+            if self.buffered:
+                src.line(d, f'{target}, pos = decode_varints_buf(buf, pos, {n})')
+            else:
+                src.line(d, f'{target} = decode_varints(read_varints(f, {n}), {n})')
+            if kind in ('set', 'frozenset'):
+                src.line(d, f'{target} = {kind}({target})')
+
+        elif kind in ('float', 'double'):
+            st = _STRUCTS[kind]
+            if self.buffered:
+                src.line(d, f'if pos + {st.size} > len(buf):')
+                src.line(d+1, 'raise EOF()')
+                src.line(d, f'{target} = {src.const(st.unpack_from)}(buf, pos)[0]')
+                src.line(d, f'pos += {st.size}')
+            else:
+                src.line(d, f'{target} = {src.const(st.unpack)}(f_read({st.size}))[0]')
+
+        elif kind == 'bytes':
+            n = src.fresh()
+            self.varint(n, d)
+            self.take(target, n, d, 'bytes(%s)' if self.buffered else '%s')
+
+        elif kind == 'str':
+            n = src.fresh()
+            self.varint(n, d)
+            self.take(target, n, d, "str(%s, 'utf8')" if self.buffered else "%s.decode('utf8')")
+
+        elif kind == 'tuple':
+            names = self.fields(spec[1], d)  # type: ignore
+            src.line(d, f'{target} = ({"".join(name + ", " for name in names)})')
+
+        elif kind in ('namedtuple', 'dataclass'):
+            names = self.fields(spec[2], d)  # type: ignore
+            src.line(d, f'{target} = {src.const(spec[1])}({", ".join(names)})')  # type: ignore
+
+        elif kind in ('list', 'set', 'frozenset'):
+            n, item = src.fresh(), src.fresh()
+            self.varint(n, d)
+            src.line(d, f'{target} = []')
+            src.line(d, f'for _ in range({n}):')
+            self.decode(spec[1], item, d+1)  # type: ignore
+            src.line(d+1, f'{target}.append({item})')
+            if kind != 'list':
+                src.line(d, f'{target} = {kind}({target})')
+
+        elif kind == 'none':
+            src.line(d, f'{target} = None')
+
+        elif kind in ('bool', 'maybe'):
+            flag = src.fresh()
+            self.varint(flag, d)
+            src.line(d, f'if {flag} == 1:')
+            if kind == 'bool':
+                src.line(d+1, f'{target} = True')
+            else:
+                self.decode(spec[1], target, d+1)  # type: ignore
+            src.line(d, f'elif {flag} == 0:')
+            src.line(d+1, f'{target} = {"False" if kind == "bool" else "None"}')
+            src.line(d, 'else:')
+            src.line(d+1, f"raise CodecError('invalid bool code: %s' % {flag})")
+
+        elif kind == 'fraction':
+            num, den = src.fresh(), src.fresh()
+            self.varint(num, d)
+            self.varint(den, d)
+            src.line(d, f'{target} = Fraction(numerator={num}, denominator={den})')
+
+        elif kind == 'enum':
+            _, name, alts = spec  # type: ignore
+            tag = src.fresh()
+            self.varint(tag, d)
+            for i, (alt_tag, ty, codecs) in enumerate(alts):
+                src.line(d, f'{"if" if i == 0 else "elif"} {tag} == {alt_tag!r}:')
+                names = self.fields(codecs, d+1)
+                src.line(d+1, f'{target} = {src.const(ty)}({"".join(name + ", " for name in names)}{tag})')
+            src.line(d, 'else:')
+            src.line(d+1, f"raise CodecError('cannot decode enum tag: %s/%s' % ({name!r}, {tag}))")
+
+        elif self.buffered:
+            src.line(d, f'{target}, pos = {src.const(codec.dec_buf())}(buf, pos)')
+
+        else:
+            src.line(d, f'{target} = {src.const(codec.decode)}(f)')
+
+class _FileDecoder(_Decoder):
+    buffered = False
+
+class _BufDecoder(_Decoder):
+    buffered = True
+
+def compiled(codec : Codec[T]) -> Codec[T]:
+    if codec.spec is None:
+        return codec  # nothing to compile
+
+    src = _Source()
+    src.line(0, 'def encode(f, x):')
+    src.line(1, 'out = bytearray()')
+    _encode(src, codec, 'x', 1)
+    src.line(1, 'f.write(out)')
+    encode = src.compile('encode')
+
+    src = _Source()
+    src.line(0, 'def decode(f):')
+    src.line(1, 'f_read = f.read')
+    src.line(1, 'try:')
+    _FileDecoder(src).decode(codec, 'result', 2)
+    src.line(1, 'except IndexError:')
+    src.line(2, 'raise EOF()')
+    src.line(1, 'return result')
+    decode = src.compile('decode')
+
+    src = _Source()
+    src.line(0, 'def decode_buf(buf, pos):')
+    src.line(1, 'try:')
+    _BufDecoder(src).decode(codec, 'result', 2)
+    src.line(1, 'except IndexError:')
+    src.line(2, 'raise EOF()')
+    src.line(1, 'return result, pos')
+    decode_buf = src.compile('decode_buf')
+
+    return Codec(encode, decode, decode_buf, spec=('compiled', codec))
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
-from typing import Callable, Sequence, TypeVar, Generic, Any
+from typing import Callable, Sequence, TypeVar, Generic, Any, cast
 from gui.progress import Worker
 from util.codec import Codec, FileIn, FileOut, intC, strC, CodecError
+from util.packed_list import SpillingBlocks, views
 
 T = TypeVar('T')
+B = TypeVar('B', bound=bytes)
 
 @dataclass
 class CodecProgress(Generic[T]):
@@ -58,6 +60,32 @@ def listCP(codec : CodecProgress[T]) -> CodecProgress[list[T]]:
 
     return CodecProgress(get_size, encode, decode)
 
+def spillingListCP(codec : Codec[B]) -> CodecProgress[Sequence[B]]:
+    # like listCP(oneCP(codec)) for packed items
+    # but large lists go to a memory-mapped file instead of the heap
+    enc, dec = codec.enc_dec()
+    intC_enc, intC_dec = intC.enc_dec()
+
+    def get_size(xs : Sequence[B]) -> int:
+        return len(xs)
+
+    def encode(worker : Worker, f : FileOut, xs : Sequence[B]) -> None:
+        intC_enc(f, len(xs))
+        for x in views(xs):
+            enc(f, cast(B, x))  # memoryviews encode like bytes
+            worker.step()
+
+    def decode(worker : Worker, f : FileIn) -> Sequence[B]:
+        length = intC_dec(f)
+        result : SpillingBlocks[B] = SpillingBlocks()
+        for _ in range(length):
+            result.append(dec(f))
+            worker.step()
+
+        return result.blocks
+
+    return CodecProgress(get_size, encode, decode)
+
 def enum_by_typenameCP(name : str, alts : Sequence[tuple[type, CodecProgress]]) -> CodecProgress:
     codecs_sz_get = {
         ty.__name__: codec.get_size
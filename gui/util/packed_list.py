@@ -1,7 +1,175 @@
-from typing import Iterable, TypeVar, Generic, Iterator, Callable, overload, Union
+import os
+import mmap
+import tempfile
+from array import array
+from typing import Iterable, TypeVar, Generic, Iterator, Callable, overload, Union, \
+    Optional, Sequence, cast
+
+import platform_specific
 from util.codec import Codec, FileIn, FileOut, listC, bytesC
 
 T = TypeVar('T')
+B = TypeVar('B', bound=bytes)
+
+# packed lists taking more bytes than this go to MappedBlocks
+SPILL_THRESHOLD = 256 * 1024 * 1024
+
+class MappedBlocks(Sequence[B]):
+    # An append-only sequence of byte blocks stored back to back in one temporary
+    # segment file, which is memory-mapped for reading. The blocks live in the page
+    # cache rather than on the Python heap so they can take more than the RAM.
+    #
+    # Indexing returns a copy of the block; view() and views() are the zero-copy alternatives.
+
+    def __init__(self, blocks : Iterable[B] = (), dirname : Optional[str] = None) -> None:
+        self.f = tempfile.TemporaryFile(dir=dirname)
+        self.offsets = array('Q', [0])  # block i is at offsets[i] .. offsets[i+1]
+
+        # remapped when the file grows; the old mapping lives on
+        # as long as there are views into it
+        self.mapping : Optional[mmap.mmap] = None
+
+        self.extend(blocks)
+
+    def append(self, block : Union[B, memoryview]) -> None:
+        self.f.write(block)
+        self.offsets.append(self.offsets[-1] + len(block))
+
+    def extend(self, blocks : Iterable[Union[B, memoryview]]) -> None:
+        for block in blocks:
+            self.append(block)
+
+    def view(self, idx : int) -> memoryview:
+        idx = range(len(self))[idx]  # negative indices, IndexError
+        lo, hi = self.offsets[idx], self.offsets[idx+1]
+        if lo == hi:
+            return memoryview(b'')  # can't map empty files
+
+        if self.mapping is None or len(self.mapping) < hi:
+            self.f.flush()
+            self.mapping = mmap.mmap(self.f.fileno(), self.offsets[-1], access=mmap.ACCESS_READ)
+
+        return memoryview(self.mapping)[lo:hi]
+
+    def views(self) -> 'MappedViews':
+        return MappedViews(self)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @overload
+    def __getitem__(self, idx : int) -> B:
+        pass
+
+    @overload
+    def __getitem__(self, idx : slice) -> list[B]:
+        pass
+
+    def __getitem__(self, idx : Union[int, slice]) -> Union[B, list[B]]:
+        if isinstance(idx, int):
+            return cast(B, self.view(idx).tobytes())
+        else:
+            return [cast(B, self.view(i).tobytes()) for i in range(len(self))[idx]]
+
+    def __iter__(self) -> Iterator[B]:
+        for view in self.views():
+            yield cast(B, view.tobytes())
+
+    def close(self) -> None:
+        self.mapping = None
+        self.f.close()
+
+class MappedViews(Sequence[memoryview]):
+    # the blocks of MappedBlocks as zero-copy memoryviews
+
+    def __init__(self, blocks : MappedBlocks) -> None:
+        self.blocks = blocks
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    @overload
+    def __getitem__(self, idx : int) -> memoryview:
+        pass
+
+    @overload
+    def __getitem__(self, idx : slice) -> list[memoryview]:
+        pass
+
+    def __getitem__(self, idx : Union[int, slice]) -> Union[memoryview, list[memoryview]]:
+        if isinstance(idx, int):
+            return self.blocks.view(idx)
+        else:
+            return [self.blocks.view(i) for i in range(len(self))[idx]]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        return map(self.blocks.view, range(len(self)))
+
+def views(blocks : Sequence[B]) -> Sequence[Union[B, memoryview]]:
+    # for reading blocks that may have been spilled, without copying them
+    if isinstance(blocks, MappedBlocks):
+        return blocks.views()
+    else:
+        return blocks
+
+class Selection(Sequence[T]):
+    # the items at the given indices, without copying them
+
+    def __init__(self, items : Sequence[T], indices : Sequence[int]) -> None:
+        self.items = items
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    @overload
+    def __getitem__(self, idx : int) -> T:
+        pass
+
+    @overload
+    def __getitem__(self, idx : slice) -> list[T]:
+        pass
+
+    def __getitem__(self, idx : Union[int, slice]) -> Union[T, list[T]]:
+        if isinstance(idx, int):
+            return self.items[self.indices[idx]]
+        else:
+            return [self.items[i] for i in self.indices[idx]]
+
+    def __iter__(self) -> Iterator[T]:
+        return map(self.items.__getitem__, self.indices)
+
+def spill_dir() -> str:
+    # not the default temporary directory, which is often in RAM (tmpfs)
+    dirname = os.path.join(platform_specific.get_user_cache_dir(), 'spill')
+    os.makedirs(dirname, exist_ok=True)
+    return dirname
+
+class SpillingBlocks(Generic[B]):
+    # Collects blocks in a list, which moves into MappedBlocks
+    # once the blocks take more than SPILL_THRESHOLD bytes.
+
+    def __init__(self) -> None:
+        self.blocks : Union[list[B], MappedBlocks[B]] = []
+        self.size = 0
+
+    def append(self, block : B) -> None:
+        self.blocks.append(block)
+        self.size += len(block)
+        if self.size > SPILL_THRESHOLD and isinstance(self.blocks, list):
+            self.blocks = MappedBlocks(self.blocks, spill_dir())
+
+    def extend(self, blocks : Iterable[B]) -> None:
+        for block in blocks:
+            self.append(block)
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+def spilled(blocks : Iterable[B]) -> Sequence[B]:
+    result : SpillingBlocks[B] = SpillingBlocks()
+    result.extend(blocks)
+    return result.blocks
 
 class PackedList(Generic[T]):
     def __init__(self, codec : Codec, elms : Iterable[T] = ()) -> None:
@@ -50,6 +218,7 @@ class PackedList(Generic[T]):
 
 def PackedListC(codec : Codec) -> Codec:
     enc, dec = listC(bytesC).enc_dec()
+    dec_buf = listC(bytesC).dec_buf()
 
     def encode(f : FileOut, xs : PackedList) -> None:
         enc(f, xs.blocks)
@@ -59,4 +228,9 @@ def PackedListC(codec : Codec) -> Codec:
         xs.blocks = dec(f)
         return xs
 
-    return Codec(encode, decode)
+    def decode_buf(buf : memoryview, pos : int) -> tuple[PackedList, int]:
+        xs : PackedList = PackedList(codec)
+        xs.blocks, pos = dec_buf(buf, pos)
+        return xs, pos
+
+    return Codec(encode, decode, decode_buf)
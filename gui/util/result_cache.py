@@ -0,0 +1,191 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Optional, Sequence, Generator, Callable, TypeVar
+
+import platform_specific
+from util.codec import Codec
+from util.packed_list import Selection
+
+log = logging.getLogger(__name__)
+
+S = TypeVar('S', bound=bytes)
+Resp = TypeVar('Resp')
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+# SQLITE_MAX_VARIABLE_NUMBER is 999 in older versions
+QUERY_BATCH_SIZE = 500
+
+# how many new results to collect before writing them
+PUT_BATCH_SIZE = 256
+
+class ResultCache:
+    # Core responses for individual subjects, kept across runs of Prest.
+    #
+    # The key is a hash of the packed subject, the name of the core command
+    # and a fingerprint of its options, salted with the Prest version
+    # so that we never reuse the results of a different core.
+    #
+    # Least recently used results are evicted once the total size
+    # of the stored responses exceeds max_size.
+    #
+    # The cache may be used from several threads.
+
+    def __init__(self, fname : str, salt : str = '', max_size : int = DEFAULT_MAX_SIZE) -> None:
+        self.salt = salt.encode('utf8')
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(fname, check_same_thread=False)
+        try:
+            with self.db:
+                self.db.execute('''
+                    CREATE TABLE IF NOT EXISTS results (
+                        key BLOB PRIMARY KEY,
+                        response BLOB NOT NULL,
+                        size INTEGER NOT NULL,
+                        last_used INTEGER NOT NULL
+                    )
+                ''')
+                self.db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+            clock, size = self.db.execute(
+                'SELECT COALESCE(MAX(last_used), 0), COALESCE(SUM(size), 0) FROM results'
+            ).fetchone()
+        except sqlite3.Error:
+            self.db.close()
+            raise
+
+        # incremented with every use; orders the entries for LRU
+        self.clock : int = clock
+        self.size : int = size
+
+    @staticmethod
+    def open_default(salt : str = '') -> Optional['ResultCache']:
+        # the cache is an optimisation so we can do without it
+        try:
+            dirname = platform_specific.get_user_cache_dir()
+            os.makedirs(dirname, exist_ok=True)
+            return ResultCache(os.path.join(dirname, 'results.sqlite'), salt)
+        except (OSError, sqlite3.Error) as e:
+            log.warning('could not open result cache: %s' % e)
+            return None
+
+    def key(self, name : str, options : bytes, subject : bytes) -> bytes:
+        h = hashlib.sha256()
+        for part in (self.salt, name.encode('utf8'), options):
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        h.update(subject)
+        return h.digest()
+
+    def get_many(self, keys : Sequence[bytes]) -> list[Optional[bytes]]:
+        found : dict[bytes, bytes] = {}
+        with self.lock:
+            for i in range(0, len(keys), QUERY_BATCH_SIZE):
+                batch = keys[i:i+QUERY_BATCH_SIZE]
+                found.update(self.db.execute(
+                    'SELECT key, response FROM results WHERE key IN (%s)' % ','.join('?' * len(batch)),
+                    batch,
+                ))
+
+            if found:
+                self.clock += 1
+                with self.db:
+                    self.db.executemany(
+                        'UPDATE results SET last_used = ? WHERE key = ?',
+                        ((self.clock, key) for key in found),
+                    )
+
+        return [found.get(key) for key in keys]
+
+    def put_many(self, items : Sequence[tuple[bytes, bytes]]) -> None:
+        if not items:
+            return
+
+        with self.lock:
+            self.clock += 1
+            with self.db:
+                for key, response in items:
+                    old = self.db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+                    if old is not None:
+                        self.size -= old[0]
+
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO results (key, response, size, last_used) VALUES (?, ?, ?, ?)',
+                        (key, response, len(response), self.clock),
+                    )
+                    self.size += len(response)
+
+                if self.size > self.max_size:
+                    self.evict()
+
+    def evict(self) -> None:
+        # evict down to 90% so that we don't have to evict with every put
+        target = self.max_size * 9 // 10
+
+        victims = []
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY last_used'):
+            if self.size <= target:
+                break
+            victims.append((key,))
+            self.size -= size
+
+        log.debug('result cache: evicting %d entries' % len(victims))
+        self.db.executemany('DELETE FROM results WHERE key = ?', victims)
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+def cached_calls(
+    cache : Optional[ResultCache],
+    name : str,
+    options : bytes,
+    codec_resp : Codec[Resp],
+    subjects : Sequence[S],
+    compute : Callable[[Sequence[S]], Generator[Resp, None, None]],
+) -> Generator[Resp, None, None]:
+    # The responses for `subjects`, in order. Only the subjects missing from the cache
+    # are passed to `compute`, which must yield one response for each of them, in order.
+    # `compute` is not called at all if everything is cached.
+    #
+    # New responses are stored as they come, so an interrupted run still
+    # saves the work done so far.
+    #
+    # The subjects are not copied, so they may be spilled to disk.
+    if cache is None:
+        yield from compute(subjects)
+        return
+
+    keys = [cache.key(name, options, subject) for subject in subjects]
+    cached = cache.get_many(keys)
+
+    missing = Selection(subjects, [i for i, response in enumerate(cached) if response is None])
+    log.debug('result cache: %d hits, %d misses' % (len(subjects) - len(missing), len(missing)))
+
+    computed : Optional[Generator[Resp, None, None]] = None
+    new : list[tuple[bytes, bytes]] = []
+    try:
+        for key, response_bytes in zip(keys, cached):
+            if response_bytes is not None:
+                yield codec_resp.decode_from_memory(response_bytes)
+                continue
+
+            if computed is None:
+                computed = compute(missing)
+
+            response = next(computed)
+            new.append((key, codec_resp.encode_to_memory(response)))
+            if len(new) >= PUT_BATCH_SIZE:
+                cache.put_many(new)
+                new = []
+
+            yield response
+    finally:
+        if computed is not None:
+            computed.close()
+        cache.put_many(new)
@@ -172,7 +172,7 @@ class PackedRootNode(RootNode):
         subj_cls : type,
         subj_decode : Callable[[bytes], Any],
         subj_desc : str,
-        subjects: List,  # linear list of packed subjects!
+        subjects: Sequence,  # linear list of packed subjects!
     ) -> None:
         # distribute the subjects about evenly:
         # the number of groups should be roughly
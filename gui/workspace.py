@@ -1,6 +1,8 @@
+import os
 import bz2
 import logging
-from typing import cast
+import contextlib
+from typing import cast, NamedTuple, Optional, Union, Iterator, BinaryIO
 
 import dataset
 import dataset.budgetary
@@ -9,45 +11,217 @@ import dataset.estimation_result
 import dataset.deterministic_consistency_result
 import dataset.stochastic_consistency_result
 import dataset.experiment_stats
+import dataset.power_analysis
 
 import branding
 from gui.progress import Worker
-from util.codec import FileIn, FileOut, strC, intC
+from util.codec import FileIn, FileOut, strC, intC, listC, namedtupleC
 from util.codec_progress import CodecProgress, listCP, enum_by_typenameCP
+from util.block_compression import Compression, BlockWriter, BlockReader, \
+    BlockCompressionError, thread_pool
 
 log = logging.getLogger(__name__)
 
 PREST_SIGNATURE = b'Prest Workspace\0'
-FILE_FORMAT_VERSION = 18
+FILE_FORMAT_VERSION = 19
+
+# the whole workspace in one bz2 stream, including the signature,
+# with subjects that spell out their alternatives;
+# we can still read it but all datasets must be decoded at once
+LEGACY_FILE_FORMAT_VERSION = 18
+
+# Since version 19, the file consists of
+#
+#   signature, version, Prest version (uncompressed)
+#   offset of the index (8 bytes, little endian)
+#   one compressed block per dataset, see util.block_compression
+#   index
+#
+# so that the datasets can be listed without reading them,
+# and loaded one by one, as they are needed.
+
+INDEX_OFFSET_SIZE = 8
+
+# for copying blocks between files
+COPY_CHUNK_SIZE = 1024 * 1024
 
 DatasetCP : CodecProgress = enum_by_typenameCP('Dataset', [
     (cls, cls.get_codec_progress())
     for cls in dataset.Dataset.__subclasses__()
 ])
 
+class IndexEntry(NamedTuple):
+    type_name : str
+    name : str
+    label_alts : str
+    label_size : str
+    work_size : int  # worker steps to decode the block
+    offset : int
+    size : int  # of the compressed block
+
+IndexC = listC(namedtupleC(IndexEntry, strC, strC, strC, strC, intC, intC, intC))
+
 class PersistenceError(Exception):
     pass
 
+Fingerprint = tuple[int, int]
+
+def get_fingerprint(f : BinaryIO) -> Fingerprint:
+    st = os.fstat(f.fileno())
+    return st.st_size, st.st_mtime_ns
+
+class DatasetStub:
+    # A dataset in a workspace file, not loaded yet.
+    # It can be listed and renamed; anything else needs load().
+
+    def __init__(self, fname : str, fingerprint : Fingerprint, entry : IndexEntry) -> None:
+        self.fname = fname
+        self.fingerprint = fingerprint
+        self.entry = entry
+        self.name = entry.name
+
+    def label_name(self) -> str:
+        return self.name
+
+    def label_alts(self) -> str:
+        return self.entry.label_alts
+
+    def label_size(self) -> str:
+        return self.entry.label_size
+
+    @contextlib.contextmanager
+    def open_file(self) -> Iterator[BinaryIO]:
+        with open(self.fname, 'rb') as f:
+            if get_fingerprint(f) != self.fingerprint:
+                raise PersistenceError('the workspace file has changed since it was loaded: %s' % self.fname)
+
+            f.seek(self.entry.offset)
+            yield f
+
+    def copy_block(self, f_out : BinaryIO) -> None:
+        with self.open_file() as f:
+            remaining = self.entry.size
+            while remaining > 0:
+                chunk = f.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    raise PersistenceError('truncated workspace file: %s' % self.fname)
+                f_out.write(chunk)
+                remaining -= len(chunk)
+
+    def load(self, worker : Worker) -> dataset.Dataset:
+        worker.set_work_size(self.entry.work_size)
+        with self.open_file() as f, thread_pool() as pool, BlockReader(f, pool) as f_raw:
+            try:
+                ds = cast(dataset.Dataset, DatasetCP.decode(worker, cast(FileIn, f_raw)))
+            except BlockCompressionError as e:
+                raise PersistenceError('corrupted workspace file: %s' % self.fname) from e
+
+        ds.name = self.name  # may have been renamed
+        return ds
+
+WorkspaceItem = Union[dataset.Dataset, DatasetStub]
+
 class Workspace:
     def __init__(self):
-        self.datasets : list[dataset.Dataset] = []
+        self.datasets : list[WorkspaceItem] = []
 
-    def save_to_file(self, worker : Worker, fname: str) -> None:
-        with bz2.open(fname, 'wb') as f_raw:
-            f = cast(FileOut, f_raw)  # assert we're doing output
+    def save_to_file(
+        self, worker : Worker, fname: str,
+        compression : Compression = Compression.DEFAULT,
+        unload : bool = False,
+    ) -> None:
+        # we write into a temporary file first because the unloaded datasets
+        # are copied from the file we may be overwriting
+        #
+        # unload: replace all datasets with stubs pointing into the new file,
+        #         rather than only those that are unloaded already
+        fname_tmp = fname + '.tmp'
 
-            f.write(PREST_SIGNATURE)
-            intC.encode(f, FILE_FORMAT_VERSION)  # version
-            strC.encode(f, branding.VERSION)
+        worker.set_work_size(sum(
+            ds.entry.work_size if isinstance(ds, DatasetStub) else DatasetCP.get_size(ds)
+            for ds in self.datasets
+        ))
 
-            work_size = listCP(DatasetCP).get_size(self.datasets)
-            intC.encode(f, work_size)
+        index : list[IndexEntry] = []
+        try:
+            with open(fname_tmp, 'wb') as f_raw, thread_pool() as pool:
+                f = cast(FileOut, f_raw)  # assert we're doing output
 
-            worker.set_work_size(work_size)
-            listCP(DatasetCP).encode(worker, f, self.datasets)
+                f.write(PREST_SIGNATURE)
+                intC.encode(f, FILE_FORMAT_VERSION)
+                strC.encode(f, branding.VERSION)
+
+                index_offset_position = f.tell()
+                f.write(bytes(INDEX_OFFSET_SIZE))  # filled in at the end
+
+                for ds in self.datasets:
+                    offset = f.tell()
+                    if isinstance(ds, DatasetStub):
+                        # no need to decode it
+                        ds.copy_block(f)
+                        worker.set_progress(worker.position + ds.entry.work_size)
+                        entry = ds.entry._replace(name=ds.name)
+                    else:
+                        with BlockWriter(f, compression, pool) as f_block:
+                            DatasetCP.encode(worker, cast(FileOut, f_block), ds)
+
+                        entry = IndexEntry(
+                            type_name=ds.__class__.__name__,
+                            name=ds.name,
+                            label_alts=ds.label_alts(),
+                            label_size=ds.label_size(),
+                            work_size=DatasetCP.get_size(ds),
+                            offset=0,
+                            size=0,
+                        )
+
+                    index.append(entry._replace(offset=offset, size=f.tell() - offset))
+
+                index_offset = f.tell()
+                IndexC.encode(f, index)
+
+                f.seek(index_offset_position)
+                f.write(index_offset.to_bytes(INDEX_OFFSET_SIZE, 'little'))
+
+            os.replace(fname_tmp, fname)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(fname_tmp)
+            raise
+
+        # the unloaded datasets now live in the new file
+        with open(fname, 'rb') as f_raw:
+            fingerprint = get_fingerprint(f_raw)
+
+        self.datasets = [
+            DatasetStub(fname, fingerprint, entry) if unload or isinstance(ds, DatasetStub) else ds
+            for ds, entry in zip(self.datasets, index)
+        ]
 
     def load_from_file(self, worker : Worker, fname: str) -> None:
-        with bz2.open(fname, 'rb') as f_raw:
+        with open(fname, 'rb') as f_raw:
+            f = cast(FileIn, f_raw)  # assert we're doing input
+
+            sig = f.read(len(PREST_SIGNATURE))
+            if sig != PREST_SIGNATURE:
+                f.seek(0)
+                self.datasets = self.load_legacy(worker, f)
+                return
+
+            version = intC.decode(f)
+            prest_version = strC.decode(f)
+            check_version(version, FILE_FORMAT_VERSION, prest_version)
+
+            index_offset = int.from_bytes(f.read(INDEX_OFFSET_SIZE), 'little')
+            f.seek(index_offset)
+            index = IndexC.decode(f)
+            fingerprint = get_fingerprint(f)
+
+        # the datasets are loaded when needed
+        self.datasets = [DatasetStub(fname, fingerprint, entry) for entry in index]
+
+    def load_legacy(self, worker : Worker, f_compressed : FileIn) -> list[WorkspaceItem]:
+        with bz2.BZ2File(f_compressed, 'rb') as f_raw:
             f = cast(FileIn, f_raw)  # assert we're doing input
 
             sig = f.read(len(PREST_SIGNATURE))
@@ -60,20 +234,26 @@ class Workspace:
             else:
                 prest_version = None  # too old
 
-            if version != FILE_FORMAT_VERSION:
-                message = 'incompatible PWF version: expected {0}, received {1}'.format(
-                    FILE_FORMAT_VERSION,
-                    version,
-                )
-
-                if prest_version:
-                    message += ' (saved by {0})'.format(prest_version)
-
-                raise PersistenceError(message)
+            check_version(version, LEGACY_FILE_FORMAT_VERSION, prest_version)
 
             work_size = intC.decode(f)
             worker.set_work_size(work_size)
             datasets = listCP(DatasetCP).decode(worker, f)
 
-        # assign to self only once everything's gone all right
-        self.datasets = datasets
+        for ds in datasets:
+            if isinstance(ds, dataset.experimental_data.ExperimentalData):
+                ds.compact_legacy_subjects()
+
+        return datasets
+
+def check_version(version : int, expected : int, prest_version : Optional[str]) -> None:
+    if version != expected:
+        message = 'incompatible PWF version: expected {0}, received {1}'.format(
+            expected,
+            version,
+        )
+
+        if prest_version:
+            message += ' (saved by {0})'.format(prest_version)
+
+        raise PersistenceError(message)
@@ -5,7 +5,7 @@ extern crate rand;
 use rand::SeedableRng;
 use rand::rngs::SmallRng;
 use prest_core::{rpc,args};
-use prest::{precomputed,estimation,consistency,simulation,instviz};
+use prest::{precomputed,estimation,consistency,simulation,power,instviz};
 use prest::{experiment_stats,budgetary,integrity};
 use precomputed::Precomputed;
 
@@ -14,6 +14,7 @@ fn rpc_loop(args : &args::Args) {
 
     // core state
     let mut rng : SmallRng = SeedableRng::from_seed([0;32]);
+    let mut templates = simulation::Templates::new();
     let mut rpc = IO::from_stdio();
     let mut precomp = Precomputed::new(
         args.fname_precomputed_preorders.as_ref().map(String::as_str)
@@ -43,10 +44,21 @@ fn rpc_loop(args : &args::Args) {
                 rpc.write_result(estimation::run(&mut precomp, &req)).unwrap();
             }
 
+            ActionRequest::EstimationStreaming(req) => {
+                let count = estimation::run_streaming(&mut precomp, &req,
+                    |i, response| rpc.write_item(i, response).unwrap()
+                );
+                rpc.write_result(count).unwrap();
+            }
+
             ActionRequest::ConsistencyDeterministic(req) => {
                 rpc.write_result(consistency::deterministic::run(&req)).unwrap();
             }
 
+            ActionRequest::ConsistencyDeterministicBatch(req) => {
+                rpc.write_result(Ok::<_, bool>(consistency::deterministic::run_batch(&req))).unwrap();
+            }
+
             ActionRequest::ConsistencyStochastic(req) => {
                 rpc.write_result(consistency::stochastic::run(&req)).unwrap();
             }
@@ -79,6 +91,29 @@ fn rpc_loop(args : &args::Args) {
                 rpc.write_result(simulation::run(&mut rng, req)).unwrap();
             }
 
+            ActionRequest::SimulationBatch(req) => {
+                let count = simulation::run_batch(&templates, &req,
+                    |i, chunk| rpc.write_item(i, chunk).unwrap()
+                );
+                rpc.write_result(count).unwrap();
+            }
+
+            ActionRequest::SimulationRegisterTemplates(subjects) => {
+                rpc.write_result(templates.register(subjects)).unwrap();
+            }
+
+            ActionRequest::SimulationClearTemplates => {
+                templates.clear();
+                rpc.write_result(Ok::<(), bool>(())).unwrap();
+            }
+
+            ActionRequest::PowerAnalysis(req) => {
+                let count = power::run(&templates, &req,
+                    |i, replication| rpc.write_item(i, replication).unwrap()
+                );
+                rpc.write_result(count).unwrap();
+            }
+
             ActionRequest::Summary(req) => {
                 rpc.write_result(experiment_stats::run(req)).unwrap();
             }
@@ -3,9 +3,9 @@ use std::io::{Read,Write,Stdout,Stdin,BufReader,BufWriter};
 use std::result::Result;
 use std::fmt::Display;
 
-use prest::codec::{self,Encode,Decode};
-use prest::common::{Log,LogLevel};
-use prest::{estimation,simulation,consistency,experiment_stats,budgetary,integrity,instviz};
+use prest::codec::{self,Encode,Decode,Packed};
+use prest::common::{Log,LogLevel,Subject};
+use prest::{estimation,simulation,power,consistency,experiment_stats,budgetary,integrity,instviz};
 
 #[derive(Debug)]
 pub enum ActionRequest {
@@ -15,11 +15,17 @@ pub enum ActionRequest {
     Summary(experiment_stats::Request),
     SetRngSeed(Vec<u8>),
     Simulation(simulation::Request),
+    SimulationBatch(simulation::BatchRequest),
+    SimulationRegisterTemplates(Vec<Packed<Subject>>),
+    SimulationClearTemplates,
+    PowerAnalysis(power::Request),
     ConsistencyDeterministic(consistency::deterministic::Request),
+    ConsistencyDeterministicBatch(consistency::deterministic::BatchRequest),
     ConsistencyStochastic(consistency::stochastic::Request),
     TupleIntransMenus(consistency::deterministic::Request),
     TupleIntransAlts(consistency::deterministic::Request),
     Estimation(estimation::Request),
+    EstimationStreaming(estimation::Request),
     Echo(String),
     Crash(String),
     Fail(String),
@@ -37,11 +43,17 @@ impl Decode for ActionRequest {
             "summary" => Ok(Summary(Decode::decode(f)?)),
             "set-rng-seed" => Ok(SetRngSeed(Decode::decode(f)?)),
             "simulation" => Ok(Simulation(Decode::decode(f)?)),
+            "simulation-batch" => Ok(SimulationBatch(Decode::decode(f)?)),
+            "simulation-register-templates" => Ok(SimulationRegisterTemplates(Decode::decode(f)?)),
+            "simulation-clear-templates" => Ok(SimulationClearTemplates),
+            "power-analysis" => Ok(PowerAnalysis(Decode::decode(f)?)),
             "consistency-deterministic" => Ok(ConsistencyDeterministic(Decode::decode(f)?)),
+            "consistency-deterministic-batch" => Ok(ConsistencyDeterministicBatch(Decode::decode(f)?)),
             "consistency-stochastic" => Ok(ConsistencyStochastic(Decode::decode(f)?)),
             "tuple-intrans-menus" => Ok(TupleIntransMenus(Decode::decode(f)?)),
             "tuple-intrans-alts" => Ok(TupleIntransAlts(Decode::decode(f)?)),
             "estimation" => Ok(Estimation(Decode::decode(f)?)),
+            "estimation-streaming" => Ok(EstimationStreaming(Decode::decode(f)?)),
             "integrity-check" => Ok(IntegrityCheck(Decode::decode(f)?)),
             "echo" => Ok(Echo(Decode::decode(f)?)),
             "crash" => Ok(Crash(Decode::decode(f)?)),
@@ -90,6 +102,7 @@ pub enum Message<Ans> {
     Answer(Ans),
     Error(Error),
     Log(LogMessage),
+    Item(u32, Ans),  // one of many answers to a streaming request, with its index
 }
 
 impl<Ans : Encode> Encode for Message<Ans> {
@@ -100,6 +113,7 @@ impl<Ans : Encode> Encode for Message<Ans> {
             &Answer(ref answer) => (1u8, answer).encode(f),
             &Error(ref error)   => (2u8, error).encode(f),
             &Log(ref log)       => (3u8, log).encode(f),
+            &Item(index, ref item) => (4u8, index, item).encode(f),
         }
     }
 }
@@ -131,6 +145,14 @@ impl IO {
         self.stdout.flush()?;
         Ok(())
     }
+
+    // streaming requests send any number of items, in any order,
+    // and then the final answer with write_result()
+    pub fn write_item<T : Encode>(&mut self, index : u32, item : T) -> codec::Result<()> {
+        Message::Item(index, item).encode(&mut self.stdout)?;
+        self.stdout.flush()?;
+        Ok(())
+    }
 }
 
 pub struct Logger<'a> {
@@ -37,10 +37,55 @@ macro_rules! choices {
     ]}
 }
 
+// The alternatives of a subject, usually as references into the alternatives
+// of the dataset, which are not sent along. The alternative indices
+// in the choice rows are indices into this list.
+#[derive(Debug, Clone, PartialEq, Eq)]
+pub enum Alternatives {
+    All(u32),  // the first n alternatives of the dataset
+    Some(Vec<u32>),  // a selection of the alternatives of the dataset
+    Named(Vec<String>),  // not in the dataset
+}
+
+impl Alternatives {
+    pub fn len(&self) -> usize {
+        match *self {
+            Alternatives::All(n) => n as usize,
+            Alternatives::Some(ref indices) => indices.len(),
+            Alternatives::Named(ref names) => names.len(),
+        }
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+}
+
+impl Encode for Alternatives {
+    fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
+        match *self {
+            Alternatives::All(n) => (0u8, n).encode(f),
+            Alternatives::Some(ref indices) => (1u8, indices).encode(f),
+            Alternatives::Named(ref names) => (2u8, names).encode(f),
+        }
+    }
+}
+
+impl Decode for Alternatives {
+    fn decode<R : Read>(f : &mut R) -> codec::Result<Alternatives> {
+        Ok(match Decode::decode(f)? {
+            0u8 => Alternatives::All(Decode::decode(f)?),
+            1u8 => Alternatives::Some(Decode::decode(f)?),
+            2u8 => Alternatives::Named(Decode::decode(f)?),
+            _ => Err(codec::Error::BadEnumTag)?,
+        })
+    }
+}
+
 #[derive(Debug, Clone)]
 pub struct Subject {
     pub name : String,
-    pub alternatives : Vec<String>,
+    pub alternatives : Alternatives,
     pub choices : Vec<ChoiceRow>,
 }
 
@@ -330,6 +330,38 @@ impl Decode for Request {
     }
 }
 
+// several subjects in one request, to amortise the IPC overhead
+#[derive(Debug)]
+pub struct BatchRequest {
+    subjects : Vec<Packed<Subject>>,
+    allow_repeated_menus : bool,  // for testing
+}
+
+impl Decode for BatchRequest {
+    fn decode<R : Read>(f : &mut R) -> codec::Result<BatchRequest> {
+        Ok(BatchRequest {
+            subjects: Decode::decode(f)?,
+            allow_repeated_menus: false,
+        })
+    }
+}
+
+// the outcome for one subject of a batch; an error fails only its own subject,
+// as if the subject had been sent in a request of its own
+pub struct BatchItem {
+    name : String,
+    result : Result<Response>,
+}
+
+impl Encode for BatchItem {
+    fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
+        match self.result {
+            Ok(ref response) => (0u8, response).encode(f),
+            Err(ref e) => (1u8, &self.name, e.to_string()).encode(f),
+        }
+    }
+}
+
 // scores for one particular cycle length
 #[derive(Clone, PartialEq, Eq, PartialOrd, Ord, Debug)]
 pub struct Row {
@@ -378,6 +410,26 @@ pub struct Response {
     contraction_consistency_all : u32,
 }
 
+impl Response {
+    pub fn warp_pairs(&self) -> u32 {
+        self.warp_pairs
+    }
+
+    pub fn contraction_consistency_pairs(&self) -> u32 {
+        self.contraction_consistency_pairs
+    }
+
+    /// Congruence violations of all cycle lengths.
+    pub fn total_garp(&self) -> BigUint {
+        self.rows.iter().map(|r| &r.garp).sum()
+    }
+
+    /// Strict general cycles of all lengths.
+    pub fn total_sarp(&self) -> BigUint {
+        self.rows.iter().map(|r| &r.sarp).sum()
+    }
+}
+
 impl Encode for Response {
     fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
         (
@@ -598,11 +650,28 @@ fn has_repeated_menus(choices : &[ChoiceRow]) -> bool {
 }
 
 pub fn run(request : &Request) -> Result<Response> {
-    let ref subject = request.subject.unpack();
+    run_one(request.subject.unpack(), request.allow_repeated_menus)
+}
+
+pub fn run_batch(request : &BatchRequest) -> Vec<BatchItem> {
+    request.subjects.iter().map(|subject| {
+        let subject = subject.unpack();
+        BatchItem {
+            name: subject.name.clone(),
+            result: run_one(subject, request.allow_repeated_menus),
+        }
+    }).collect()
+}
+
+pub fn run_subject(subject : &Subject) -> Result<Response> {
+    run_one(subject, false)
+}
+
+fn run_one(subject : &Subject, allow_repeated_menus : bool) -> Result<Response> {
     let alt_count = subject.alternatives.len() as u32;
     let choices = &subject.choices;
 
-    if !request.allow_repeated_menus && has_repeated_menus(choices) {
+    if !allow_repeated_menus && has_repeated_menus(choices) {
         return Err(Error::RepeatedMenus);
     }
 
@@ -915,12 +984,12 @@ pub mod tuple_intrans {
     #[cfg(test)]
     mod test {
         use super::*;
-        use crate::common::{Subject,ChoiceRow};
+        use crate::common::{Subject,ChoiceRow,Alternatives};
 
         fn testreq(alt_count : u32, choices : Vec<ChoiceRow>) -> Request {
             Request{subject: codec::Packed(Subject{
                 name: String::from("subject"),
-                alternatives: (0..alt_count).map(|s| s.to_string()).collect(),
+                alternatives: Alternatives::All(alt_count),
                 choices,
             }), allow_repeated_menus: true}
         }
@@ -963,12 +1032,13 @@ mod test {
     use super::*;
     use num::Zero;
     use crate::alt_set::AltSet;
+    use crate::common::Alternatives;
     use std::iter::FromIterator;
 
     fn testreq(alt_count : u32, choices : Vec<ChoiceRow>) -> Request {
         Request{subject: codec::Packed(Subject{
             name: String::from("subject"),
-            alternatives: (0..alt_count).map(|s| s.to_string()).collect(),
+            alternatives: Alternatives::All(alt_count),
             choices,
         }), allow_repeated_menus: true}
     }
@@ -1156,6 +1226,42 @@ mod test {
         assert_eq!(response.warp, BigUint::from(2u32));
     }
 
+    #[test]
+    fn batch() {
+        let single = testreq(3, choices![
+            [0,1] -> [0],
+            [1,2] -> [1],
+            [0,2] -> [2]
+        ]);
+        let repeated = testreq(3, choices![
+            [0,1] -> [0],
+            [0,1] -> [1]
+        ]);
+        let mut batch = BatchRequest{
+            subjects: vec![
+                single.subject.clone(),
+                repeated.subject.clone(),
+                single.subject.clone(),
+            ],
+            allow_repeated_menus: false,
+        };
+
+        let response = run(&single).unwrap();
+        let items = run_batch(&batch);
+
+        // only the subject with repeated menus fails
+        assert_eq!(items.len(), 3);
+        assert!(matches!(items[1].result, Err(Error::RepeatedMenus)));
+        for item in [&items[0], &items[2]] {
+            let r = item.result.as_ref().unwrap();
+            assert_eq!(r.rows, response.rows);
+            assert_eq!(r.warp, response.warp);
+        }
+
+        batch.allow_repeated_menus = true;
+        assert!(run_batch(&batch).iter().all(|item| item.result.is_ok()));
+    }
+
     #[test]
     fn binary_intransitivities_acyclic() {
         let choices = choices![
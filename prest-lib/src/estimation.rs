@@ -9,6 +9,9 @@ use crate::common::{Subject,ChoiceRow};
 use crate::codec::{self,Encode,Decode,Packed};
 use std::iter::FromIterator;
 use rayon::prelude::*;
+use std::sync::mpsc;
+use std::sync::atomic::{AtomicBool,Ordering};
+use std::thread;
 use num_rational::Ratio;
 use num_traits::identities::Zero;
 
@@ -309,7 +312,7 @@ pub fn run_one(
     })
 }
 
-pub fn run(precomputed : &mut Precomputed, request : &Request) -> Result<Vec<Packed<Response>>> {
+fn precompute(precomputed : &mut Precomputed, request : &Request) -> Result<()> {
     // precompute up to the maximum number of alternatives
     let alt_count = request.subjects.iter().map(
         |subj| subj.unpack().alternatives.len() as u32
@@ -320,26 +323,32 @@ pub fn run(precomputed : &mut Precomputed, request : &Request) -> Result<Vec<Pac
         precomputed.precompute(alt_count)?;
     }
 
+    Ok(())
+}
+
+fn estimate(precomputed : &Precomputed, request : &Request, subj : &Packed<Subject>) -> Result<Response> {
+    run_one(
+        precomputed,
+        request.distance_score,
+        &subj.unpack().drop_deferrals(request.disregard_deferrals),
+        &request.models,
+    )
+}
+
+pub fn run(precomputed : &mut Precomputed, request : &Request) -> Result<Vec<Packed<Response>>> {
+    precompute(precomputed, request)?;
+    let precomputed : &Precomputed = precomputed;
+
     let results : Vec<Result<Response>> = if request.disable_parallelism {
         // run estimation sequentially
         request.subjects.iter().map(
-            |subj| run_one(
-                precomputed,
-                request.distance_score,
-                &subj.unpack().drop_deferrals(request.disregard_deferrals),
-                &request.models,
-            )
+            |subj| estimate(precomputed, request, subj)
         ).collect()
     } else {
         // run estimation in parallel
         let mut results = Vec::new();
         request.subjects.par_iter().map(
-            |subj| run_one(
-                precomputed,
-                request.distance_score,
-                &subj.unpack().drop_deferrals(request.disregard_deferrals),
-                &request.models
-            )
+            |subj| estimate(precomputed, request, subj)
         ).collect_into_vec(&mut results);
         results
     };
@@ -353,6 +362,66 @@ pub fn run(precomputed : &mut Precomputed, request : &Request) -> Result<Vec<Pac
     Ok(responses)
 }
 
+// Like run() but each response is passed to `emit` as soon as it's ready,
+// together with the index of its subject in the request, so responses come
+// in the order of completion. All subjects of the request share one parallel
+// iterator so the thread pool stays busy until the very last subject.
+//
+// Returns the number of responses emitted. After the first error,
+// no more responses are emitted and the remaining subjects are skipped.
+pub fn run_streaming<F>(precomputed : &mut Precomputed, request : &Request, mut emit : F) -> Result<u32>
+    where F : FnMut(u32, Packed<Response>)
+{
+    precompute(precomputed, request)?;
+    let precomputed : &Precomputed = precomputed;
+
+    if request.disable_parallelism {
+        for (i, subj) in request.subjects.iter().enumerate() {
+            emit(i as u32, Packed(estimate(precomputed, request, subj)?));
+        }
+        return Ok(request.subjects.len() as u32);
+    }
+
+    let failed = AtomicBool::new(false);
+    let (tx, rx) = mpsc::channel();
+    let mut error = None;
+    let mut count = 0;
+
+    thread::scope(|s| {
+        // the workers send the responses to this thread,
+        // which is the only one allowed to emit them
+        s.spawn(|| {
+            request.subjects.par_iter().enumerate().for_each_with(tx, |tx, (i, subj)| {
+                if !failed.load(Ordering::Relaxed) {
+                    // the receiver lives until all workers are done
+                    tx.send((i as u32, estimate(precomputed, request, subj))).unwrap();
+                }
+            });
+        });
+
+        for (i, result) in rx {
+            match result {
+                Ok(response) if error.is_none() => {
+                    emit(i, Packed(response));
+                    count += 1;
+                }
+                Ok(_) => {
+                    // already failed, just drain
+                }
+                Err(e) => {
+                    failed.store(true, Ordering::Relaxed);
+                    error.get_or_insert(e);
+                }
+            }
+        }
+    });
+
+    match error {
+        Some(e) => Err(e),
+        None => Ok(count),
+    }
+}
+
 #[cfg(test)]
 mod test {
     use crate::precomputed::Precomputed;
@@ -365,17 +434,53 @@ mod test {
     use crate::codec;
     use crate::alt_set::AltSet;
     use crate::alt::Alt;
-    use crate::common::{ChoiceRow,Subject};
+    use crate::common::{ChoiceRow,Subject,Alternatives};
     use std::iter::FromIterator;
 
     fn testsubj(alt_count : u32, choices : Vec<ChoiceRow>) -> Subject {
         Subject{
             name: String::from("subject"),
-            alternatives: (0..alt_count).map(|s| s.to_string()).collect(),
+            alternatives: Alternatives::All(alt_count),
             choices,
         }
     }
 
+    #[test]
+    fn streaming() {
+        use model::Model;
+        use crate::codec::Packed;
+
+        let subjects : Vec<Packed<Subject>> = (0..20).map(|i| Packed(testsubj(4, choices![
+            [0,1,2,3] -> [i % 4],
+            [0,1,2] -> [i % 3],
+            [0,1] -> [i % 2],
+            [2,3] -> [2 + i % 2]
+        ]))).collect();
+
+        for &disable_parallelism in &[false, true] {
+            let request = super::Request {
+                subjects: subjects.clone(),
+                models: vec![Model::UndominatedChoice{strict: true}, Model::TopTwo],
+                disable_parallelism,
+                disregard_deferrals: false,
+                distance_score: DistanceScore::HoutmanMaks,
+            };
+
+            let mut precomputed = Precomputed::new(None);
+            let expected : Vec<Vec<u8>> = super::run(&mut precomputed, &request).unwrap()
+                .iter().map(|r| codec::encode_to_memory(r).unwrap()).collect();
+
+            let mut streamed : Vec<Option<Vec<u8>>> = vec![None; subjects.len()];
+            let count = super::run_streaming(&mut precomputed, &request, |i, r| {
+                assert!(streamed[i as usize].is_none());
+                streamed[i as usize] = Some(codec::encode_to_memory(&r).unwrap());
+            }).unwrap();
+
+            assert_eq!(count as usize, subjects.len());
+            assert_eq!(streamed.into_iter().map(Option::unwrap).collect::<Vec<_>>(), expected);
+        }
+    }
+
     #[test]
     fn top_two() {
         use model::Model;
@@ -58,13 +58,13 @@ mod test {
     use super::*;
     use crate::alt_set::AltSet;
     use crate::alt::Alt;
-    use crate::common::{Subject,ChoiceRow};
+    use crate::common::{Subject,ChoiceRow,Alternatives};
     use crate::codec;
 
     fn testreq(alt_count : u32, choices : Vec<ChoiceRow>) -> Request {
         Request{subject: codec::Packed(Subject{
             name: String::from("subject"),
-            alternatives: (0..alt_count).map(|s| s.to_string()).collect(),
+            alternatives: Alternatives::All(alt_count),
             choices,
         })}
     }
@@ -28,6 +28,7 @@ pub mod model;
 pub mod precomputed;
 pub mod consistency;
 pub mod simulation;
+pub mod power;
 pub mod experiment_stats;
 pub mod void;
 pub mod budgetary;
@@ -0,0 +1,200 @@
+//! Monte Carlo power analysis: how often do random subjects violate consistency?
+//!
+//! Every replication simulates a batch of subjects and analyses their deterministic
+//! consistency on the spot; only a summary of the replication leaves the core.
+
+use std::fmt;
+use std::result;
+use std::io::{Read,Write};
+use num::zero;
+use num_bigint::BigUint;
+use num_traits::identities::Zero;
+
+use crate::codec::{self,Encode,Decode};
+use crate::simulation::{self,BatchGenerator,Templates};
+use crate::consistency::deterministic;
+
+#[derive(Debug)]
+pub struct Request {
+    batch : simulation::BatchRequest,  // the subjects of every replication
+    replications : u32,
+}
+
+impl Decode for Request {
+    fn decode<R : Read>(f : &mut R) -> codec::Result<Request> {
+        Ok(Request {
+            batch: Decode::decode(f)?,
+            replications: Decode::decode(f)?,
+        })
+    }
+}
+
+/// The summary of one replication.
+#[derive(Debug, PartialEq, Eq)]
+pub struct Replication {
+    subject_count : u32,
+
+    // the number of subjects with violations of
+    congruence : u32,
+    strict_general_cycles : u32,
+    warp : u32,
+    contraction_consistency : u32,
+
+    congruence_total : BigUint,  // all congruence violations of all subjects
+    warp_pairs : Vec<u32>,  // histogram: warp_pairs[n] subjects have n WARP pairs
+}
+
+impl Replication {
+    fn new() -> Replication {
+        Replication {
+            subject_count: 0,
+            congruence: 0,
+            strict_general_cycles: 0,
+            warp: 0,
+            contraction_consistency: 0,
+            congruence_total: zero(),
+            warp_pairs: Vec::new(),
+        }
+    }
+
+    fn add(&mut self, response : &deterministic::Response) {
+        let garp = response.total_garp();
+        let warp_pairs = response.warp_pairs() as usize;
+
+        self.subject_count += 1;
+        self.congruence += !garp.is_zero() as u32;
+        self.strict_general_cycles += !response.total_sarp().is_zero() as u32;
+        self.warp += (warp_pairs > 0) as u32;
+        self.contraction_consistency += (response.contraction_consistency_pairs() > 0) as u32;
+        self.congruence_total += garp;
+
+        if self.warp_pairs.len() <= warp_pairs {
+            self.warp_pairs.resize(warp_pairs + 1, 0);
+        }
+        self.warp_pairs[warp_pairs] += 1;
+    }
+}
+
+impl Encode for Replication {
+    fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
+        (
+            &self.subject_count,
+            &self.congruence,
+            &self.strict_general_cycles,
+            &self.warp,
+            &self.contraction_consistency,
+            &self.congruence_total,
+            &self.warp_pairs,
+        ).encode(f)
+    }
+}
+
+pub enum Error {
+    Simulation(simulation::Error),
+    Consistency(deterministic::Error),
+}
+
+impl Encode for Error {
+    fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
+        match self {
+            Error::Simulation(e) => (0u8, e).encode(f),
+            Error::Consistency(e) => (1u8, e).encode(f),
+        }
+    }
+}
+
+impl fmt::Display for Error {
+    fn fmt(&self, f : &mut fmt::Formatter) -> fmt::Result {
+        match self {
+            Error::Simulation(e) => write!(f, "{}", e),
+            Error::Consistency(e) => write!(f, "{}", e),
+        }
+    }
+}
+
+pub type Result<T> = result::Result<T, Error>;
+
+fn replicate(generator : &BatchGenerator, request : &Request, r : u32) -> Result<Replication> {
+    // the replications take consecutive ranges of streams
+    let subject_count = generator.subject_count();
+    let first_stream = request.batch.first_stream + r as u64 * subject_count;
+
+    let mut replication = Replication::new();
+    for k in 0 .. subject_count {
+        let response = generator.generate(k, first_stream + k);
+        replication.add(
+            &deterministic::run_subject(response.subject()).map_err(Error::Consistency)?
+        );
+    }
+
+    Ok(replication)
+}
+
+/// Emits the replications, tagged with their indices; returns the number of replications.
+/// The result does not depend on the number of threads.
+///
+/// After the first error, no more replications are emitted.
+pub fn run<F>(templates : &Templates, request : &Request, emit : F) -> Result<u32>
+    where F : FnMut(u32, Replication)
+{
+    let generator = BatchGenerator::new(templates, &request.batch).map_err(Error::Simulation)?;
+    simulation::parallel_map(request.replications, |r| replicate(&generator, request, r), emit)
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use std::collections::BTreeMap;
+    use crate::simulation::{BatchSubjects,GenMenus,GenChoices,MenuGenerator};
+
+    fn request(seed : u64, replications : u32) -> Request {
+        Request {
+            batch: simulation::BatchRequest {
+                name: String::from("random"),
+                alternatives: vec![String::from("a"), String::from("b"), String::from("c"), String::from("d")],
+                subjects: BatchSubjects::Generated(GenMenus {
+                    generator: MenuGenerator::Exhaustive,
+                    defaults: false,
+                }),
+                gen_choices: GenChoices::Uniform {
+                    forced_choice: true,
+                    multiple_choice: false,
+                },
+                preserve_deferrals: false,
+                first_index: 1,
+                last_index: 20,
+                seed,
+                first_stream: 0,
+            },
+            replications,
+        }
+    }
+
+    fn replications(request : &Request) -> BTreeMap<u32, Replication> {
+        let mut result = BTreeMap::new();
+        let count = run(&Templates::new(), request, |r, replication| {
+            assert!(result.insert(r, replication).is_none());
+        }).ok().unwrap();
+
+        assert_eq!(count, request.replications);
+        result
+    }
+
+    #[test]
+    fn summaries() {
+        let result = replications(&request(42, 10));
+        assert_eq!(result.len(), 10);
+
+        for replication in result.values() {
+            assert_eq!(replication.subject_count, 20);
+            assert_eq!(replication.warp_pairs.iter().sum::<u32>(), 20);
+            assert_eq!(replication.warp, 20 - replication.warp_pairs[0]);
+
+            // random choices from all menus of four alternatives are almost never consistent
+            assert!(replication.congruence > 0);
+            assert!(replication.congruence <= replication.subject_count);
+        }
+
+        assert_ne!(replications(&request(43, 10)), result);
+    }
+}
@@ -2,11 +2,13 @@ use std::result;
 use std::fmt;
 use std::io::{Read,Write};
 use std::iter::FromIterator;
-use rand::Rng;
+use rand::{Rng,SeedableRng};
+use rand::rngs::SmallRng;
 use rand::seq::IndexedRandom;
+use rayon::prelude::*;
 
 use crate::model;
-use crate::common::{ChoiceRow,Subject};
+use crate::common::{ChoiceRow,Subject,Alternatives};
 use crate::codec::{Encode,Decode,Packed,self};
 use crate::alt_set::{AltSet,AltSetView};
 use crate::alt::Alt;
@@ -193,6 +195,12 @@ pub struct Response {
     observation_count : u32,
 }
 
+impl Response {
+    pub fn subject(&self) -> &Subject {
+        self.subject.unpack()
+    }
+}
+
 impl Encode for Response {
     fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
         (&self.subject, self.observation_count).encode(f)
@@ -200,65 +208,476 @@ impl Encode for Response {
 }
 
 pub enum Error {
+    UnknownTemplate(u32),
 }
 
 impl Encode for Error {
-    fn encode<W : Write>(&self, _f : &mut W) -> codec::Result<()> {
-        match *self { }
+    fn encode<W : Write>(&self, f : &mut W) -> codec::Result<()> {
+        use self::Error::*;
+        match self {
+            UnknownTemplate(handle) => (0u8, handle).encode(f),
+        }
     }
 }
 
 impl fmt::Display for Error {
-    fn fmt(&self, _f : &mut fmt::Formatter) -> fmt::Result {
-        match *self { }
+    fn fmt(&self, f : &mut fmt::Formatter) -> fmt::Result {
+        use self::Error::*;
+        match self {
+            UnknownTemplate(handle) => write!(f, "unknown copycat template: {}", handle),
+        }
     }
 }
 
 pub type Result<T> = result::Result<T, Error>;
 
-pub fn run<R : Rng>(rng : &mut R, request : Request) -> Result<Response> {
-    let alt_count = request.alternatives.len() as u32;
+#[derive(Debug)]
+struct TemplateRow {
+    menu : AltSet,
+    default : Option<Alt>,
+    deferred : bool,
+}
 
-    let choices : Vec<ChoiceRow> = match request.gen_menus.generator {
-        MenuGenerator::Copycat(Packed(ref subj)) => subj.choices.iter().map(
-            |cr| ChoiceRow {
+/// The menus of a subject, for copycat simulation.
+#[derive(Debug)]
+pub struct Template {
+    name : String,
+    rows : Vec<TemplateRow>,
+}
+
+impl Template {
+    pub fn from_subject(subject : &Subject) -> Template {
+        Template {
+            name: subject.name.clone(),
+            rows: subject.choices.iter().map(|cr| TemplateRow {
                 menu: cr.menu.clone(),
-                default: cr.default.clone(),
-                choice: if request.preserve_deferrals
-                    && cr.choice.view().is_empty() {
-                        AltSet::empty()
-                    } else {
-                        request.gen_choices.generate(
-                            rng, alt_count, cr.menu.view(), cr.default
-                        )
-                    }
-            }
-        ).collect(),
-
-        _ => request.gen_menus.generate(rng, alt_count).into_iter().map(
-            // we use this order of ChoiceRow fields
-            // because we first need to generate the choice
-            // and only then pass the ownership of the menu
-            |(menu, default)| ChoiceRow {
-                choice: request.gen_choices.generate(rng, alt_count, menu.view(), default),
-                menu,
-                default,
-            }
-        ).collect(),
-    };
+                default: cr.default,
+                deferred: cr.choice.view().is_empty(),
+            }).collect(),
+        }
+    }
+}
 
-    let name = match request.gen_menus.generator {
-        MenuGenerator::Copycat(subject_packed)
-            => format!("{}{}", subject_packed.unpack().name, request.name),
-        _ => request.name,
-    };
+/// Templates registered for the whole session, so that they are sent
+/// to the core and unpacked only once; the handle is the index.
+/// The client clears them when they take too much memory.
+#[derive(Debug, Default)]
+pub struct Templates {
+    templates : Vec<Template>,
+}
+
+impl Templates {
+    pub fn new() -> Templates {
+        Templates::default()
+    }
+
+    /// Returns the handle of the first template; the others follow consecutively.
+    pub fn register(&mut self, subjects : Vec<Packed<Subject>>) -> Result<u32> {
+        let first = self.templates.len() as u32;
+        self.templates.extend(subjects.iter().map(|Packed(subject)| Template::from_subject(subject)));
+        Ok(first)
+    }
+
+    /// Forgets all templates; the handles start from zero again.
+    pub fn clear(&mut self) {
+        self.templates.clear();
+    }
 
-    Ok(Response {
+    pub fn get(&self, handle : u32) -> Result<&Template> {
+        self.templates.get(handle as usize).ok_or(Error::UnknownTemplate(handle))
+    }
+}
+
+fn copycat_choices<R : Rng>(
+    rng : &mut R, template : &Template, gen_choices : &GenChoices,
+    preserve_deferrals : bool, alt_count : u32,
+) -> Vec<ChoiceRow> {
+    template.rows.iter().map(
+        |row| ChoiceRow {
+            menu: row.menu.clone(),
+            default: row.default,
+            choice: if preserve_deferrals && row.deferred {
+                    AltSet::empty()
+                } else {
+                    gen_choices.generate(
+                        rng, alt_count, row.menu.view(), row.default
+                    )
+                }
+        }
+    ).collect()
+}
+
+fn generated_choices<R : Rng>(
+    rng : &mut R, gen_menus : &GenMenus, gen_choices : &GenChoices, alt_count : u32,
+) -> Vec<ChoiceRow> {
+    gen_menus.generate(rng, alt_count).into_iter().map(
+        // we use this order of ChoiceRow fields
+        // because we first need to generate the choice
+        // and only then pass the ownership of the menu
+        |(menu, default)| ChoiceRow {
+            choice: gen_choices.generate(rng, alt_count, menu.view(), default),
+            menu,
+            default,
+        }
+    ).collect()
+}
+
+fn response(name : String, alt_count : u32, choices : Vec<ChoiceRow>) -> Response {
+    Response {
         observation_count: choices.len() as u32,
         subject: Packed(Subject {
             name,
-            alternatives: request.alternatives,
+            alternatives: Alternatives::All(alt_count),
             choices,
         })
+    }
+}
+
+pub fn run<R : Rng>(rng : &mut R, request : Request) -> Result<Response> {
+    let alt_count = request.alternatives.len() as u32;
+
+    Ok(match request.gen_menus.generator {
+        MenuGenerator::Copycat(Packed(ref subj)) => response(
+            format!("{}{}", subj.name, request.name),
+            alt_count,
+            copycat_choices(rng, &Template::from_subject(subj), &request.gen_choices, request.preserve_deferrals, alt_count),
+        ),
+
+        _ => response(
+            request.name,
+            alt_count,
+            generated_choices(rng, &request.gen_menus, &request.gen_choices, alt_count),
+        ),
     })
 }
+
+#[derive(Debug)]
+pub enum BatchSubjects {
+    Generated(GenMenus),
+    Copycat(Vec<Packed<Subject>>),
+    Registered(Vec<u32>),  // handles of copycat templates
+}
+
+impl Decode for BatchSubjects {
+    fn decode<R : Read>(f : &mut R) -> codec::Result<BatchSubjects> {
+        use self::BatchSubjects::*;
+
+        Ok(match Decode::decode(f)? {
+            0u8 => Generated(Decode::decode(f)?),
+            1u8 => Copycat(Decode::decode(f)?),
+            2u8 => Registered(Decode::decode(f)?),
+            _ => Err(codec::Error::BadEnumTag)?,
+        })
+    }
+}
+
+/// Many subjects in one request.
+///
+/// Generated subjects are named `{name}{i}` for `i` in `first_index ..= last_index`;
+/// every copycat template gives one subject named `{template name}{name}{i}` for every `i`.
+///
+/// The `k`-th subject of the batch (in this order, counting from zero)
+/// is generated from its own random stream `first_stream + k` of `seed`,
+/// so a batch split into several requests with the right `first_stream`s
+/// gives the same subjects as the whole batch.
+#[derive(Debug)]
+pub struct BatchRequest {
+    pub(crate) name : String,
+    pub(crate) alternatives : Vec<String>,
+    pub(crate) subjects : BatchSubjects,
+    pub(crate) gen_choices : GenChoices,
+    pub(crate) preserve_deferrals : bool,
+    pub(crate) first_index : u32,
+    pub(crate) last_index : u32,
+    pub(crate) seed : u64,
+    pub(crate) first_stream : u64,
+}
+
+impl Decode for BatchRequest {
+    fn decode<R : Read>(f : &mut R) -> codec::Result<BatchRequest> {
+        Ok(BatchRequest {
+            name: Decode::decode(f)?,
+            alternatives: Decode::decode(f)?,
+            subjects: Decode::decode(f)?,
+            gen_choices: Decode::decode(f)?,
+            preserve_deferrals: Decode::decode(f)?,
+            first_index: Decode::decode(f)?,
+            last_index: Decode::decode(f)?,
+            seed: Decode::decode(f)?,
+            first_stream: Decode::decode(f)?,
+        })
+    }
+}
+
+impl BatchRequest {
+    /// The number of indices in `first_index ..= last_index`.
+    fn index_count(&self) -> u64 {
+        (self.last_index as u64 + 1).saturating_sub(self.first_index as u64)
+    }
+}
+
+/// Subjects per streamed chunk: big enough to amortise the messages,
+/// small enough to report progress often.
+pub const CHUNK_SIZE : usize = 1024;
+
+/// The random stream of one subject. Distinct streams of the same seed
+/// are independent, whichever thread or process generates them.
+pub fn subject_rng(seed : u64, stream : u64) -> SmallRng {
+    // the splitmix64 finaliser, a bijection, so distinct streams get distinct seeds
+    fn mix(mut z : u64) -> u64 {
+        z = (z ^ (z >> 30)).wrapping_mul(0xbf58476d1ce4e5b9);
+        z = (z ^ (z >> 27)).wrapping_mul(0x94d049bb133111eb);
+        z ^ (z >> 31)
+    }
+
+    SmallRng::seed_from_u64(mix(seed ^ mix(stream)))
+}
+
+enum Source<'a> {
+    Generated(&'a GenMenus),
+    Copycat(Vec<Template>),
+    Registered(Vec<&'a Template>),
+}
+
+/// Generates the subjects of a batch one by one, in any order.
+pub struct BatchGenerator<'a> {
+    request : &'a BatchRequest,
+    source : Source<'a>,
+}
+
+impl<'a> BatchGenerator<'a> {
+    pub fn new(templates : &'a Templates, request : &'a BatchRequest) -> Result<BatchGenerator<'a>> {
+        let source = match request.subjects {
+            BatchSubjects::Generated(ref gen_menus) => Source::Generated(gen_menus),
+
+            BatchSubjects::Copycat(ref subjects) => Source::Copycat(subjects.iter().map(
+                |Packed(subject)| Template::from_subject(subject)
+            ).collect()),
+
+            // fail before generating anything
+            BatchSubjects::Registered(ref handles) => Source::Registered(handles.iter().map(
+                |&handle| templates.get(handle)
+            ).collect::<Result<Vec<&Template>>>()?),
+        };
+
+        Ok(BatchGenerator { request, source })
+    }
+
+    /// The number of subjects in the batch.
+    pub fn subject_count(&self) -> u64 {
+        let template_count = match self.source {
+            Source::Generated(_) => 1,
+            Source::Copycat(ref templates) => templates.len(),
+            Source::Registered(ref templates) => templates.len(),
+        };
+
+        template_count as u64 * self.request.index_count()
+    }
+
+    /// The subject `k` of the batch, from the given random stream.
+    pub fn generate(&self, k : u64, stream : u64) -> Response {
+        let request = self.request;
+        let alt_count = request.alternatives.len() as u32;
+        let index = request.first_index as u64 + k % request.index_count();
+        let rng = &mut subject_rng(request.seed, stream);
+
+        let template = match self.source {
+            Source::Generated(gen_menus) => return response(
+                format!("{}{}", request.name, index),
+                alt_count,
+                generated_choices(rng, gen_menus, &request.gen_choices, alt_count),
+            ),
+
+            Source::Copycat(ref templates) => &templates[(k / request.index_count()) as usize],
+            Source::Registered(ref templates) => templates[(k / request.index_count()) as usize],
+        };
+
+        response(
+            format!("{}{}{}", template.name, request.name, index),
+            alt_count,
+            copycat_choices(rng, template, &request.gen_choices, request.preserve_deferrals, alt_count),
+        )
+    }
+}
+
+/// Computes `work(0) .. work(count - 1)` in parallel, on the current rayon pool,
+/// and emits the results in order, on the calling thread; returns `count`.
+/// After the first error, nothing more is computed or emitted and the error is returned.
+pub fn parallel_map<T, E, W, F>(count : u32, work : W, mut emit : F) -> result::Result<u32, E>
+    where T : Send, E : Send, W : Fn(u32) -> result::Result<T, E> + Sync, F : FnMut(u32, T)
+{
+    // In waves, so that the workers don't run far ahead of the output.
+    // The calling thread takes part in every wave and may be the only worker of the pool.
+    let wave_size = 4 * rayon::current_num_threads() as u32;
+    for start in (0 .. count).step_by(wave_size as usize) {
+        let end = count.min(start + wave_size);
+        let results : Vec<result::Result<T, E>> = (start .. end).into_par_iter().map(&work).collect();
+        for (i, result) in (start .. end).zip(results) {
+            emit(i, result?);
+        }
+    }
+
+    Ok(count)
+}
+
+/// Emits the subjects in chunks, tagged with their indices; returns the number of chunks.
+/// The result does not depend on the number of threads.
+pub fn run_batch<F>(templates : &Templates, request : &BatchRequest, emit : F) -> Result<u32>
+    where F : FnMut(u32, Vec<Response>)
+{
+    let generator = BatchGenerator::new(templates, request)?;
+    let subject_count = generator.subject_count();
+    let chunk_count = subject_count.div_ceil(CHUNK_SIZE as u64) as u32;
+
+    parallel_map(chunk_count, |i| {
+        let start = i as u64 * CHUNK_SIZE as u64;
+        let end = subject_count.min(start + CHUNK_SIZE as u64);
+        let chunk = (start .. end).map(|k| generator.generate(k, request.first_stream + k));
+        Ok(chunk.collect::<Vec<Response>>())
+    }, emit)
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use std::collections::BTreeMap;
+
+    fn batch_request(subjects : BatchSubjects, last_index : u32) -> BatchRequest {
+        BatchRequest {
+            name: String::from("random"),
+            alternatives: vec![String::from("a"), String::from("b"), String::from("c")],
+            subjects,
+            gen_choices: GenChoices::Uniform {
+                forced_choice: true,
+                multiple_choice: false,
+            },
+            preserve_deferrals: false,
+            first_index: 1,
+            last_index,
+            seed: 0,
+            first_stream: 0,
+        }
+    }
+
+    fn responses(templates : &Templates, request : &BatchRequest) -> Vec<Response> {
+        let mut chunks = BTreeMap::new();
+        let chunk_count = run_batch(templates, request, |i, chunk| {
+            assert!(chunk.len() <= CHUNK_SIZE);
+            assert!(chunks.insert(i, chunk).is_none());
+        }).ok().unwrap();
+
+        assert_eq!(chunks.keys().cloned().collect::<Vec<u32>>(), Vec::from_iter(0..chunk_count));
+        chunks.into_values().flatten().collect()
+    }
+
+    fn names(templates : &Templates, request : &BatchRequest) -> Vec<String> {
+        responses(templates, request).into_iter().map(|response| {
+            assert_eq!(response.observation_count, 7);  // exhaustive on 3 alternatives
+            response.subject.unpack().name.clone()
+        }).collect()
+    }
+
+    fn encoded(responses : &[Response]) -> Vec<Vec<u8>> {
+        responses.iter().map(|r| codec::encode_to_memory(r).ok().unwrap()).collect()
+    }
+
+    #[test]
+    fn generated() {
+        let request = batch_request(BatchSubjects::Generated(GenMenus {
+            generator: MenuGenerator::Exhaustive,
+            defaults: false,
+        }), CHUNK_SIZE as u32 + 1);
+
+        let names = names(&Templates::new(), &request);
+        assert_eq!(names.len(), CHUNK_SIZE + 1);
+        assert_eq!(names[0], "random1");
+        assert_eq!(names[CHUNK_SIZE], format!("random{}", CHUNK_SIZE + 1));
+    }
+
+    #[test]
+    fn copycat() {
+        let template = |name : &str| Packed(Subject {
+            name: String::from(name),
+            alternatives: Alternatives::All(3),
+            choices: AltSet::powerset(3).map(|menu| ChoiceRow {
+                menu,
+                default: None,
+                choice: AltSet::empty(),
+            }).collect(),
+        });
+
+        let no_templates = Templates::new();
+        let request = batch_request(BatchSubjects::Copycat(vec![template("x"), template("y")]), 2);
+        assert_eq!(names(&no_templates, &request), vec!["xrandom1", "xrandom2", "yrandom1", "yrandom2"]);
+        assert!(names(&no_templates, &batch_request(BatchSubjects::Copycat(vec![]), 2)).is_empty());
+
+        let mut templates = Templates::new();
+        assert_eq!(templates.register(vec![template("x")]).ok(), Some(0));
+        assert_eq!(templates.register(vec![template("y"), template("z")]).ok(), Some(1));
+        let request = batch_request(BatchSubjects::Registered(vec![2, 0]), 1);
+        assert_eq!(names(&templates, &request), vec!["zrandom1", "xrandom1"]);
+
+        let request = batch_request(BatchSubjects::Registered(vec![0, 3]), 1);
+        assert!(run_batch(&templates, &request, |_, _| panic!()).is_err());
+
+        templates.clear();
+        assert!(run_batch(&templates, &batch_request(BatchSubjects::Registered(vec![0]), 1), |_, _| panic!()).is_err());
+        assert_eq!(templates.register(vec![template("w")]).ok(), Some(0));
+        assert_eq!(names(&templates, &batch_request(BatchSubjects::Registered(vec![0]), 1)), vec!["wrandom1"]);
+    }
+
+    #[test]
+    fn parallel() {
+        let mut emitted = Vec::new();
+        let result = parallel_map(1000, |i| if i == 500 { Err(i) } else { Ok(i) }, |i, x| {
+            assert_eq!(i, x);
+            emitted.push(i);
+        });
+        assert_eq!(result, Err(500));
+        assert_eq!(emitted, Vec::from_iter(0 .. 500));
+
+        // everything runs on the calling thread if it's the only worker
+        let pool = rayon::ThreadPoolBuilder::new().num_threads(1).build().unwrap();
+        pool.install(|| {
+            let caller = std::thread::current().id();
+            let on_caller = |_| if std::thread::current().id() == caller { Ok(()) } else { Err(()) };
+            assert_eq!(parallel_map(1000, on_caller, |_, _| ()), Ok(1000));
+        });
+    }
+
+    #[test]
+    fn reproducible() {
+        let generated = || BatchSubjects::Generated(GenMenus {
+            generator: MenuGenerator::SampleWithReplacement(5),
+            defaults: false,
+        });
+        let no_templates = Templates::new();
+
+        let mut whole = batch_request(generated(), 2 * CHUNK_SIZE as u32 + 5);
+        whole.seed = 42;
+        let expected = encoded(&responses(&no_templates, &whole));
+
+        // the same on one thread
+        let pool = rayon::ThreadPoolBuilder::new().num_threads(1).build().unwrap();
+        assert_eq!(pool.install(|| {
+            assert_eq!(rayon::current_num_threads(), 1);
+            encoded(&responses(&no_templates, &whole))
+        }), expected);
+
+        // the same in two shards
+        let mut first = batch_request(generated(), 700);
+        first.seed = 42;
+        let mut second = batch_request(generated(), whole.last_index);
+        second.seed = 42;
+        second.first_index = 701;
+        second.first_stream = 700;
+
+        let mut sharded = encoded(&responses(&no_templates, &first));
+        sharded.extend(encoded(&responses(&no_templates, &second)));
+        assert_eq!(sharded, expected);
+
+        // but not with another seed
+        whole.seed = 43;
+        assert_ne!(encoded(&responses(&no_templates, &whole)), expected);
+    }
+}